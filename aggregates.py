@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""Agrégats journaliers par dimension (table daily_aggregates), alimentés pendant le traitement."""
+from config import EFFICACITE_UNITES
+from database import db, DailyAggregate
+from sketches import QuantileSketch, HyperLogLog
+
+# Dimensions agrégées ('' = tous relevés du jour)
+AGGREGATE_DIMS = ('', 'parc', 'personne', 'produit', 'cuve')
+
+
+def _dim_values(row):
+    return (
+        ('', ''),
+        ('parc', str(row.parc or '')),
+        ('personne', str(row.personne or '')),
+        ('produit', str(row.produit or '')),
+        ('cuve', '' if row.cuve_num is None else str(row.cuve_num)),
+    )
+
+
+class DailyAggregateBuilder:
+    """Collecte les agrégats de chaque (jour, dimension, valeur) au fil du traitement, puis les enregistre d'un bloc."""
+
+    def __init__(self):
+        self.cells = {}
+
+    def add(self, row, km=None, efficacite_unite=None):
+        """
+        row : relevé RawData ; km : écart de compteur depuis le relevé normal précédent (None si non mesurable) ;
+        efficacite_unite : 'km' ou 'h' si l'intervalle compte dans l'efficacité (quantité et écart cumulés par unité).
+        """
+        jour = row.date_heure.date()
+        parc_hash = HyperLogLog.hash_value(row.parc) if row.parc else None
+        personne_hash = HyperLogLog.hash_value(row.personne) if row.personne else None
+        for dim, valeur in _dim_values(row):
+            key = (jour, dim, valeur)
+            cell = self.cells.get(key)
+            if cell is None:
+                cell = self.cells[key] = [
+                    0, QuantileSketch(), QuantileSketch(), HyperLogLog(), HyperLogLog(), 0.0, 0.0, 0.0, 0.0,
+                ]
+            cell[0] += 1
+            cell[1].add(row.quantite)
+            if km is not None:
+                cell[2].add(km)
+            if parc_hash is not None:
+                cell[3].add_hash(parc_hash)
+            if personne_hash is not None:
+                cell[4].add_hash(personne_hash)
+            if efficacite_unite is not None:
+                i = 5 if efficacite_unite == 'km' else 7
+                cell[i] += row.quantite
+                cell[i + 1] += km / EFFICACITE_UNITES[efficacite_unite][0]
+
+    def save(self):
+        """Remplace le contenu de daily_aggregates (sans commit)."""
+        DailyAggregate.query.delete()
+        db.session.bulk_insert_mappings(DailyAggregate, [
+            {
+                'jour': jour,
+                'dim': dim,
+                'valeur': valeur,
+                'nb_releves': nb,
+                'quantite_sketch': q_sketch.to_json(),
+                'km_sketch': km_sketch.to_json() if km_sketch.count else None,
+                'parcs_hll': parcs_hll.to_json(),
+                'personnes_hll': personnes_hll.to_json(),
+                'efficacite_quantite': eff_quantite,
+                'efficacite_compteur': eff_compteur,
+                'efficacite_h_quantite': eff_h_quantite,
+                'efficacite_h_compteur': eff_h_compteur,
+            }
+            for (jour, dim, valeur), (nb, q_sketch, km_sketch, parcs_hll, personnes_hll,
+                                      eff_quantite, eff_compteur, eff_h_quantite, eff_h_compteur)
+            in self.cells.items()
+        ])
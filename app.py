@@ -6,20 +6,27 @@ Lancer avec : py app.py
 import io
 import json
 import os
+from concurrent.futures import TimeoutError as FuturesTimeout
 from datetime import datetime, timedelta
-from functools import wraps
-from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session
+from functools import partial, wraps
+from flask import Flask, render_template, request, redirect, url_for, flash, send_file, jsonify, session, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from werkzeug.utils import secure_filename
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from config import UPLOAD_FOLDER, CUVE_LABELS, STOCK_ROULANT_CUVE_IDS
-from database import init_db, db, RawData, ProcessedData, Anomalie, HistoryPeriod, User, UserFilter, SavedIndicator, AnomalieTypeConfig, UserAnomalieConfig, CamionCuve, Famille, MachineFamille, CP30Data, get_user_anomalie_configs, get_jump_threshold, set_jump_threshold, get_compteur_zero_excluded_products, set_compteur_zero_excluded_products, get_camion_cuve_seuil_litres, set_camion_cuve_seuil_litres
+from config import UPLOAD_FOLDER, CUVE_LABELS, STOCK_ROULANT_CUVE_IDS, REPORT_SYNC_WAIT, format_cuve_label
+from database import init_db, db, RawData, ProcessedData, Anomalie, DailyAggregate, HistoryPeriod, User, UserFilter, SavedIndicator, AnomalieTypeConfig, UserAnomalieConfig, CamionCuve, Famille, MachineFamille, CP30Data, get_user_anomalie_configs, get_jump_threshold, set_jump_threshold, get_compteur_zero_excluded_products, set_compteur_zero_excluded_products, get_camion_cuve_seuil_litres, set_camion_cuve_seuil_litres, get_data_version, bump_data_version, get_user_anomalie_config_hash, request_memo, touch_settings
 from excel_importer import import_excel
+from consumption import refresh_quantite_conso
+from dimensions import collect_dimension_values, rebuild_dimensions, clear_dimensions
 from cp30_importer import import_cp30_excel
 from processor import process_all_machines
-from reports import get_stats, get_consumption_by_machine, get_consumption_by_person, get_anomalies_detail, get_date_range, generate_pdf, generate_excel, get_all_machines_for_filter, get_all_personnes_for_filter, get_all_produits_for_filter, get_machine_detail, get_person_detail, get_cuves_summary, get_cuve_detail
-from indicators import get_indicator_data, get_available_values
+from reports import get_stats, get_consumption_by_machine, get_consumption_by_person, get_date_range, generate_pdf, iter_excel_report, XLSX_MIMETYPE, PDF_DECOUPAGES, get_all_machines_for_filter, get_all_personnes_for_filter, get_all_produits_for_filter, get_machine_detail, get_person_detail, get_cuves_summary, get_cuve_detail, get_dashboard_leaderboard, count_dashboard_leaderboard, DASHBOARD_TOP_N, get_anomalies_page, get_anomalies_by_type, get_releves_page, KEYSET_PAGE_SIZE, MAX_KEYSET_PAGE_SIZE, KEYSET_SCOPES
+from indicators import get_indicator_columns, get_indicator_columnar, get_indicator_data_batch, get_available_values, columnar_to_chartjs, iter_ndjson
+from cache import make_cache_key, indicator_cache, values_cache, all_cache_stats
+from exports import EXPORT_DATASETS, EXPORT_FORMATS, iter_csv, write_parquet, parquet_available
+from streaming import iter_written, PositionedChunkPipe
+from report_cache import find_report, get_or_start_report, report_status, stream_into_cache, REPORT_EXTENSIONS
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY') or os.urandom(24).hex()
@@ -36,7 +43,7 @@ login_manager.login_message = 'Connectez-vous pour accéder à cette page.'
 
 @login_manager.user_loader
 def load_user(user_id):
-    return User.query.get(int(user_id))
+    return request_memo(('user', user_id), lambda: db.session.get(User, int(user_id)))
 
 
 def admin_required(f):
@@ -230,9 +237,12 @@ def reset_data():
     try:
         Anomalie.query.delete()
         ProcessedData.query.delete()
+        DailyAggregate.query.delete()
         RawData.query.delete()
         HistoryPeriod.query.delete()
         db.session.commit()
+        clear_dimensions()
+        bump_data_version()
         flash('Données réinitialisées. Vous pouvez réimporter votre fichier Excel (les dates seront correctement interprétées en jj/mm/aaaa).', 'success')
     except Exception as e:
         flash(f'Erreur : {str(e)}', 'error')
@@ -279,7 +289,10 @@ def camion_cuve_ajouter():
         flash('Cette machine est déjà enregistrée comme camion cuve.', 'warning')
         return redirect(url_for('camion_cuve_page'))
     db.session.add(CamionCuve(parc=parc, stock_roulant_num=stock))
+    touch_settings()
     db.session.commit()
+    refresh_quantite_conso(parcs=[parc])
+    bump_data_version()
     flash('Camion cuve enregistré.', 'success')
     return redirect(url_for('camion_cuve_page'))
 
@@ -293,7 +306,10 @@ def camion_cuve_retirer():
     cc = CamionCuve.query.get(parc)
     if cc:
         db.session.delete(cc)
+        touch_settings()
         db.session.commit()
+        refresh_quantite_conso(parcs=[parc])
+        bump_data_version()
         flash('Camion cuve retiré de la liste.', 'success')
     return redirect(url_for('camion_cuve_page'))
 
@@ -340,6 +356,7 @@ def famille_supprimer(fid):
     MachineFamille.query.filter_by(famille_id=f.id).update({MachineFamille.famille_id: None})
     db.session.delete(f)
     db.session.commit()
+    bump_data_version()
     flash('Famille supprimée. Les machines associées sont passées en « sans famille ».', 'success')
     return redirect(url_for('famille_page'))
 
@@ -387,6 +404,7 @@ def famille_assigner():
         return redirect(url_for('famille_page'))
     _apply_famille_to_parc(parc, fid)
     db.session.commit()
+    bump_data_version()
     flash('Affectation enregistrée.', 'success')
     return redirect(url_for('famille_page'))
 
@@ -406,6 +424,7 @@ def famille_assigner_groupe():
     for parc in parcs:
         _apply_famille_to_parc(parc, fid)
     db.session.commit()
+    bump_data_version()
     flash(f'{len(parcs)} machine(s) affectée(s).', 'success')
     return redirect(url_for('famille_page'))
 
@@ -499,7 +518,127 @@ def index():
         date_to_str=uf.date_to_str if uf else '',
         has_filter=has_filter,
         can_import=can_import,
-        cuves_summary=cuves_summary)
+        cuves_summary=cuves_summary,
+        dashboard_top_n=DASHBOARD_TOP_N)
+
+
+MAX_LEADERBOARD_PAGE = 100
+
+
+@app.route('/api/classement/<dimension>')
+@login_required
+def api_classement(dimension):
+    """
+    Page d'un classement du tableau de bord (parc | personne | cuve), tri par quantité totale.
+    Applique le filtre d'affichage enregistré de l'utilisateur (machines / personnes).
+    """
+    if dimension not in ('parc', 'personne', 'cuve'):
+        return jsonify({'error': f'Classement inconnu : {dimension}'}), 404
+    try:
+        page = max(1, int(request.args.get('page') or 1))
+        per_page = min(MAX_LEADERBOARD_PAGE, max(1, int(request.args.get('per_page') or 20)))
+    except ValueError:
+        return jsonify({'error': 'Paramètres de pagination invalides'}), 400
+    display_filter = None
+    uf = UserFilter.query.get(current_user.id)
+    if uf and dimension != 'cuve':
+        try:
+            display_filter = json.loads((uf.machines_json if dimension == 'parc' else uf.personnes_json) or '[]')
+        except (json.JSONDecodeError, TypeError):
+            display_filter = None
+    rows = get_dashboard_leaderboard(dimension, display_filter, limit=per_page, offset=(page - 1) * per_page)
+    total = count_dashboard_leaderboard(dimension, display_filter)
+    items = []
+    for r in rows:
+        if dimension == 'parc':
+            valeur, label, url = r.parc, r.parc, url_for('machine_detail', parc=r.parc)
+        elif dimension == 'personne':
+            valeur, label, url = r.personne, r.personne, url_for('personne_detail', nom=r.personne)
+        else:
+            valeur, label = r.cuve, format_cuve_label(r.cuve)
+            url = url_for('cuve_detail', cuve='sans' if r.cuve is None else r.cuve)
+        items.append({
+            'valeur': valeur,
+            'label': label,
+            'total': round(r.total, 2),
+            'nb': r.nb,
+            'last_seen': r.last_seen.isoformat() if r.last_seen else None,
+            'url': url,
+        })
+    return jsonify({
+        'items': items,
+        'page': page,
+        'per_page': per_page,
+        'total': total,
+        'has_more': page * per_page < total,
+    })
+
+
+def _parse_keyset_args():
+    """
+    Paramètres communs des tableaux paginés : scope, value, date_from, date_to, cursor, limit.
+    value vaut le n° de cuve (int ou None pour « sans ») quand scope = cuve. Lève ValueError si invalides.
+    """
+    scope = request.args.get('scope') or None
+    if scope is not None and scope not in KEYSET_SCOPES:
+        raise ValueError(f'Périmètre inconnu : {scope}')
+    value = request.args.get('value', '')
+    if scope == 'cuve':
+        value = None if value.strip().lower() in ('sans', 'none', 'null', 'vide', '') else int(value)
+    df = request.args.get('date_from', '')
+    dt = request.args.get('date_to', '')
+    date_from = datetime.strptime(df, '%Y-%m-%d').date() if df else None
+    date_to = datetime.strptime(dt, '%Y-%m-%d').date() if dt else None
+    limit = min(MAX_KEYSET_PAGE_SIZE, max(1, int(request.args.get('limit') or KEYSET_PAGE_SIZE)))
+    return scope, value, date_from, date_to, request.args.get('cursor') or None, limit
+
+
+def _json_value(v):
+    return v.isoformat() if hasattr(v, 'isoformat') else v
+
+
+@app.route('/api/anomalies')
+@login_required
+def api_anomalies():
+    """
+    Page d'anomalies pour les tableaux à défilement infini (/rapports, pages détail), filtrées selon la config user.
+    ?scope=machine|personne|cuve&value=…&date_from=…&date_to=…&cursor=…&limit=… ; scope absent = toutes.
+    Réponse : items (plus récentes d'abord) et next_cursor (null en fin de liste).
+    """
+    try:
+        scope, value, date_from, date_to, cursor, limit = _parse_keyset_args()
+    except ValueError as e:
+        return jsonify({'error': f'Paramètres invalides : {e}'}), 400
+    rows, next_cursor = get_anomalies_page(scope, value, date_from, date_to, current_user.id, cursor, limit)
+    items = [{
+        'id': a.id,
+        'date': _json_value(a.date),
+        'machine': a.machine,
+        'type_anomalie': a.type_anomalie,
+        'personne': a.personne,
+        'compteur_before': a.compteur_before,
+        'compteur_after': a.compteur_after,
+        'details': a.details,
+    } for a in rows]
+    return jsonify({'items': items, 'next_cursor': next_cursor})
+
+
+@app.route('/api/releves')
+@login_required
+def api_releves():
+    """
+    Page de relevés d'une machine, personne ou cuve (colonnes de sa page détail), plus récents d'abord.
+    ?scope=machine|personne|cuve&value=…&date_from=…&date_to=…&cursor=…&limit=…
+    """
+    try:
+        scope, value, date_from, date_to, cursor, limit = _parse_keyset_args()
+    except ValueError as e:
+        return jsonify({'error': f'Paramètres invalides : {e}'}), 400
+    if scope is None:
+        return jsonify({'error': 'Paramètre scope requis (machine, personne ou cuve)'}), 400
+    rows, next_cursor = get_releves_page(scope, value, date_from, date_to, cursor, limit)
+    items = [{k: _json_value(v) for k, v in r._mapping.items()} for r in rows]
+    return jsonify({'items': items, 'next_cursor': next_cursor})
 
 
 def _do_import(filepath, filename):
@@ -641,12 +780,21 @@ def supprimer_import(import_id):
         db.session.commit()
         return redirect(url_for('gestion_imports'))
     try:
-        raw_ids = [r.id for r in RawData.query.filter_by(history_period_id=import_id).with_entities(RawData.id).all()]
+        # bornes de l'import : seules les partitions mensuelles concernées sont lues (PostgreSQL)
+        import_rows = RawData.query.filter(
+            RawData.history_period_id == import_id,
+            RawData.date_heure >= datetime.combine(hp.date_min, datetime.min.time()),
+            RawData.date_heure <= datetime.combine(hp.date_max, datetime.max.time()),
+        )
+        touched_values = collect_dimension_values(import_rows)
+        raw_ids = [r.id for r in import_rows.with_entities(RawData.id).all()]
         if raw_ids:
             ProcessedData.query.filter(ProcessedData.raw_data_id.in_(raw_ids)).delete(synchronize_session=False)
-        RawData.query.filter_by(history_period_id=import_id).delete()
+        import_rows.delete(synchronize_session=False)
         db.session.delete(hp)
         db.session.commit()
+        rebuild_dimensions(touched_values)
+        bump_data_version()
         process_all_machines()
         flash(f'Import supprimé ({nb_linked} lignes retirées). Les données du site ont été mises à jour.', 'success')
     except Exception as e:
@@ -880,51 +1028,228 @@ def importer_cp30():
     return redirect(url_for('cp30_page'))
 
 
-@app.route('/api/indicateurs/data')
-@login_required
-def api_indicateurs_data():
-    """API retournant les données agrégées pour le graphique (JSON)."""
-    x_axis = request.args.get('x_axis', 'date')
-    x_date_group = request.args.get('x_date_group', 'mois')
-    serie_dim = request.args.get('serie_dim') or None
-    if serie_dim == '':
-        serie_dim = None
-    
-    y_metrics_raw = request.args.get('y_metrics', 'quantite|sum')
+def _not_modified(cache, etag):
+    """Réponse 304 si le navigateur a déjà cette version (If-None-Match), sinon None."""
+    if not request.if_none_match.contains(etag):
+        return None
+    cache.note_not_modified()
+    return _with_etag(app.response_class(status=304), etag)
+
+
+def _with_etag(resp, etag):
+    resp.set_etag(etag)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+def _cached_json(cache, key, compute, serialize=None):
+    """Réponse JSON servie depuis le cache LRU, avec ETag (304 si le navigateur a déjà cette version)."""
+    resp = _not_modified(cache, key)
+    if resp is not None:
+        return resp
+    value = cache.get_or_compute(key, compute)
+    return _with_etag(jsonify(serialize(value) if serialize else value), key)
+
+
+def _normalize_indicator_config(src):
+    """
+    Paramètres normalisés d'un indicateur, depuis request.args ou une config enregistrée.
+    y_metrics : 'metric|agg;metric|agg' ou liste de {'metric', 'agg'} ; serie_filter : 'a,b' ou liste.
+    """
+    x_axis = src.get('x_axis') or 'date'
+    x_date_group = src.get('x_date_group') or 'mois'
+    serie_dim = src.get('serie_dim') or None
+
+    y_raw = src.get('y_metrics') or 'quantite|sum'
     y_metrics = []
-    for part in y_metrics_raw.split(';'):
-        part = part.strip()
-        if not part:
-            continue
-        sp = part.split('|')
-        if len(sp) >= 2:
-            y_metrics.append({'metric': sp[0], 'agg': sp[1]})
-        else:
-            y_metrics.append({'metric': 'quantite', 'agg': 'sum'})
+    if isinstance(y_raw, str):
+        for part in y_raw.split(';'):
+            part = part.strip()
+            if not part:
+                continue
+            sp = part.split('|')
+            if len(sp) >= 2:
+                y_metrics.append({'metric': sp[0], 'agg': sp[1]})
+            else:
+                y_metrics.append({'metric': 'quantite', 'agg': 'sum'})
+    else:
+        for m in y_raw:
+            if isinstance(m, dict):
+                y_metrics.append({'metric': m.get('metric') or 'quantite', 'agg': m.get('agg') or 'sum'})
     if not y_metrics:
         y_metrics = [{'metric': 'quantite', 'agg': 'sum'}]
-    
-    date_from = date_to = None
-    try:
-        df = request.args.get('date_from', '')
-        dt = request.args.get('date_to', '')
-        if df:
-            date_from = datetime.strptime(df, '%Y-%m-%d').date()
-        if dt:
-            date_to = datetime.strptime(dt, '%Y-%m-%d').date()
-    except ValueError:
-        pass
-    
-    serie_filter_raw = request.args.get('serie_filter', '')  # machines, produits, personnes à inclure (séparés par virgule)
-    serie_filter = [v.strip() for v in serie_filter_raw.split(',') if v.strip()] if serie_filter_raw else None
-    
+
+    serie_filter_raw = src.get('serie_filter') or ''  # machines, produits, personnes à inclure (séparés par virgule)
+    if isinstance(serie_filter_raw, str):
+        serie_filter = [v.strip() for v in serie_filter_raw.split(',') if v.strip()]
+    else:
+        serie_filter = [str(v).strip() for v in serie_filter_raw if str(v).strip()]
+
+    def _positive_int(name):
+        try:
+            v = int(src.get(name) or 0)
+        except (ValueError, TypeError):
+            return None
+        return v if v > 0 else None
+
+    return {
+        'x_axis': x_axis,
+        'x_date_group': x_date_group,
+        'y_metrics': y_metrics,
+        'serie_dim': serie_dim,
+        'date_from': _parse_date(src.get('date_from')),
+        'date_to': _parse_date(src.get('date_to')),
+        'serie_filter': serie_filter or None,
+        'top_n': _positive_int('top_n') if serie_dim else None,
+        'max_points': _positive_int('max_points') if x_axis == 'date' else None,
+    }
+
+
+def _indicator_cache_key(params, anomalie_config_hash, data_version):
+    """Clé de cache / ETag d'un indicateur : paramètres normalisés, config anomalies (si utile), version des données."""
+    uses_anomalies = any(m['metric'] == 'nb_anomalies' for m in params['y_metrics'])
+    return make_cache_key(
+        'data',
+        dict(params,
+             x_date_group=params['x_date_group'] if params['x_axis'] == 'date' else None,
+             serie_filter=sorted(params['serie_filter']) if params['serie_filter'] else None),
+        anomalie_config_hash if uses_anomalies else '',
+        data_version,
+    )
+
+
+INDICATOR_FORMATS = ('json', 'columnar', 'ndjson')
+
+
+def _indicator_args(params):
+    return (params['x_axis'], params['x_date_group'], params['y_metrics'], params['serie_dim'],
+            params['date_from'], params['date_to'], params['serie_filter'])
+
+
+@app.route('/api/indicateurs/data')
+@login_required
+def api_indicateurs_data():
+    """
+    API retournant les données agrégées pour le graphique.
+    format=json (Chart.js, défaut) | columnar (abscisses et métadonnées une seule fois) | ndjson (une ligne par série, en flux).
+    """
+    fmt = (request.args.get('format') or 'json').lower()
+    if fmt not in INDICATOR_FORMATS:
+        return jsonify({'error': f'Format inconnu : {fmt}'}), 400
+    params = _normalize_indicator_config(request.args)
+    user_id = current_user.id if current_user.is_authenticated else None
+    key = _indicator_cache_key(params, get_user_anomalie_config_hash(user_id), get_data_version())
+    etag = key if fmt == 'json' else f'{key}-{fmt}'
+    resp = _not_modified(indicator_cache, etag)
+    if resp is not None:
+        return resp
     try:
-        data = get_indicator_data(x_axis, x_date_group, y_metrics, serie_dim, date_from, date_to, serie_filter, current_user.id if current_user.is_authenticated else None)
-        return jsonify(data)
+        found, col = indicator_cache.get(key)
+        if fmt == 'ndjson':
+            if found:
+                series = ((meta['label'], meta['color'], data) for meta, data in zip(col['series'], col['values']))
+                labels = col['labels']
+            else:
+                labels, series = get_indicator_columns(
+                    *_indicator_args(params), user_id, top_n=params['top_n'], max_points=params['max_points'])
+                series = _tee_into_cache(indicator_cache, key, labels, series)
+            resp = app.response_class(iter_ndjson(labels, series), mimetype='application/x-ndjson')
+            return _with_etag(resp, etag)
+        if not found:
+            col = get_indicator_columnar(
+                *_indicator_args(params), user_id, top_n=params['top_n'], max_points=params['max_points'])
+            indicator_cache.set(key, col)
+        return _with_etag(jsonify(col if fmt == 'columnar' else columnar_to_chartjs(col)), etag)
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
 
+def _tee_into_cache(cache, key, labels, series):
+    """Relaie les séries produites en flux et met le résultat complet en cache une fois le flux terminé."""
+    meta, values = [], []
+    for label, color, data in series:
+        meta.append({'label': label, 'color': color})
+        values.append(data)
+        yield label, color, data
+    cache.set(key, {'labels': labels, 'series': meta, 'values': values})
+
+
+MAX_BATCH_INDICATORS = 50
+
+
+@app.route('/api/indicateurs/batch', methods=['POST'])
+@login_required
+def api_indicateurs_batch():
+    """
+    Calcule plusieurs indicateurs en une requête : {"ids": [...]} (indicateurs enregistrés)
+    et/ou {"configs": [...]}. Les configs non en cache sont calculées ensemble en un seul passage sur les données.
+    """
+    payload = request.get_json(silent=True) or {}
+    items = []
+    ids = []
+    for v in payload.get('ids') or []:
+        try:
+            ids.append(int(v))
+        except (ValueError, TypeError):
+            continue
+    if ids:
+        saved = {si.id: si for si in SavedIndicator.query.filter(
+            SavedIndicator.user_id == current_user.id, SavedIndicator.id.in_(ids)).all()}
+        for sid in ids:
+            si = saved.get(sid)
+            if si is None:
+                items.append({'id': sid, 'error': 'Indicateur introuvable.'})
+                continue
+            try:
+                cfg = json.loads(si.config_json)
+            except (TypeError, ValueError):
+                items.append({'id': sid, 'name': si.name, 'error': 'Configuration illisible.'})
+                continue
+            items.append({'id': sid, 'name': si.name, 'config': cfg})
+    for cfg in payload.get('configs') or []:
+        if isinstance(cfg, dict):
+            items.append({'config': cfg})
+    if len(items) > MAX_BATCH_INDICATORS:
+        return jsonify({'error': f'{MAX_BATCH_INDICATORS} indicateurs maximum par requête.'}), 400
+
+    user_id = current_user.id
+    anomalie_hash = get_user_anomalie_config_hash(user_id)
+    version = get_data_version()
+    for it in items:
+        if 'config' in it:
+            it['params'] = _normalize_indicator_config(it.pop('config'))
+            it['key'] = _indicator_cache_key(it['params'], anomalie_hash, version)
+
+    etag = make_cache_key('batch', [it.get('key') or it.get('error') for it in items])
+    resp = _not_modified(indicator_cache, etag)
+    if resp is not None:
+        return resp
+
+    missing = []
+    for it in items:
+        if 'key' not in it:
+            continue
+        found, col = indicator_cache.get(it['key'])
+        if found:
+            it['data'] = columnar_to_chartjs(col)
+        else:
+            missing.append(it)
+    if missing:
+        try:
+            computed = get_indicator_data_batch([it['params'] for it in missing], user_id, columnar=True)
+        except Exception as e:
+            return jsonify({'error': str(e)}), 400
+        for it, col in zip(missing, computed):
+            indicator_cache.set(it['key'], col)
+            it['data'] = columnar_to_chartjs(col)
+
+    results = []
+    for it in items:
+        out = {k: it[k] for k in ('id', 'name', 'error', 'data') if k in it}
+        results.append(out)
+    return _with_etag(jsonify({'results': results}), etag)
+
+
 @app.route('/api/indicateurs/values/<dimension>')
 @login_required
 def api_indicateurs_values(dimension):
@@ -939,8 +1264,15 @@ def api_indicateurs_values(dimension):
             date_to = datetime.strptime(request.args.get('date_to'), '%Y-%m-%d').date()
     except ValueError:
         pass
-    values = get_available_values(dimension, date_from, date_to)
-    return jsonify(values)
+    key = make_cache_key('values', dimension, date_from, date_to, get_data_version())
+    return _cached_json(values_cache, key, lambda: get_available_values(dimension, date_from, date_to))
+
+
+@app.route('/api/cache/stats')
+@login_required
+def api_cache_stats():
+    """Compteurs hits / misses des caches de résultats et version courante des données."""
+    return jsonify({'data_version': get_data_version(), 'caches': all_cache_stats()})
 
 
 @app.route('/api/indicateurs/save', methods=['POST'])
@@ -993,7 +1325,15 @@ def machine_detail():
     detail = get_machine_detail(parc, date_from, date_to, current_user.id if current_user.is_authenticated else None)
     detail['by_date_chart'] = [[str(d.dt) if hasattr(d, 'dt') else d[0], float(d.total) if hasattr(d, 'total') else d[1]] for d in (detail.get('by_date') or [])]
     detail['by_personne_chart'] = [[str(p[0]) or '-', float(p[1]) if len(p) > 1 else 0] for p in (detail.get('by_personne') or [])]
-    detail['anomalies_json'] = [{'type_anomalie': a.type_anomalie} for a in (detail.get('anomalies') or [])]
+    detail['anomalies_by_type_chart'] = [[t or 'Autre', n] for t, n in (detail.get('anomalies_by_type') or [])]
+    # Efficacité : une série par unité de compteur (L/100 km, L/h) sur l'axe commun des jours
+    efficacites = detail.get('efficacites') or []
+    eff_jours = sorted({d for _libelle, _valeur, jours in efficacites for d, _v in jours})
+    eff_series = []
+    for libelle, _valeur, jours in efficacites:
+        par_jour = dict(jours)
+        eff_series.append({'label': libelle, 'data': [round(par_jour[d], 2) if d in par_jour else None for d in eff_jours]})
+    detail['efficacite_chart'] = {'labels': [d.isoformat() for d in eff_jours], 'series': eff_series} if eff_series else None
     date_min, date_max = get_date_range()
     def _to_iso(d):
         if d is None:
@@ -1026,7 +1366,7 @@ def personne_detail():
     detail = get_person_detail(nom, date_from, date_to, current_user.id if current_user.is_authenticated else None)
     detail['by_date_chart'] = [[str(d.dt) if hasattr(d, 'dt') else d[0], float(d.total) if hasattr(d, 'total') else d[1]] for d in (detail.get('by_date') or [])]
     detail['by_machine_chart'] = [[str(m[0]) or '-', float(m[1]) if len(m) > 1 else 0] for m in (detail.get('by_machine') or [])]
-    detail['anomalies_json'] = [{'type_anomalie': a.type_anomalie} for a in (detail.get('anomalies') or [])]
+    detail['anomalies_by_type_chart'] = [[t or 'Autre', n] for t, n in (detail.get('anomalies_by_type') or [])]
     date_min, date_max = get_date_range()
     def _to_iso(d):
         if d is None:
@@ -1077,7 +1417,7 @@ def cuve_detail():
     detail['by_parc_chart'] = [[str(p[0]) or '-', float(p[1]) if len(p) > 1 else 0] for p in (detail.get('by_parc') or [])]
     detail['by_personne_chart'] = [[str(p[0]) or '-', float(p[1]) if len(p) > 1 else 0] for p in (detail.get('by_personne') or [])]
     detail['by_produit_chart'] = [[str(p[0]) or '-', float(p[1]) if len(p) > 1 else 0] for p in (detail.get('by_produit') or [])]
-    detail['anomalies_json'] = [{'type_anomalie': a.type_anomalie} for a in (detail.get('anomalies') or [])]
+    detail['anomalies_by_type_chart'] = [[t or 'Autre', n] for t, n in (detail.get('anomalies_by_type') or [])]
     date_min, date_max = get_date_range()
 
     def _to_iso(d):
@@ -1134,9 +1474,12 @@ def rapports():
     date_to_display = _fmt_display(date_to_s) if date_to_s else ''
     machines = get_consumption_by_machine(date_from, date_to)
     personnes = get_consumption_by_person(date_from, date_to)
-    anomalies = get_anomalies_detail(date_from, date_to, current_user.id if current_user.is_authenticated else None)
+    user_id = current_user.id if current_user.is_authenticated else None
+    anomalies, anomalies_cursor = get_anomalies_page(None, None, date_from, date_to, user_id)
+    nb_anomalies = sum(n for _t, n in get_anomalies_by_type(None, None, date_from, date_to, user_id))
     return render_template('rapports.html',
         machines=machines, personnes=personnes, anomalies=anomalies,
+        anomalies_cursor=anomalies_cursor, nb_anomalies=nb_anomalies,
         date_from=date_from_s, date_to=date_to_s,
         date_from_display=date_from_display, date_to_display=date_to_display,
         date_min_str=date_min_str, date_max_str=date_max_str,
@@ -1146,7 +1489,7 @@ def rapports():
 @app.route('/download/<format>')
 @login_required
 def download_report(format):
-    """Télécharge le rapport PDF ou Excel (avec filtre dates si fourni)."""
+    """Télécharge le rapport PDF ou Excel (avec filtre dates si fourni ; PDF : ?decoupage=machine|site)."""
     if format not in ('pdf', 'excel'):
         flash('Format non valide.', 'error')
         return redirect(url_for('rapports'))
@@ -1162,18 +1505,86 @@ def download_report(format):
     except ValueError:
         pass
     
+    user_id = current_user.id if current_user.is_authenticated else None
+    decoupage = request.args.get('decoupage') if format == 'pdf' else None
+    if decoupage not in PDF_DECOUPAGES:
+        decoupage = None
+    download_name = _report_download_name(format, date_from, date_to, decoupage)
     try:
-        if format == 'pdf':
-            filepath = generate_pdf(date_from, date_to, current_user.id if current_user.is_authenticated else None)
-        else:
-            filepath = generate_excel(date_from, date_to, current_user.id if current_user.is_authenticated else None)
-        
-        return send_file(filepath, as_attachment=True, download_name=os.path.basename(filepath))
+        if format == 'excel':
+            # Excel : envoyé au fil de l'écriture (et mis en cache au passage) plutôt que généré en tâche de fond
+            key, filepath = find_report(app, format, date_from, date_to, user_id)
+            if filepath is None:
+                resp = app.response_class(
+                    stream_into_cache(app, format, key, iter_excel_report(date_from, date_to, user_id)),
+                    mimetype=XLSX_MIMETYPE)
+                resp.headers['Content-Disposition'] = f'attachment; filename={download_name}'
+                return resp
+            return send_file(filepath, as_attachment=True, download_name=download_name)
+        key, filepath, future = get_or_start_report(
+            app, format, partial(generate_pdf, decoupage=decoupage), date_from, date_to, user_id, variant=decoupage)
+        if filepath is None:
+            try:
+                filepath = future.result(timeout=REPORT_SYNC_WAIT)
+            except FuturesTimeout:
+                return render_template('rapport_attente.html', key=key, format=format,
+                                       download_url=request.full_path)
+        return send_file(filepath, as_attachment=True, download_name=download_name)
     except Exception as e:
         flash(f'Erreur génération rapport : {str(e)}', 'error')
         return redirect(url_for('rapports'))
 
 
+def _report_download_name(format, date_from=None, date_to=None, decoupage=None):
+    """Nom proposé au téléchargement (le fichier en cache porte sa clé)."""
+    periode = ''
+    if date_from or date_to:
+        periode = f"_{date_from.strftime('%Y%m%d') if date_from else 'debut'}-{date_to.strftime('%Y%m%d') if date_to else 'fin'}"
+    suffixe = f"_par_{decoupage}" if decoupage else ''
+    return f"rapport_madic{periode}{suffixe}.{REPORT_EXTENSIONS[format]}"
+
+
+@app.route('/api/rapport/<key>')
+@login_required
+def api_rapport_status(key):
+    """État de la génération d'un rapport en tâche de fond (page d'attente)."""
+    status, error = report_status(key)
+    return jsonify({'status': status, 'error': error})
+
+
+@app.route('/export/<dataset>.<fmt>')
+@login_required
+def export_data(dataset, fmt):
+    """
+    Export brut en flux : /export/raw.csv, /export/raw.parquet, /export/anomalies.csv, /export/anomalies.parquet.
+    Filtres : date_from, date_to (AAAA-MM-JJ), machine et personne (répétables ou séparés par des virgules).
+    """
+    if dataset not in EXPORT_DATASETS or fmt not in EXPORT_FORMATS:
+        return jsonify({'error': f'Export inconnu : {dataset}.{fmt}'}), 404
+    try:
+        df = request.args.get('date_from', '')
+        dt = request.args.get('date_to', '')
+        date_from = datetime.strptime(df, '%Y-%m-%d').date() if df else None
+        date_to = datetime.strptime(dt, '%Y-%m-%d').date() if dt else None
+    except ValueError:
+        return jsonify({'error': 'Dates invalides (format AAAA-MM-JJ)'}), 400
+    machines = [v.strip() for raw in request.args.getlist('machine') for v in raw.split(',') if v.strip()]
+    personnes = [v.strip() for raw in request.args.getlist('personne') for v in raw.split(',') if v.strip()]
+    filters = (date_from, date_to, machines, personnes)
+    if fmt == 'csv':
+        resp = app.response_class(stream_with_context(
+            chunk.encode('utf-8') for chunk in iter_csv(dataset, *filters)), mimetype='text/csv; charset=utf-8')
+    else:
+        if not parquet_available():
+            return jsonify({'error': 'Export Parquet indisponible : installer pyarrow'}), 501
+        resp = app.response_class(
+            iter_written(app, lambda out: write_parquet(out, dataset, *filters),
+                         name='export-parquet', pipe_class=PositionedChunkPipe),
+            mimetype='application/vnd.apache.parquet')
+    resp.headers['Content-Disposition'] = f'attachment; filename=madic_{dataset}.{fmt}'
+    return resp
+
+
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
     debug = os.environ.get('FLASK_DEBUG', '1') == '1'
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Cache de résultats en mémoire (LRU) indexé par version des données."""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+
+def make_cache_key(*parts):
+    """Clé stable (sha1) à partir de paramètres normalisés (dicts triés, dates en ISO)."""
+    raw = json.dumps(parts, sort_keys=True, default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """Cache LRU thread-safe avec compteurs hits / misses."""
+
+    def __init__(self, name, maxsize=256):
+        self.name = name
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key):
+        """Retourne (trouvé, valeur) et met l'entrée en tête si présente."""
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return True, self._data[key]
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, compute):
+        """Valeur en cache ou calculée (puis mise en cache)."""
+        found, value = self.get(key)
+        if found:
+            return value
+        value = compute()
+        self.set(key, value)
+        return value
+
+    def note_not_modified(self):
+        """Compte une revalidation client (304) : ni calcul ni lecture du cache."""
+        with self._lock:
+            self.not_modified += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'name': self.name,
+                'size': len(self._data),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': round(self.hits / total, 3) if total else None,
+            }
+
+
+indicator_cache = ResultCache('indicateurs', maxsize=256)
+values_cache = ResultCache('valeurs', maxsize=128)
+stats_cache = ResultCache('tableau_de_bord', maxsize=128)
+chart_cache = ResultCache('graphiques_pdf', maxsize=512)
+
+ALL_CACHES = [indicator_cache, values_cache, stats_cache, chart_cache]
+
+
+def all_cache_stats():
+    """Statistiques de tous les caches de résultats."""
+    return [c.stats() for c in ALL_CACHES]
@@ -16,6 +16,20 @@ if DATABASE_URL:
 DATABASE_PATH = os.path.join(BASE_DIR, 'madic_data.db')
 UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER') or os.path.join(BASE_DIR, 'uploads')
 REPORTS_FOLDER = os.environ.get('REPORTS_FOLDER') or os.path.join(BASE_DIR, 'reports')
+# Taille maximale du dossier des rapports en cache (octets) ; au-delà, les moins récemment utilisés sont supprimés
+REPORTS_MAX_BYTES = int(os.environ.get('REPORTS_MAX_BYTES') or 200 * 1024 * 1024)
+# Attente (secondes) d'un rapport en génération avant d'afficher la page « génération en cours »
+REPORT_SYNC_WAIT = float(os.environ.get('REPORT_SYNC_WAIT') or 3)
+
+# Profil SQLite (base locale / mono-serveur), appliqué à chaque connexion : voir database._sqlite_profile
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 1024 * 1024)  # octets lus par mmap
+SQLITE_CACHE_KIB = int(os.environ.get('SQLITE_CACHE_KIB') or 64 * 1024)  # cache de pages par connexion (Kio)
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS') or 30000)  # attente d'un verrou d'écriture
+SQLITE_OPTIMIZE_INTERVAL = int(os.environ.get('SQLITE_OPTIMIZE_INTERVAL') or 3600)  # s entre deux PRAGMA optimize
+
+# PostgreSQL : partitionnement mensuel de raw_data / anomalies (partitions.py), désactivé par défaut.
+# Avec PG_PARTITIONING=1, les tables sont converties au démarrage suivant puis les mois à venir créés à chaque démarrage.
+PG_PARTITIONING = os.environ.get('PG_PARTITIONING', '') == '1'
 
 # Seuil paramétrable pour la détection du saut de compteur (en km)
 MAX_COUNTER_JUMP = 1000
@@ -64,6 +78,21 @@ def format_cuve_label(cuve_num):
         return str(cuve_num)
     return CUVE_LABELS.get(n, f'Cuve {n}')
 
+
+# Efficacité selon l'unité du compteur (RawData.unite, casse ignorée) :
+# unité → (écart compteur ramené à une unité d'efficacité, libellé) ; 'km' en L/100 km, 'h' en L/h
+EFFICACITE_UNITES = {
+    'km': (100.0, 'L/100 km'),
+    'h': (1.0, 'L/h'),
+}
+
+
+def compteur_unite(unite):
+    """'km' ou 'h' ; None si l'unité est absente ou sans compteur exploitable (ex. 'L')."""
+    u = (unite or '').strip().lower()
+    return u if u in EFFICACITE_UNITES else None
+
+
 # Mots-clés pour identifier les colonnes (matching flexible - contains)
 # Ordre de priorité : le premier match gagne
 COLUMN_KEYWORDS = {
@@ -23,3 +23,42 @@ def effective_quantite_conso_carburant(parc, quantite, cuve_num, camion_parcs, s
     if q <= float(seuil_litres or 0):
         return q
     return 0.0
+
+
+def quantite_conso_sql_expression(parc_col, quantite_col, cuve_col, camion_parcs, seuil_litres):
+    """Expression SQL équivalente à effective_quantite_conso_carburant (calcul en masse)."""
+    from sqlalchemy import case, and_, or_
+    if not camion_parcs:
+        return quantite_col
+    return case(
+        (and_(
+            parc_col.in_(sorted(camion_parcs)),
+            or_(cuve_col.is_(None), cuve_col.notin_(sorted(STOCK_ROULANT_CUVE_IDS))),
+            quantite_col > float(seuil_litres or 0),
+        ), 0.0),
+        else_=quantite_col,
+    )
+
+
+def refresh_quantite_conso(parcs=None, history_period_id=None):
+    """
+    Recalcule en une requête UPDATE la colonne raw_data.quantite_conso.
+    parcs : limite aux parcs concernés (ex. camion cuve ajouté/retiré) ; history_period_id : un import.
+    Retourne le nombre de lignes mises à jour.
+    """
+    from database import db, RawData, get_camion_cuve_parcs_set, get_camion_cuve_seuil_litres
+    from dimensions import dimension_in_condition
+    expr = quantite_conso_sql_expression(
+        RawData.parc, RawData.quantite, RawData.cuve_num,
+        get_camion_cuve_parcs_set(), get_camion_cuve_seuil_litres())
+    q = RawData.query
+    if parcs is not None:
+        parcs = [p for p in parcs if p]
+        if not parcs:
+            return 0
+        q = q.filter(dimension_in_condition(RawData.parc_id, 'parc', parcs))
+    if history_period_id is not None:
+        q = q.filter(RawData.history_period_id == history_period_id)
+    n = q.update({RawData.quantite_conso: expr}, synchronize_session=False)
+    db.session.commit()
+    return n
@@ -1,10 +1,23 @@
 # -*- coding: utf-8 -*-
 """Configuration et modèles de base de données pour MADIC (PostgreSQL / SQLite)."""
+import json
+import logging
 import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
 from datetime import datetime
+from types import MappingProxyType
+from flask import g, has_request_context
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
-from config import DATABASE_URL, DATABASE_PATH, UPLOAD_FOLDER, REPORTS_FOLDER, MAX_COUNTER_JUMP
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from config import (
+    DATABASE_URL, DATABASE_PATH, UPLOAD_FOLDER, REPORTS_FOLDER, MAX_COUNTER_JUMP,
+    SQLITE_MMAP_SIZE, SQLITE_CACHE_KIB, SQLITE_BUSY_TIMEOUT_MS, SQLITE_OPTIMIZE_INTERVAL, PG_PARTITIONING,
+)
 
 # Créer les dossiers si nécessaire
 for folder in [UPLOAD_FOLDER, REPORTS_FOLDER]:
@@ -13,131 +26,203 @@ for folder in [UPLOAD_FOLDER, REPORTS_FOLDER]:
 db = SQLAlchemy()
 
 
+def request_memo(key, compute):
+    """
+    Valeur mémorisée pour la requête HTTP en cours (flask.g) : calculée au premier appel, relue ensuite.
+    Hors requête (traitements de fond, commandes, migrations : contextes applicatifs de longue durée) :
+    calculée à chaque appel, pour ne jamais servir une valeur antérieure à touch_settings.
+    """
+    if not has_request_context():
+        return compute()
+    memo = g.setdefault('_madic_memo', {})
+    if key not in memo:
+        memo[key] = compute()
+    return memo[key]
+
+
+@event.listens_for(Session, 'after_commit')
+def _clear_request_memo(session):
+    """Toute écriture validée peut changer une valeur mémorisée : elles seront relues."""
+    if has_request_context():
+        g.pop('_madic_memo', None)
+
+
+def _table_columns(conn, table):
+    """Colonnes d'une table ; None si elle n'existe pas (créée complète par _upgrade_data)."""
+    from sqlalchemy import inspect
+    inspector = inspect(conn)
+    if not inspector.has_table(table):
+        return None
+    return {c['name'] for c in inspector.get_columns(table)}
+
+
+def _add_columns(table, columns):
+    """Ajoute à une table existante les colonnes absentes ((nom, type SQL), ...) ; True si au moins une l'a été."""
+    from sqlalchemy import text
+    with db.engine.begin() as conn:
+        existing = _table_columns(conn, table)
+        if existing is None:
+            return False
+        missing = [(name, ddl) for name, ddl in columns if name not in existing]
+        for name, ddl in missing:
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+    return bool(missing)
+
+
+def _execute_on_table(table, *statements):
+    """Exécute des requêtes SQL fixes si la table existe."""
+    from sqlalchemy import text
+    with db.engine.begin() as conn:
+        if _table_columns(conn, table) is not None:
+            for statement in statements:
+                conn.execute(text(statement))
+
+
+def _drop_indexes(table, names):
+    """Supprime les index remplacés (ils sont recréés sous leur forme actuelle par _upgrade_data)."""
+    from sqlalchemy import inspect, text
+    with db.engine.begin() as conn:
+        inspector = inspect(conn)
+        if not inspector.has_table(table):
+            return
+        existing = {ix['name'] for ix in inspector.get_indexes(table)}
+        for name in names:
+            if name in existing:
+                conn.execute(text(f"DROP INDEX {name}"))
+
+
+def _migrate_add_history_period_id(app):
+    """Ajoute la colonne history_period_id à raw_data si elle n'existe pas."""
+    is_sqlite = db.engine.dialect.name == 'sqlite'
+    _add_columns('raw_data', [
+        ('history_period_id', 'INTEGER' if is_sqlite else 'INTEGER REFERENCES history_periods(id)'),
+    ])
+
+
 def _migrate_anomalie_produit(app):
     """Ajoute la colonne produit à anomalies si elle n'existe pas."""
-    from sqlalchemy import text
-    try:
-        with app.app_context():
-            with db.engine.connect() as conn:
-                uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-                if 'sqlite' in uri:
-                    result = conn.execute(text("PRAGMA table_info(anomalies)"))
-                    col_exists = 'produit' in [r[1] for r in result]
-                else:
-                    result = conn.execute(text("""
-                        SELECT 1 FROM information_schema.columns
-                        WHERE table_name='anomalies' AND column_name='produit'
-                    """))
-                    col_exists = result.fetchone() is not None
-                if not col_exists:
-                    if 'sqlite' in uri:
-                        conn.execute(text("ALTER TABLE anomalies ADD COLUMN produit VARCHAR(100)"))
-                    else:
-                        conn.execute(text("ALTER TABLE anomalies ADD COLUMN produit VARCHAR(100)"))
-                    conn.commit()
-    except Exception:
-        pass
+    _add_columns('anomalies', [('produit', 'VARCHAR(100)')])
 
 
-def _migrate_user_anomalie_produits(app):
-    """Ajoute la colonne produits_json à user_anomalie_config si elle n'existe pas."""
-    from sqlalchemy import text
-    try:
-        with app.app_context():
-            with db.engine.connect() as conn:
-                uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-                if 'sqlite' in uri:
-                    result = conn.execute(text("PRAGMA table_info(user_anomalie_config)"))
-                    col_exists = 'produits_json' in [r[1] for r in result]
-                else:
-                    result = conn.execute(text("""
-                        SELECT 1 FROM information_schema.columns
-                        WHERE table_name='user_anomalie_config' AND column_name='produits_json'
-                    """))
-                    col_exists = result.fetchone() is not None
-                if not col_exists:
-                    if 'sqlite' in uri:
-                        conn.execute(text("ALTER TABLE user_anomalie_config ADD COLUMN produits_json TEXT DEFAULT '[]'"))
-                    else:
-                        conn.execute(text("ALTER TABLE user_anomalie_config ADD COLUMN produits_json TEXT DEFAULT '[]'"))
-                    conn.commit()
-    except Exception:
-        pass
+def _migrate_user_filter_dates(app):
+    """Ajoute date_from_str et date_to_str à user_filters si absents."""
+    _add_columns('user_filters', [('date_from_str', 'VARCHAR(10)'), ('date_to_str', 'VARCHAR(10)')])
 
 
 def _migrate_raw_data_cuve(app):
     """Ajoute la colonne cuve_num à raw_data si absente."""
-    from sqlalchemy import text
-    try:
-        with app.app_context():
-            with db.engine.connect() as conn:
-                uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-                if 'sqlite' in uri:
-                    result = conn.execute(text("PRAGMA table_info(raw_data)"))
-                    col_exists = 'cuve_num' in [r[1] for r in result]
-                else:
-                    result = conn.execute(text("""
-                        SELECT 1 FROM information_schema.columns
-                        WHERE table_name='raw_data' AND column_name='cuve_num'
-                    """))
-                    col_exists = result.fetchone() is not None
-                if not col_exists:
-                    conn.execute(text("ALTER TABLE raw_data ADD COLUMN cuve_num INTEGER"))
-                    conn.commit()
-    except Exception:
-        pass
+    _add_columns('raw_data', [('cuve_num', 'INTEGER')])
 
 
-def _migrate_user_filter_dates(app):
-    """Ajoute date_from_str et date_to_str à user_filters si absents."""
-    from sqlalchemy import text
-    for col in ('date_from_str', 'date_to_str'):
-        try:
-            with app.app_context():
-                with db.engine.connect() as conn:
-                    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-                    if 'sqlite' in uri:
-                        result = conn.execute(text("PRAGMA table_info(user_filters)"))
-                        col_exists = col in [r[1] for r in result]
-                    else:
-                        result = conn.execute(text(f"""
-                            SELECT 1 FROM information_schema.columns
-                            WHERE table_name='user_filters' AND column_name='{col}'
-                        """))
-                        col_exists = result.fetchone() is not None
-                    if not col_exists:
-                        conn.execute(text(f"ALTER TABLE user_filters ADD COLUMN {col} VARCHAR(10)"))
-                        conn.commit()
-        except Exception:
-            pass
+def _migrate_user_anomalie_produits(app):
+    """Ajoute la colonne produits_json à user_anomalie_config si elle n'existe pas."""
+    _add_columns('user_anomalie_config', [('produits_json', "TEXT DEFAULT '[]'")])
 
 
-def _migrate_add_history_period_id(app):
-    """Ajoute la colonne history_period_id à raw_data si elle n'existe pas (migration)."""
-    from sqlalchemy import text
-    uri = app.config.get('SQLALCHEMY_DATABASE_URI', '')
-    is_sqlite = 'sqlite' in uri
+def _migrate_raw_data_quantite_conso(app):
+    """Ajoute la colonne quantite_conso à raw_data si absente (calculée par _upgrade_data)."""
+    _add_columns('raw_data', [('quantite_conso', 'FLOAT')])
+
+
+def _migrate_dimension_tables(app):
+    """
+    Ajoute total_quantite aux dictionnaires si absente et vide alors le dictionnaire
+    (reconstruit depuis raw_data par _upgrade_data).
+    """
+    for table in ('dim_parcs', 'dim_personnes', 'dim_produits'):
+        if _add_columns(table, [('total_quantite', 'FLOAT NOT NULL DEFAULT 0')]):
+            _execute_on_table(table, f"DELETE FROM {table}")
+
+
+def _migrate_processed_data_columns(app):
+    """
+    Ajoute km_entre_pleins et efficacite à processed_data si absentes ; les agrégats journaliers sont alors
+    vidés pour que la mise à niveau des données (_upgrade_data) relance le traitement.
+    """
+    if _add_columns('processed_data', [('km_entre_pleins', 'FLOAT'), ('efficacite', 'FLOAT')]):
+        _execute_on_table('daily_aggregates', "DELETE FROM daily_aggregates")
+
+
+def _migrate_daily_aggregates(app):
+    """
+    Ajoute les colonnes de résumés manquantes à daily_aggregates et vide alors la table
+    (agrégats incomplets : recalculés par _upgrade_data).
+    """
+    if _add_columns('daily_aggregates', [
+        ('parcs_hll', 'TEXT'), ('personnes_hll', 'TEXT'),
+        ('efficacite_quantite', 'FLOAT'), ('efficacite_compteur', 'FLOAT'),
+        ('efficacite_h_quantite', 'FLOAT'), ('efficacite_h_compteur', 'FLOAT'),
+    ]):
+        _execute_on_table('daily_aggregates', "DELETE FROM daily_aggregates")
+
+
+def _migrate_anomalie_type_key(app):
+    """
+    Ajoute type_key et threshold à anomalies et les calcule depuis type_anomalie (SQL, sans retraitement) ;
+    l'index (date, type_anomalie, produit) est supprimé, celui sur type_key créé par _upgrade_data.
+    Les codes sont ceux de ANOMALIE_TYPE_CODES à la création de l'étape, figés ici.
+    """
+    _add_columns('anomalies', [('type_key', 'SMALLINT'), ('threshold', 'INTEGER')])
+    _execute_on_table('anomalies', """
+        UPDATE anomalies SET
+            type_key = CASE
+                WHEN type_anomalie = 'Zero quantity' THEN 1
+                WHEN type_anomalie = 'Compteur decreased' THEN 2
+                WHEN type_anomalie LIKE 'Jump >%' THEN 3
+                WHEN type_anomalie = 'Compteur zero' THEN 4
+                WHEN type_anomalie = 'Compteur identique malgré plein' THEN 5
+            END,
+            threshold = CASE WHEN type_anomalie LIKE 'Jump >%' THEN CAST(SUBSTR(type_anomalie, 7) AS INTEGER) END
+        WHERE type_key IS NULL
+    """)
+    _drop_indexes('anomalies', ('ix_anomalies_date_type_produit',))
+
+
+def _migrate_dimension_ids(app):
+    """
+    Ajoute les clés entières de dimensions (parc_id, personne_id, produit_id ; machine_id pour les anomalies)
+    et supprime les index texte (parc / machine, personne) ; les clés sont renseignées et les index entiers
+    créés par _upgrade_data.
+    """
+    _add_columns('raw_data', [('parc_id', 'INTEGER'), ('personne_id', 'INTEGER'), ('produit_id', 'INTEGER')])
+    _add_columns('anomalies', [('machine_id', 'INTEGER'), ('personne_id', 'INTEGER'), ('produit_id', 'INTEGER')])
+    _drop_indexes('raw_data', ('ix_raw_data_parc_date', 'ix_raw_data_personne_date'))
+    _drop_indexes('anomalies', ('ix_anomalies_machine_date', 'ix_anomalies_personne_date'))
+
+
+def _sqlite_profile(dbapi_connection, _record):
+    """
+    Profil appliqué à chaque connexion SQLite : WAL (les lectures ne sont plus bloquées par le traitement
+    ou un import en cours), synchronous=NORMAL (sûr en WAL), mmap et cache de pages élargis, tables
+    temporaires en mémoire, attente d'un verrou plutôt qu'une erreur « database is locked ».
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma in (
+        'journal_mode=WAL',
+        'synchronous=NORMAL',
+        f'mmap_size={SQLITE_MMAP_SIZE}',
+        f'cache_size=-{SQLITE_CACHE_KIB}',
+        'temp_store=MEMORY',
+        f'busy_timeout={SQLITE_BUSY_TIMEOUT_MS}',
+        'analysis_limit=1000',  # borne le coût de PRAGMA optimize sur les grosses tables
+    ):
+        cursor.execute(f'PRAGMA {pragma}')
+    cursor.close()
+
+
+_sqlite_optimized = {'at': time.monotonic()}
+
+
+def _sqlite_optimize(dbapi_connection, _record):
+    """Au retour d'une connexion dans le pool : PRAGMA optimize (statistiques du planificateur) au plus toutes les SQLITE_OPTIMIZE_INTERVAL s."""
+    now = time.monotonic()
+    if now - _sqlite_optimized['at'] < SQLITE_OPTIMIZE_INTERVAL:
+        return
+    _sqlite_optimized['at'] = now
     try:
-        with app.app_context():
-            with db.engine.connect() as conn:
-                col_exists = False
-                if is_sqlite:
-                    result = conn.execute(text("PRAGMA table_info(raw_data)"))
-                    col_exists = 'history_period_id' in [r[1] for r in result]
-                else:
-                    result = conn.execute(text("""
-                        SELECT 1 FROM information_schema.columns 
-                        WHERE table_name='raw_data' AND column_name='history_period_id'
-                    """))
-                    col_exists = result.fetchone() is not None
-                if not col_exists:
-                    if is_sqlite:
-                        conn.execute(text("ALTER TABLE raw_data ADD COLUMN history_period_id INTEGER"))
-                    else:
-                        conn.execute(text("ALTER TABLE raw_data ADD COLUMN history_period_id INTEGER REFERENCES history_periods(id)"))
-                    conn.commit()
+        dbapi_connection.execute('PRAGMA optimize')
     except Exception:
-        pass
+        logging.getLogger(__name__).warning("PRAGMA optimize en échec", exc_info=True)
 
 
 def init_db(app):
@@ -156,16 +241,171 @@ def init_db(app):
     app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
     app.config['REPORTS_FOLDER'] = REPORTS_FOLDER
     db.init_app(app)
-    
+
     with app.app_context():
-        db.create_all()
-        _migrate_add_history_period_id(app)
-        _migrate_anomalie_produit(app)
-        _migrate_user_filter_dates(app)
-        _migrate_raw_data_cuve(app)
-        _migrate_user_anomalie_produits(app)
-        _ensure_admin_user()
-        _ensure_anomalie_type_config()
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', _sqlite_profile)
+            event.listen(db.engine, 'checkin', _sqlite_optimize)
+        if get_schema_version() < SCHEMA_VERSION:
+            run_migrations(app)
+        if PG_PARTITIONING and db.engine.dialect.name == 'postgresql':
+            from partitions import partition_tables
+            with _migration_lock(app):
+                partition_tables()  # conversion à la première activation, puis mois à venir
+
+
+def _seed_defaults():
+    _ensure_admin_user()
+    _ensure_anomalie_type_config()
+    _ensure_data_version()
+
+
+def _upgrade_data(app):
+    """
+    Dernière étape, jouée une seule fois après les étapes numérotées et donc sur le schéma final :
+    tables et index déclarés manquants (base neuve : schéma complet ; ANALYZE sous SQLite), valeurs par défaut,
+    puis, si des relevés existent, dictionnaires et clés de dimensions,
+    quantite_conso et retraitement complet (processed_data, anomalies, agrégats journaliers).
+    Ne refait que ce qui manque.
+    """
+    from sqlalchemy import inspect, text
+    db.create_all()
+    inspector = inspect(db.engine)
+    created = False
+    for table in db.metadata.sorted_tables:
+        existing = {ix['name'] for ix in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                created = True
+    if created and db.engine.dialect.name == 'sqlite':
+        with db.engine.connect() as conn:
+            conn.execute(text("ANALYZE"))
+            conn.commit()
+    _seed_defaults()
+    if db.session.query(RawData.id).first() is None:
+        return
+    from dimensions import DIMENSIONS, fill_dimension_ids, rebuild_dimensions
+    if (any(db.session.query(model.id).first() is None for model, _col in DIMENSIONS.values())
+            or db.session.query(RawData.id).filter(RawData.parc_id.is_(None)).first() is not None):
+        rebuild_dimensions()
+        fill_dimension_ids()
+    if db.session.query(RawData.id).filter(RawData.quantite_conso.is_(None)).first() is not None:
+        from consumption import refresh_quantite_conso
+        refresh_quantite_conso()
+    if db.session.query(DailyAggregate.id).first() is None:
+        from processor import process_all_machines
+        process_all_machines()
+
+
+# Étapes de migration, dans l'ordre : la version du schéma est le nombre d'étapes appliquées.
+# Toute évolution du schéma = une nouvelle étape ajoutée en fin de liste (ne jamais réordonner).
+# Une étape ne fait que du DDL / SQL fixe sur les tables existantes (jamais les modèles ni le code applicatif,
+# qui suivent le schéma final) : tables, index, valeurs par défaut et données dérivées relèvent de _upgrade_data.
+MIGRATIONS = [
+    _migrate_add_history_period_id,
+    _migrate_anomalie_produit,
+    _migrate_user_filter_dates,
+    _migrate_raw_data_cuve,
+    _migrate_user_anomalie_produits,
+    _migrate_raw_data_quantite_conso,
+    _migrate_dimension_tables,
+    _migrate_processed_data_columns,
+    _migrate_daily_aggregates,
+    _migrate_anomalie_type_key,
+    _migrate_dimension_ids,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+MIGRATION_LOCK_ID = 4_621_330  # verrou consultatif PostgreSQL (arbitraire, propre à MADIC)
+
+
+def get_schema_version():
+    """Version du schéma appliquée (0 : table schema_version absente, base antérieure au suivi)."""
+    from sqlalchemy.exc import SQLAlchemyError
+    try:
+        with db.engine.connect() as conn:
+            row = conn.execute(SchemaVersion.__table__.select().where(SchemaVersion.id == 1)).first()
+    except SQLAlchemyError:
+        return 0
+    return row.version if row else 0
+
+
+def _set_schema_version(conn, version):
+    table = SchemaVersion.__table__
+    values = {'version': version, 'applied_at': datetime.utcnow()}
+    if not conn.execute(table.update().where(table.c.id == 1).values(**values)).rowcount:
+        conn.execute(table.insert().values(id=1, **values))
+    conn.commit()
+
+
+def _lock_file(fd):
+    """Verrou exclusif (bloquant) sur un fichier ouvert : libéré à sa fermeture, y compris si le processus meurt."""
+    try:
+        import fcntl
+    except ImportError:  # Windows
+        import msvcrt
+        while True:
+            try:
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.5)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+
+@contextmanager
+def _migration_lock(app):
+    """
+    Un seul processus migre à la fois (workers gunicorn, redémarrages simultanés).
+    PostgreSQL : verrou consultatif de session ; SQLite : verrou du système sur un fichier à côté de la base
+    (tenu tant que dure la migration, quelle que soit sa durée ; jamais « périmé » tant que son titulaire vit).
+    """
+    if db.engine.dialect.name == 'postgresql':
+        from sqlalchemy import text
+        with db.engine.connect() as conn:
+            conn.execute(text("SELECT pg_advisory_lock(:k)"), {'k': MIGRATION_LOCK_ID})
+            try:
+                yield
+            finally:
+                conn.execute(text("SELECT pg_advisory_unlock(:k)"), {'k': MIGRATION_LOCK_ID})
+        return
+    path = f"{db.engine.url.database or DATABASE_PATH}.migration.lock"
+    fd = os.open(path, os.O_CREAT | os.O_RDWR)  # fichier conservé : le supprimer séparerait les processus en attente
+    try:
+        _lock_file(fd)
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, f"{os.getpid():<10}\n".encode())  # titulaire (diagnostic)
+        yield
+    finally:
+        os.close(fd)
+
+
+def run_migrations(app):
+    """
+    Applique les étapes de MIGRATIONS non encore passées, sous verrou, en enregistrant la version
+    après chacune, puis _upgrade_data. La dernière version n'est enregistrée qu'après la mise à niveau
+    des données : interrompue, celle-ci est reprise au démarrage suivant (étapes idempotentes).
+    Une étape en échec est journalisée et interrompt le démarrage (reprise à cette étape).
+    """
+    with _migration_lock(app):
+        SchemaVersion.__table__.create(db.engine, checkfirst=True)
+        current = get_schema_version()  # un autre processus a pu migrer pendant l'attente du verrou
+        if current >= SCHEMA_VERSION:
+            return
+        steps = list(enumerate(MIGRATIONS[current:], start=current + 1)) + [(SCHEMA_VERSION, _upgrade_data)]
+        for version, step in steps:
+            try:
+                step(app)
+            except Exception:
+                db.session.rollback()
+                app.logger.exception("Migration %d (%s) en échec", version, step.__name__)
+                raise
+            db.session.remove()
+            if step is not MIGRATIONS[-1]:  # version finale enregistrée après _upgrade_data
+                with db.engine.connect() as conn:
+                    _set_schema_version(conn, version)
+            app.logger.info("Migration %d (%s) appliquée", version, step.__name__)
 
 
 def _ensure_admin_user():
@@ -177,22 +417,42 @@ def _ensure_admin_user():
         db.session.commit()
 
 
+class SchemaVersion(db.Model):
+    """Version du schéma appliquée par run_migrations (une seule ligne, id = 1)."""
+    __tablename__ = 'schema_version'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
 class RawData(db.Model):
     """Données brutes importées du fichier Excel (sans duplication)."""
     __tablename__ = 'raw_data'
+    __table_args__ = (
+        db.Index('ix_raw_data_date_heure', 'date_heure'),  # filtres de période (rapports, indicateurs, exports)
+        db.Index('ix_raw_data_parc_id_date', 'parc_id', 'date_heure'),  # fiche machine, traitement par machine
+        db.Index('ix_raw_data_personne_id_date', 'personne_id', 'date_heure'),  # fiche personne
+        db.Index('ix_raw_data_cuve_date', 'cuve_num', 'date_heure'),  # fiche cuve
+        db.Index('ix_raw_data_history_period', 'history_period_id'),  # suppression d'un import
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     history_period_id = db.Column(db.Integer, db.ForeignKey('history_periods.id'), nullable=True)
     date_heure = db.Column(db.DateTime, nullable=False)
     parc = db.Column(db.String(50), nullable=False)  # N° Parc (machine)
+    parc_id = db.Column(db.Integer)  # dim_parcs.id : filtres et regroupements sur entier (voir dimensions.py)
     service_vehicule = db.Column(db.String(100))
     personne = db.Column(db.String(100))
+    personne_id = db.Column(db.Integer)  # dim_personnes.id
     service_personne = db.Column(db.String(100))
     produit = db.Column(db.String(100))
+    produit_id = db.Column(db.Integer)  # dim_produits.id
     quantite = db.Column(db.Float, nullable=False)
     compteur = db.Column(db.Float, nullable=False)
     unite = db.Column(db.String(20))
     cuve_num = db.Column(db.Integer, nullable=True)  # 1–10 : lieu de plein (voir config.CUVE_LABELS)
+    quantite_conso = db.Column(db.Float, nullable=True)  # Quantité retenue en consommation (règle camion cuve, voir consumption.py)
     imported_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
@@ -207,6 +467,10 @@ class CamionCuve(db.Model):
 class ProcessedData(db.Model):
     """Données traitées avec calculs (compteur_before, diff, etc.)."""
     __tablename__ = 'processed_data'
+    __table_args__ = (
+        db.Index('ix_processed_data_raw_data_id', 'raw_data_id'),  # jointure depuis les relevés
+        db.Index('ix_processed_data_date_heure', 'date_heure'),  # indicateurs en mode exact
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     raw_data_id = db.Column(db.Integer, db.ForeignKey('raw_data.id'))
@@ -222,20 +486,33 @@ class ProcessedData(db.Model):
     compteur_before = db.Column(db.Float)
     compteur_after = db.Column(db.Float)
     diff_compteur = db.Column(db.Float)
+    km_entre_pleins = db.Column(db.Float, nullable=True)  # Écart de compteur depuis le relevé normal précédent (None si non mesurable)
+    efficacite = db.Column(db.Float, nullable=True)  # L/100 km ou L/h selon RawData.unite (None : produit exclu, intervalle anormal, unité inconnue)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class Anomalie(db.Model):
     """Anomalies détectées."""
     __tablename__ = 'anomalies'
+    __table_args__ = (
+        # décomptes filtrés par la config user (type_key IN (…) + produit) sur une période : index couvrant
+        db.Index('ix_anomalies_type_date', 'type_key', 'date', 'produit', 'threshold'),
+        db.Index('ix_anomalies_machine_id_date', 'machine_id', 'date'),
+        db.Index('ix_anomalies_personne_id_date', 'personne_id', 'date'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     machine = db.Column(db.String(50), nullable=False)
+    machine_id = db.Column(db.Integer)  # dim_parcs.id (repris du relevé)
     type_anomalie = db.Column(db.String(100), nullable=False)
+    type_key = db.Column(db.SmallInteger)  # Code du type (ANOMALIE_TYPE_CODES) : filtres et décomptes
+    threshold = db.Column(db.Integer)  # Seuil appliqué (saut compteur), None pour les autres types
     produit = db.Column(db.String(100))  # Produit concerné (lors du relevé)
+    produit_id = db.Column(db.Integer)  # dim_produits.id
     date = db.Column(db.DateTime, nullable=False)
     prev_date = db.Column(db.DateTime)
     personne = db.Column(db.String(100))
+    personne_id = db.Column(db.Integer)  # dim_personnes.id
     compteur_before = db.Column(db.Float)
     compteur_after = db.Column(db.Float)
     quantite_before = db.Column(db.Float)
@@ -334,94 +611,143 @@ def get_anomalie_type_key(type_anomalie):
     return None
 
 
+# Codes entiers des types d'anomalies (colonne anomalies.type_key) : ne jamais renuméroter
+ANOMALIE_TYPE_CODES = {
+    'zero_quantity': 1,
+    'compteur_decreased': 2,
+    'jump': 3,
+    'compteur_zero': 4,
+    'compteur_identique': 5,
+}
+_ANOMALIE_TYPE_NAMES = {
+    'zero_quantity': 'Zero quantity',
+    'compteur_decreased': 'Compteur decreased',
+    'jump': 'Jump >{threshold}',
+    'compteur_zero': 'Compteur zero',
+    'compteur_identique': 'Compteur identique malgré plein',
+}
+_ANOMALIE_TYPE_BY_CODE = {code: key for key, code in ANOMALIE_TYPE_CODES.items()}
+
+
+def anomalie_type_fields(type_key, threshold=None):
+    """Colonnes type_anomalie (libellé en base), type_key (code) et threshold d'une nouvelle anomalie."""
+    return {
+        'type_anomalie': _ANOMALIE_TYPE_NAMES[type_key].format(threshold=threshold),
+        'type_key': ANOMALIE_TYPE_CODES[type_key],
+        'threshold': threshold,
+    }
+
+
+def anomalie_type_name(code, threshold=None):
+    """Libellé type_anomalie correspondant à un code (regroupements par type_key, threshold)."""
+    key = _ANOMALIE_TYPE_BY_CODE.get(code)
+    return _ANOMALIE_TYPE_NAMES[key].format(threshold=threshold) if key else ''
+
+
 def ensure_user_anomalie_config(user_id):
-    """Crée les configs utilisateur si inexistantes (valeurs par défaut)."""
-    types_catalog = AnomalieTypeConfig.query.order_by(AnomalieTypeConfig.sort_order).all()
-    for t in types_catalog:
-        if UserAnomalieConfig.query.filter_by(user_id=user_id, type_key=t.type_key).first() is None:
-            c = UserAnomalieConfig(user_id=user_id, type_key=t.type_key, enabled=True, include_in_count=True)
-            db.session.add(c)
+    """Crée les configs utilisateur si inexistantes (valeurs par défaut), avant une modification. N'écrit que s'il en manque."""
+    existing = {r[0] for r in UserAnomalieConfig.query.filter_by(user_id=user_id).with_entities(UserAnomalieConfig.type_key).all()}
+    missing = [t['type_key'] for t in _anomalie_type_catalog() if t['type_key'] not in existing]
+    if not missing:
+        return
+    for type_key in missing:
+        db.session.add(UserAnomalieConfig(user_id=user_id, type_key=type_key, enabled=True, include_in_count=True))
     db.session.commit()
 
 
+def _anomalie_type_catalog():
+    """Catalogue des types (type_key, label, sort_order) trié, mémorisé pour la requête."""
+    def load():
+        rows = AnomalieTypeConfig.query.order_by(AnomalieTypeConfig.sort_order).with_entities(
+            AnomalieTypeConfig.type_key, AnomalieTypeConfig.label, AnomalieTypeConfig.sort_order,
+        ).all()
+        return tuple({'type_key': r[0], 'label': r[1], 'sort_order': r[2] or 0} for r in rows)
+    return request_memo('anomalie_type_catalog', load)
+
+
+def _user_anomalie_config(user_id):
+    """
+    Config anomalies effective de l'utilisateur : type_key → (enabled, include_in_count, produits, produits_json).
+    Types sans ligne utilisateur : valeurs par défaut (comme ensure_user_anomalie_config), sans rien écrire.
+    """
+    def load():
+        effective = {t['type_key']: (True, True, (), '[]') for t in _anomalie_type_catalog()}
+        rows = UserAnomalieConfig.query.filter_by(user_id=user_id).with_entities(
+            UserAnomalieConfig.type_key,
+            UserAnomalieConfig.enabled,
+            UserAnomalieConfig.include_in_count,
+            UserAnomalieConfig.produits_json,
+        ).all()
+        for type_key, enabled, include, produits_json in rows:
+            try:
+                produits = json.loads(produits_json or '[]')
+            except (TypeError, ValueError):
+                produits = []
+            if not isinstance(produits, list):
+                produits = []
+            effective[type_key] = (bool(enabled), bool(include), tuple(produits), produits_json or '[]')
+        return MappingProxyType(effective)
+    return request_memo(('user_anomalie_config', user_id), load)
+
+
 def get_user_anomalie_configs(user_id):
-    """Retourne la config anomalies de l'utilisateur, en la créant si besoin."""
-    import json
-    ensure_user_anomalie_config(user_id)
-    configs = UserAnomalieConfig.query.filter_by(user_id=user_id).all()
-    catalog = {t.type_key: t for t in AnomalieTypeConfig.query.all()}
+    """Retourne la config anomalies de l'utilisateur (valeurs par défaut pour les types non configurés)."""
+    config = _user_anomalie_config(user_id)
     out = []
-    for c in configs:
-        cat = catalog.get(c.type_key)
-        try:
-            produits = json.loads(c.produits_json or '[]')
-        except (TypeError, ValueError):
-            produits = []
+    for cat in _anomalie_type_catalog():
+        enabled, include, produits, _json = config[cat['type_key']]
         out.append({
-            'type_key': c.type_key,
-            'label': cat.label if cat else c.type_key,
-            'enabled': c.enabled,
-            'include_in_count': c.include_in_count,
-            'produits': produits if isinstance(produits, list) else [],
-            'sort_order': cat.sort_order if cat else 0,
+            'type_key': cat['type_key'],
+            'label': cat['label'],
+            'enabled': enabled,
+            'include_in_count': include,
+            'produits': list(produits),
+            'sort_order': cat['sort_order'],
         })
-    return sorted(out, key=lambda x: x['sort_order'])
+    return out
 
 
 def get_anomalie_filter_conditions(user_id, for_include_in_count=True):
     """
-    Retourne la clause SQLAlchemy (or_) pour filtrer les anomalies selon la config user.
+    Retourne la clause SQLAlchemy pour filtrer les anomalies selon la config user.
     for_include_in_count: True= décompte, False= affichage (enabled).
-    Pour chaque type activé : type match AND (produits vide OU produit in produits).
+    Types sans restriction produit : type_key IN (…) ; types restreints : regroupés par liste de produits,
+    type_key IN (…) AND produit IN (…).
     """
     from sqlalchemy import or_, and_
     if not user_id:
         return Anomalie.id < 0  # aucun
-    ensure_user_anomalie_config(user_id)
-    import json
-    attr = 'include_in_count' if for_include_in_count else 'enabled'
-    configs = UserAnomalieConfig.query.filter_by(user_id=user_id).filter(
-        getattr(UserAnomalieConfig, attr) == True
-    ).all()
-    type_conds = {
-        'zero_quantity': Anomalie.type_anomalie == 'Zero quantity',
-        'compteur_decreased': Anomalie.type_anomalie == 'Compteur decreased',
-        'jump': Anomalie.type_anomalie.like('Jump >%'),
-        'compteur_zero': Anomalie.type_anomalie == 'Compteur zero',
-        'compteur_identique': Anomalie.type_anomalie == 'Compteur identique malgré plein',
-    }
-    out = []
-    for c in configs:
-        type_cond = type_conds.get(c.type_key)
-        if type_cond is None:
+    by_produits = {}  # tuple(produits) ou () → codes
+    for type_key, (enabled, include, produits, _json) in _user_anomalie_config(user_id).items():
+        code = ANOMALIE_TYPE_CODES.get(type_key)
+        if code is None or not (include if for_include_in_count else enabled):
             continue
-        try:
-            produits = json.loads(c.produits_json or '[]')
-        except (TypeError, ValueError):
-            produits = []
-        if not produits:
-            out.append(type_cond)
-        else:
-            out.append(and_(type_cond, Anomalie.produit.in_(produits)))
+        by_produits.setdefault(tuple(sorted(produits)), []).append(code)
+    out = []
+    for produits, codes in sorted(by_produits.items()):
+        cond = Anomalie.type_key.in_(sorted(codes))
+        out.append(and_(cond, Anomalie.produit.in_(produits)) if produits else cond)
     return or_(*out) if out else (Anomalie.id < 0)  # jamais vrai si vide
 
 
+def get_user_anomalie_config_hash(user_id):
+    """Empreinte de la config anomalies de l'utilisateur (clé de cache des résultats filtrés)."""
+    import hashlib
+    if not user_id:
+        return ''
+    effective = _user_anomalie_config(user_id)
+    raw = '|'.join(f'{k}:{int(v[0])}:{int(v[1])}:{v[3]}' for k, v in sorted(effective.items()))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
 def get_anomalie_types_include_in_count(user_id):
     """Retourne les type_key dont include_in_count=True pour cet utilisateur."""
-    ensure_user_anomalie_config(user_id)
-    rows = UserAnomalieConfig.query.filter_by(
-        user_id=user_id, include_in_count=True
-    ).with_entities(UserAnomalieConfig.type_key).all()
-    return {r[0] for r in rows}
+    return {k for k, v in _user_anomalie_config(user_id).items() if v[1]}
 
 
 def get_anomalie_types_enabled(user_id):
     """Retourne les type_key dont enabled=True pour cet utilisateur (types pris en compte)."""
-    ensure_user_anomalie_config(user_id)
-    rows = UserAnomalieConfig.query.filter_by(
-        user_id=user_id, enabled=True
-    ).with_entities(UserAnomalieConfig.type_key).all()
-    return {r[0] for r in rows}
+    return {k for k, v in _user_anomalie_config(user_id).items() if v[0]}
 
 
 class SystemConfig(db.Model):
@@ -433,15 +759,91 @@ class SystemConfig(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 
-def get_jump_threshold():
-    """Retourne le seuil de saut compteur (km) pour la détection. Par défaut MAX_COUNTER_JUMP."""
+# Instantané des paramètres, partagé par les threads du processus et reconstruit quand la version change
+# (settings_version : jeton réécrit par toute modification, relu une fois par requête ; hors requête,
+# au plus toutes les SETTINGS_CHECK_INTERVAL secondes).
+SETTINGS_CHECK_INTERVAL = 1.0
+Settings = namedtuple('Settings', (
+    'jump_threshold', 'compteur_zero_excluded_products', 'camion_cuve_seuil_litres', 'camion_cuve_parcs',
+))
+_settings_lock = threading.Lock()
+_settings = {'token': None, 'snapshot': None, 'versions': None, 'checked': 0.0}
+
+
+def _read_config_versions():
+    rows = SystemConfig.query.filter(SystemConfig.key.in_(('settings_version', 'data_version'))).with_entities(
+        SystemConfig.key, SystemConfig.value,
+    ).all()
+    return MappingProxyType(dict(rows))
+
+
+def _config_versions():
+    """Versions des paramètres et des données : une lecture par requête, au plus une par seconde hors requête."""
+    if has_request_context():
+        return request_memo('config_versions', _read_config_versions)
+    now = time.monotonic()
+    with _settings_lock:
+        if _settings['versions'] is not None and now - _settings['checked'] < SETTINGS_CHECK_INTERVAL:
+            return _settings['versions']
+    versions = _read_config_versions()
+    with _settings_lock:
+        _settings['versions'], _settings['checked'] = versions, now
+    return versions
+
+
+def _forget_config_versions():
+    with _settings_lock:
+        _settings['versions'] = None
+
+
+def _load_settings():
+    values = dict(SystemConfig.query.with_entities(SystemConfig.key, SystemConfig.value).all())
     try:
-        row = SystemConfig.query.filter_by(key='jump_threshold').first()
-        if row and row.value:
-            return int(row.value)
+        jump_threshold = int(values.get('jump_threshold') or MAX_COUNTER_JUMP)
     except (ValueError, TypeError):
-        pass
-    return MAX_COUNTER_JUMP
+        jump_threshold = MAX_COUNTER_JUMP
+    try:
+        lst = json.loads(values.get('compteur_zero_excluded_products') or '[]')
+        excluded = frozenset(x for x in lst if isinstance(x, str))
+    except (ValueError, TypeError):
+        excluded = frozenset()
+    try:
+        seuil = float(values.get('camion_cuve_seuil_litres') or 100.0)
+    except (ValueError, TypeError):
+        seuil = 100.0
+    parcs = frozenset(r[0] for r in CamionCuve.query.with_entities(CamionCuve.parc).all() if r[0])
+    return Settings(jump_threshold, excluded, seuil, parcs)
+
+
+def get_settings():
+    """Instantané immuable des paramètres (seuils, produits exclus, camions cuve), reconstruit s'il a changé."""
+    token = _config_versions().get('settings_version')
+    with _settings_lock:
+        if _settings['snapshot'] is not None and _settings['token'] == token:
+            return _settings['snapshot']
+    snapshot = _load_settings()
+    with _settings_lock:
+        _settings['snapshot'], _settings['token'] = snapshot, token
+    return snapshot
+
+
+def touch_settings():
+    """
+    À appeler avec toute modification de paramètre ou de camion cuve, avant son commit :
+    nouveau jeton settings_version, pris en compte par tous les processus.
+    """
+    import uuid
+    row = db.session.get(SystemConfig, 'settings_version')
+    if row is None:
+        row = SystemConfig(key='settings_version')
+        db.session.add(row)
+    row.value = uuid.uuid4().hex  # jeton (et non compteur) : deux modifications simultanées restent distinctes
+    _forget_config_versions()
+
+
+def get_jump_threshold():
+    """Retourne le seuil de saut compteur (km) pour la détection. Par défaut MAX_COUNTER_JUMP."""
+    return get_settings().jump_threshold
 
 
 def set_jump_threshold(value):
@@ -458,26 +860,18 @@ def set_jump_threshold(value):
     else:
         row = SystemConfig(key='jump_threshold', value=str(v))
         db.session.add(row)
+    touch_settings()
     db.session.commit()
     return v
 
 
 def get_compteur_zero_excluded_products():
     """Produits à ignorer pour l'anomalie compteur zéro (ex: ADB sans compteur demandé)."""
-    import json
-    try:
-        row = SystemConfig.query.filter_by(key='compteur_zero_excluded_products').first()
-        if row and row.value:
-            lst = json.loads(row.value)
-            return set(x for x in lst if isinstance(x, str))
-    except (ValueError, TypeError):
-        pass
-    return set()
+    return get_settings().compteur_zero_excluded_products
 
 
 def set_compteur_zero_excluded_products(products):
     """Enregistre la liste des produits exclus pour compteur zéro."""
-    import json
     lst = list(products) if products else []
     row = SystemConfig.query.filter_by(key='compteur_zero_excluded_products').first()
     if row:
@@ -485,18 +879,51 @@ def set_compteur_zero_excluded_products(products):
     else:
         row = SystemConfig(key='compteur_zero_excluded_products', value=json.dumps(lst))
         db.session.add(row)
+    touch_settings()
     db.session.commit()
 
 
-def get_camion_cuve_seuil_litres():
-    """Seuil (L) : au-dessus = remplissage cuve mobile (hors stock roulant), en dessous = conso pour rouler."""
+def get_data_version():
+    """Version globale des données : incrémentée par les imports, suppressions et paramétrages impactant les calculs."""
     try:
-        row = SystemConfig.query.filter_by(key='camion_cuve_seuil_litres').first()
-        if row and row.value:
-            return float(row.value)
+        value = _config_versions().get('data_version')
+        if value:
+            return int(value)
     except (ValueError, TypeError):
         pass
-    return 100.0
+    return 0
+
+
+def bump_data_version():
+    """
+    Incrémente la version des données (invalide les caches de résultats et les ETag) et valide la session.
+    Incrément en une seule instruction SQL : deux processus simultanés obtiennent deux versions distinctes.
+    """
+    table = SystemConfig.__table__
+    value = table.c.value
+    v = db.session.execute(
+        table.update().where(table.c.key == 'data_version')
+        .values(value=db.cast(db.cast(db.func.coalesce(value, '0'), db.Integer) + 1, db.String), updated_at=datetime.utcnow())
+        .returning(value)
+    ).scalar()
+    if v is None:  # ligne absente (normalement créée à l'initialisation)
+        v = '1'
+        db.session.add(SystemConfig(key='data_version', value=v))
+    db.session.commit()
+    _forget_config_versions()
+    return int(v)
+
+
+def _ensure_data_version():
+    """Crée la ligne data_version (bump_data_version l'incrémente sur place)."""
+    if db.session.get(SystemConfig, 'data_version') is None:
+        db.session.add(SystemConfig(key='data_version', value='0'))
+        db.session.commit()
+
+
+def get_camion_cuve_seuil_litres():
+    """Seuil (L) : au-dessus = remplissage cuve mobile (hors stock roulant), en dessous = conso pour rouler."""
+    return get_settings().camion_cuve_seuil_litres
 
 
 def set_camion_cuve_seuil_litres(value):
@@ -507,19 +934,24 @@ def set_camion_cuve_seuil_litres(value):
     except (ValueError, TypeError):
         v = 100.0
     row = SystemConfig.query.filter_by(key='camion_cuve_seuil_litres').first()
+    changed = row is None or row.value != str(v)
     if row:
         row.value = str(v)
     else:
         row = SystemConfig(key='camion_cuve_seuil_litres', value=str(v))
         db.session.add(row)
+    touch_settings()
     db.session.commit()
+    if changed:
+        from consumption import refresh_quantite_conso
+        refresh_quantite_conso(parcs=get_camion_cuve_parcs_set())
+        bump_data_version()
     return v
 
 
 def get_camion_cuve_parcs_set():
-    """Ensemble des parcs déclarés comme camions cuve."""
-    rows = CamionCuve.query.with_entities(CamionCuve.parc).all()
-    return {r[0] for r in rows if r[0]}
+    """Ensemble des parcs déclarés comme camions cuve (modifier la liste : touch_settings avant le commit)."""
+    return get_settings().camion_cuve_parcs
 
 
 class Famille(db.Model):
@@ -539,15 +971,20 @@ class MachineFamille(db.Model):
 
 
 def get_parc_to_famille_nom_map():
-    """parc → libellé famille pour les graphiques (machines sans ligne ou sans famille : « (Sans famille) »)."""
-    id_to_nom = {f.id: f.nom for f in Famille.query.all()}
-    out = {}
-    for mf in MachineFamille.query.all():
-        if mf.famille_id and mf.famille_id in id_to_nom:
-            out[mf.parc] = id_to_nom[mf.famille_id]
-        else:
-            out[mf.parc] = '(Sans famille)'
-    return out
+    """
+    parc → libellé famille pour les graphiques (machines sans ligne ou sans famille : « (Sans famille) »).
+    Mémorisé pour la requête (lecture seule).
+    """
+    def load():
+        id_to_nom = {f.id: f.nom for f in Famille.query.all()}
+        out = {}
+        for mf in MachineFamille.query.all():
+            if mf.famille_id and mf.famille_id in id_to_nom:
+                out[mf.parc] = id_to_nom[mf.famille_id]
+            else:
+                out[mf.parc] = '(Sans famille)'
+        return MappingProxyType(out)
+    return request_memo('parc_to_famille', load)
 
 
 def famille_label_for_parc(parc, mapping):
@@ -567,6 +1004,79 @@ class HistoryPeriod(db.Model):
     imported_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
+class DimParc(db.Model):
+    """Dictionnaire des machines : première / dernière apparition et nombre de relevés (maintenu à l'import)."""
+    __tablename__ = 'dim_parcs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    valeur = db.Column(db.String(50), unique=True, nullable=False)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    nb_releves = db.Column(db.Integer, nullable=False, default=0)
+    total_quantite = db.Column(db.Float, nullable=False, default=0)
+
+
+class DimPersonne(db.Model):
+    """Dictionnaire des personnes ('' = personne non renseignée)."""
+    __tablename__ = 'dim_personnes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    valeur = db.Column(db.String(100), unique=True, nullable=False)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    nb_releves = db.Column(db.Integer, nullable=False, default=0)
+    total_quantite = db.Column(db.Float, nullable=False, default=0)
+
+
+class DimProduit(db.Model):
+    """Dictionnaire des produits ('' = produit non renseigné)."""
+    __tablename__ = 'dim_produits'
+
+    id = db.Column(db.Integer, primary_key=True)
+    valeur = db.Column(db.String(100), unique=True, nullable=False)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    nb_releves = db.Column(db.Integer, nullable=False, default=0)
+    total_quantite = db.Column(db.Float, nullable=False, default=0)
+
+
+class DimCuve(db.Model):
+    """Dictionnaire des cuves (valeur = n° de cuve en texte, '' = sans cuve)."""
+    __tablename__ = 'dim_cuves'
+
+    id = db.Column(db.Integer, primary_key=True)
+    valeur = db.Column(db.String(10), unique=True, nullable=False)
+    first_seen = db.Column(db.DateTime, nullable=True)
+    last_seen = db.Column(db.DateTime, nullable=True)
+    nb_releves = db.Column(db.Integer, nullable=False, default=0)
+    total_quantite = db.Column(db.Float, nullable=False, default=0)
+
+
+class DailyAggregate(db.Model):
+    """
+    Agrégats journaliers (recalculés par le traitement) : un enregistrement par jour et par valeur de dimension
+    (dim '' = tous relevés ; 'parc', 'personne', 'produit', 'cuve'). Les résumés (quantiles, valeurs distinctes)
+    se fusionnent pour répondre à n'importe quelle période sans relire raw_data.
+    """
+    __tablename__ = 'daily_aggregates'
+    __table_args__ = (db.Index('ix_daily_aggregates_dim_jour', 'dim', 'jour'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    jour = db.Column(db.Date, nullable=False)
+    dim = db.Column(db.String(20), nullable=False)
+    valeur = db.Column(db.String(100), nullable=False, default='')
+    nb_releves = db.Column(db.Integer, nullable=False, default=0)
+    quantite_sketch = db.Column(db.Text)  # QuantileSketch (sketches.py) des quantités
+    km_sketch = db.Column(db.Text)  # QuantileSketch des écarts de compteur entre deux pleins
+    parcs_hll = db.Column(db.Text)  # HyperLogLog des machines distinctes
+    personnes_hll = db.Column(db.Text)  # HyperLogLog des personnes distinctes
+    # Efficacité : sommes des intervalles valides par unité de compteur (rapport = L/100 km, L/h)
+    efficacite_quantite = db.Column(db.Float, nullable=False, default=0)  # Σ quantité (compteurs km)
+    efficacite_compteur = db.Column(db.Float, nullable=False, default=0)  # Σ écart compteur en centaines de km
+    efficacite_h_quantite = db.Column(db.Float, nullable=False, default=0)  # Σ quantité (compteurs horaires)
+    efficacite_h_compteur = db.Column(db.Float, nullable=False, default=0)  # Σ écart compteur en heures
+
+
 class CP30Data(db.Model):
     """Lignes CP30 importées depuis l'export Excel."""
     __tablename__ = 'cp30_data'
@@ -0,0 +1,292 @@
+# -*- coding: utf-8 -*-
+"""
+Dictionnaires de dimensions (parcs, personnes, produits, cuves) : maintenance à l'import et cache en mémoire.
+Ils servent aussi de classements (quantité totale, nb de relevés, dernière activité) pour le tableau de bord.
+"""
+import threading
+from datetime import datetime
+
+from sqlalchemy import exists, false, func
+
+from database import db, RawData, Anomalie, DimParc, DimPersonne, DimProduit, DimCuve, get_data_version
+
+# dimension → (modèle dictionnaire, colonne raw_data)
+DIMENSIONS = {
+    'parc': (DimParc, RawData.parc),
+    'personne': (DimPersonne, RawData.personne),
+    'produit': (DimProduit, RawData.produit),
+    'cuve': (DimCuve, RawData.cuve_num),
+}
+
+# dimension → (modèle dictionnaire, colonne d'identifiant dans raw_data) : clés entières de regroupement
+ID_COLUMNS = {
+    'parc': (DimParc, RawData.parc_id),
+    'personne': (DimPersonne, RawData.personne_id),
+    'produit': (DimProduit, RawData.produit_id),
+}
+
+# Espaces retirés aux bords d'une valeur de dimension, en Python (dimension_key) comme en SQL (_key_expression)
+DIMENSION_STRIP = ' \t\r\n\x0b\x0c\xa0'
+
+_cache_lock = threading.Lock()
+_cache = {'version': None, 'entries': {}, 'ids': {}}
+
+
+def dimension_key(value):
+    """Valeur normalisée telle que stockée dans un dictionnaire (espaces retirés, '' si vide)."""
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value.strip(DIMENSION_STRIP)
+    if isinstance(value, float):
+        if value != value:
+            return ''  # NaN (cellule vide lue par pandas) : stocké NULL en base
+        if value.is_integer():
+            value = int(value)  # n° de cuve lu en float depuis Excel
+    return str(value)
+
+
+def update_dimensions_from_rows(rows):
+    """
+    Fusionne des relevés nouvellement importés (objets RawData) dans les dictionnaires :
+    étend first_seen / last_seen, incrémente nb_releves et total_quantite, sans relire raw_data.
+    """
+    for dim, (model, col) in DIMENSIONS.items():
+        agg = {}
+        for r in rows:
+            v = dimension_key(getattr(r, col.key))
+            dt = r.date_heure
+            q = r.quantite or 0
+            cur = agg.get(v)
+            if cur is None:
+                agg[v] = [dt, dt, 1, q]
+            else:
+                if dt < cur[0]:
+                    cur[0] = dt
+                if dt > cur[1]:
+                    cur[1] = dt
+                cur[2] += 1
+                cur[3] += q
+        if not agg:
+            continue
+        existing = {d.valeur: d for d in model.query.filter(model.valeur.in_(list(agg))).all()}
+        for v, (dmin, dmax, nb, total) in agg.items():
+            d = existing.get(v)
+            if d is None:
+                db.session.add(model(valeur=v, first_seen=dmin, last_seen=dmax, nb_releves=nb, total_quantite=total))
+                continue
+            d.first_seen = dmin if d.first_seen is None or dmin < d.first_seen else d.first_seen
+            d.last_seen = dmax if d.last_seen is None or dmax > d.last_seen else d.last_seen
+            d.nb_releves = (d.nb_releves or 0) + nb
+            d.total_quantite = (d.total_quantite or 0) + total
+    db.session.commit()
+
+
+def collect_dimension_values(query):
+    """Valeurs de chaque dimension présentes dans une requête RawData (ex. lignes d'un import à supprimer)."""
+    out = {}
+    for dim, (_model, col) in DIMENSIONS.items():
+        out[dim] = {dimension_key(r[0]) for r in query.with_entities(col).distinct().all()}
+    return out
+
+
+def _key_expression(dim, col):
+    """Expression SQL de dimension_key : les variantes d'une valeur ('P01', 'P01 ') forment un seul groupe."""
+    return func.coalesce(func.trim(db.cast(col, db.String) if dim == 'cuve' else col, DIMENSION_STRIP), '')
+
+
+def rebuild_dimensions(values_by_dim=None):
+    """
+    Recalcule les dictionnaires depuis raw_data (GROUP BY sur la valeur normalisée).
+    values_by_dim : {dimension: set(valeurs)} pour ne recalculer que les valeurs touchées
+    (suppression d'un import) ; None = reconstruction complète.
+    """
+    for dim, (model, col) in DIMENSIONS.items():
+        targets = None if values_by_dim is None else values_by_dim.get(dim)
+        if targets is not None and not targets:
+            continue
+        key = _key_expression(dim, col)
+        q = db.session.query(
+            key, func.min(RawData.date_heure), func.max(RawData.date_heure), func.count(RawData.id),
+            func.sum(RawData.quantite),
+        )
+        if targets is not None:
+            q = q.filter(key.in_(list(targets)))
+        stats = {r[0]: r[1:] for r in q.group_by(key).all()}
+        dq = model.query
+        if targets is not None:
+            dq = dq.filter(model.valeur.in_(list(targets)))
+        existing = {d.valeur: d for d in dq.all()}
+        gone = [d.id for v, d in existing.items() if v not in stats]
+        if gone:
+            delete = model.__table__.delete().where(model.id.in_(gone))
+            if dim in ID_COLUMNS:  # jamais une entrée dont l'id est encore porté par des relevés
+                id_col = ID_COLUMNS[dim][1]
+                delete = delete.where(~exists().where(id_col == model.id))
+            db.session.execute(delete)
+        for v, (dmin, dmax, nb, total) in stats.items():
+            d = existing.get(v)
+            if d is None:
+                db.session.add(model(valeur=v, first_seen=dmin, last_seen=dmax, nb_releves=int(nb or 0),
+                                     total_quantite=float(total or 0)))
+            else:
+                d.first_seen, d.last_seen, d.nb_releves, d.total_quantite = dmin, dmax, int(nb or 0), float(total or 0)
+    db.session.commit()
+
+
+def clear_dimensions():
+    """Vide les dictionnaires (réinitialisation des données)."""
+    for model, _col in DIMENSIONS.values():
+        model.query.delete()
+    db.session.commit()
+
+
+def get_dimension_entries(dimension):
+    """Entrées (valeur, first_seen, last_seen, nb_releves) triées par valeur, en cache par version des données."""
+    version = get_data_version()
+    with _cache_lock:
+        if _cache['version'] == version and dimension in _cache['entries']:
+            return _cache['entries'][dimension]
+    model, _col = DIMENSIONS[dimension]
+    rows = model.query.with_entities(
+        model.valeur, model.first_seen, model.last_seen, model.nb_releves
+    ).all()
+    entries = sorted((tuple(r) for r in rows), key=lambda e: e[0])
+    with _cache_lock:
+        if _cache['version'] != version:
+            _cache['version'] = version
+            _cache['entries'] = {}
+            _cache['ids'] = {}
+        _cache['entries'][dimension] = entries
+    return entries
+
+
+def get_dimension_ids(dimension):
+    """
+    Correspondance valeur → id du dictionnaire (et son inverse), en cache par version des données :
+    les id d'une valeur encore présente ne changent jamais, une valeur disparue n'est retirée qu'avec ses relevés.
+    Retourne (ids, labels).
+    """
+    version = get_data_version()
+    with _cache_lock:
+        if _cache['version'] == version and dimension in _cache['ids']:
+            return _cache['ids'][dimension]
+    model, _col = ID_COLUMNS[dimension]
+    ids = dict(model.query.with_entities(model.valeur, model.id).all())
+    maps = (ids, {i: v for v, i in ids.items()})
+    with _cache_lock:
+        if _cache['version'] != version:
+            _cache['version'] = version
+            _cache['entries'] = {}
+            _cache['ids'] = {}
+        _cache['ids'][dimension] = maps
+    return maps
+
+
+def dimension_label(dimension, dim_id):
+    """Valeur d'un id de dictionnaire ('' si inconnu)."""
+    return get_dimension_ids(dimension)[1].get(dim_id, '')
+
+
+def dimension_condition(column, dimension, value):
+    """column == id de la valeur (colonne entière) ; jamais vrai si la valeur est absente du dictionnaire."""
+    dim_id = get_dimension_ids(dimension)[0].get(dimension_key(value))
+    return column == dim_id if dim_id is not None else false()
+
+
+def dimension_in_condition(column, dimension, values):
+    """column IN (id des valeurs connues)."""
+    ids = get_dimension_ids(dimension)[0]
+    return column.in_(sorted({ids[v] for v in map(dimension_key, values) if v in ids}))
+
+
+def assign_dimension_ids(rows):
+    """
+    Renseigne parc_id / personne_id / produit_id de relevés à importer (objets RawData) via la correspondance
+    en mémoire ; les valeurs nouvelles sont ajoutées aux dictionnaires (statistiques complétées ensuite par
+    update_dimensions_from_rows). À appeler dans la transaction de l'import, avant l'insertion.
+    """
+    for dim, (model, id_col) in ID_COLUMNS.items():
+        value_col = DIMENSIONS[dim][1].key
+        ids = dict(get_dimension_ids(dim)[0])
+        missing = {dimension_key(getattr(r, value_col)) for r in rows} - set(ids)
+        if missing:
+            # relu en base : une autre requête a pu les créer depuis la mise en cache
+            ids.update(model.query.filter(model.valeur.in_(list(missing))).with_entities(model.valeur, model.id).all())
+            new = [model(valeur=v, nb_releves=0, total_quantite=0) for v in missing if v not in ids]
+            if new:
+                db.session.add_all(new)
+                db.session.flush()
+                ids.update((d.valeur, d.id) for d in new)
+        for r in rows:
+            setattr(r, id_col.key, ids[dimension_key(getattr(r, value_col))])
+
+
+def fill_dimension_ids():
+    """
+    Renseigne les clés entières encore vides de raw_data et anomalies depuis les dictionnaires
+    (une mise à jour par valeur distincte, même normalisation qu'à l'import) : base antérieure aux clés.
+    """
+    targets = (
+        (RawData, (('parc', 'parc', 'parc_id'), ('personne', 'personne', 'personne_id'), ('produit', 'produit', 'produit_id'))),
+        (Anomalie, (('parc', 'machine', 'machine_id'), ('personne', 'personne', 'personne_id'), ('produit', 'produit', 'produit_id'))),
+    )
+    for model, columns in targets:
+        table = model.__table__
+        for dim, col, id_col in columns:
+            dim_model = ID_COLUMNS[dim][0]
+            ids = dict(dim_model.query.with_entities(dim_model.valeur, dim_model.id).all())
+            missing = table.c[id_col].is_(None)
+            values = [r[0] for r in db.session.query(table.c[col]).filter(missing).distinct().all()]
+            for value in values:
+                cond = table.c[col].is_(None) if value is None else table.c[col] == value
+                db.session.execute(table.update().where(missing, cond).values({id_col: ids.get(dimension_key(value))}))
+        db.session.commit()
+
+
+def get_dimension_values(dimension, date_from=None, date_to=None, include_empty=False):
+    """
+    Valeurs d'une dimension, filtrées par recouvrement de période (first_seen / last_seen)
+    au lieu d'un SELECT DISTINCT sur raw_data.
+    """
+    start = datetime.combine(date_from, datetime.min.time()) if date_from else None
+    end = datetime.combine(date_to, datetime.max.time()) if date_to else None
+    out = []
+    for valeur, first_seen, last_seen, _nb in get_dimension_entries(dimension):
+        if not valeur and not include_empty:
+            continue
+        if end is not None and first_seen is not None and first_seen > end:
+            continue
+        if start is not None and last_seen is not None and last_seen < start:
+            continue
+        out.append(valeur)
+    return out
+
+
+def get_leaderboard(dimension, limit=None, offset=0, values=None, exclude_empty=False):
+    """
+    Classement d'une dimension par quantité totale décroissante (tout l'historique) :
+    liste de (valeur, total_quantite, nb_releves, last_seen), lue telle quelle dans le dictionnaire.
+    values : restreint à ces valeurs (filtre d'affichage du tableau de bord).
+    """
+    model, _col = DIMENSIONS[dimension]
+    q = model.query.with_entities(model.valeur, model.total_quantite, model.nb_releves, model.last_seen)
+    if values:
+        q = q.filter(model.valeur.in_(list(values)))
+    if exclude_empty:
+        q = q.filter(model.valeur != '')
+    q = q.order_by(model.total_quantite.desc(), model.valeur).offset(offset)
+    if limit is not None:
+        q = q.limit(limit)
+    return [tuple(r) for r in q.all()]
+
+
+def count_leaderboard(dimension, values=None, exclude_empty=False):
+    """Nombre d'entrées du classement (mêmes filtres que get_leaderboard)."""
+    model, _col = DIMENSIONS[dimension]
+    q = model.query
+    if values:
+        q = q.filter(model.valeur.in_(list(values)))
+    if exclude_empty:
+        q = q.filter(model.valeur != '')
+    return q.count()
@@ -4,8 +4,11 @@ import re
 import os
 from datetime import datetime
 import pandas as pd
-from database import db, RawData, HistoryPeriod
+from database import db, RawData, HistoryPeriod, bump_data_version
 from config import COLUMN_KEYWORDS
+from consumption import refresh_quantite_conso
+from dimensions import assign_dimension_ids, update_dimensions_from_rows
+from partitions import ensure_partitions
 
 
 def _normalize(s):
@@ -343,6 +346,7 @@ def import_excel(filepath, filename=''):
         date_min = min(r.date_heure.date() for r in to_insert)
         date_max = max(r.date_heure.date() for r in to_insert)
         
+        ensure_partitions(db.session.connection(), date_min, date_max)  # PostgreSQL : mois importés
         hp = HistoryPeriod(
             date_min=date_min, date_max=date_max,
             nb_lignes_importees=len(to_insert), filename=filename or 'Fichier Excel'
@@ -352,8 +356,12 @@ def import_excel(filepath, filename=''):
         
         for r in to_insert:
             r.history_period_id = hp.id
+        assign_dimension_ids(to_insert)
         db.session.bulk_save_objects(to_insert)
         db.session.commit()
+        refresh_quantite_conso(history_period_id=hp.id)
+        update_dimensions_from_rows(to_insert)
+        bump_data_version()
         
         return len(to_insert), nb_skipped, date_min, date_max, []
     
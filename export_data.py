@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""Export brut des relevés ou des anomalies en CSV / Parquet (équivalent en ligne de commande de /export/…).
+Usage: py export_data.py raw.csv -o releves.csv [--date-from AAAA-MM-JJ] [--date-to AAAA-MM-JJ]
+                         [--machine PARC ...] [--personne NOM ...]
+       py export_data.py anomalies.parquet -o anomalies.parquet"""
+import argparse
+import sys
+from datetime import datetime
+
+
+def _date(s):
+    return datetime.strptime(s, '%Y-%m-%d').date()
+
+
+def main(argv=None):
+    from exports import EXPORT_DATASETS, EXPORT_FORMATS, iter_csv, write_parquet, parquet_available
+
+    parser = argparse.ArgumentParser(description="Export brut MADIC (CSV ou Parquet).")
+    parser.add_argument('export', help="jeu.format : raw.csv, raw.parquet, anomalies.csv, anomalies.parquet")
+    parser.add_argument('-o', '--output', required=True, help="fichier de sortie")
+    parser.add_argument('--date-from', type=_date)
+    parser.add_argument('--date-to', type=_date)
+    parser.add_argument('--machine', action='append', default=[], help="n° de parc (répétable)")
+    parser.add_argument('--personne', action='append', default=[], help="personne (répétable)")
+    args = parser.parse_args(argv)
+
+    dataset, _, fmt = args.export.partition('.')
+    if dataset not in EXPORT_DATASETS or fmt not in EXPORT_FORMATS:
+        parser.error(f"export inconnu : {args.export}")
+    if fmt == 'parquet' and not parquet_available():
+        parser.error("export Parquet indisponible : installer pyarrow")
+
+    from app import app
+    filters = (args.date_from, args.date_to, args.machine, args.personne)
+    with app.app_context():
+        if fmt == 'csv':
+            with open(args.output, 'w', encoding='utf-8', newline='') as f:
+                for chunk in iter_csv(dataset, *filters):
+                    f.write(chunk)
+        else:
+            write_parquet(args.output, dataset, *filters)
+    print(f"Export écrit : {args.output}")
+
+
+if __name__ == '__main__':
+    sys.exit(main())
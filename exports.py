@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+Exports bruts (relevés, anomalies) en CSV et Parquet pour l'analyse externe.
+Lecture par lots sur curseur serveur (yield_per) et écriture incrémentale : mémoire constante quel que soit le volume.
+"""
+import csv
+import io
+from datetime import datetime
+
+from database import db, RawData, Anomalie
+from dimensions import dimension_in_condition
+
+EXPORT_FORMATS = ('csv', 'parquet')
+# Lignes lues par lot sur le curseur serveur
+EXPORT_FETCH_BATCH = 5000
+# Lignes par groupe de lignes Parquet (unité d'écriture et de lecture sélective)
+PARQUET_ROW_GROUP = 100000
+
+# jeu de données → (modèle, colonne date, id machine, id personne, colonnes exportées)
+EXPORT_DATASETS = {
+    'raw': (RawData, RawData.date_heure, RawData.parc_id, RawData.personne_id, (
+        RawData.id, RawData.date_heure, RawData.parc, RawData.service_vehicule, RawData.personne,
+        RawData.service_personne, RawData.produit, RawData.quantite, RawData.quantite_conso,
+        RawData.compteur, RawData.unite, RawData.cuve_num, RawData.history_period_id,
+    )),
+    'anomalies': (Anomalie, Anomalie.date, Anomalie.machine_id, Anomalie.personne_id, (
+        Anomalie.id, Anomalie.date, Anomalie.prev_date, Anomalie.machine, Anomalie.type_anomalie,
+        Anomalie.type_key, Anomalie.threshold, Anomalie.produit, Anomalie.personne, Anomalie.compteur_before, Anomalie.compteur_after,
+        Anomalie.quantite_before, Anomalie.quantite_after, Anomalie.details,
+    )),
+}
+
+
+def export_query(dataset, date_from=None, date_to=None, machines=None, personnes=None):
+    """
+    Lignes d'un jeu de données ('raw' | 'anomalies') filtrées par période, machines et personnes,
+    dans l'ordre chronologique. Toutes les anomalies sont exportées (pas de filtre de config utilisateur).
+    """
+    _model, date_col, machine_id_col, personne_id_col, columns = EXPORT_DATASETS[dataset]
+    q = db.session.query(*columns)
+    if date_from:
+        q = q.filter(date_col >= datetime.combine(date_from, datetime.min.time()))
+    if date_to:
+        q = q.filter(date_col <= datetime.combine(date_to, datetime.max.time()))
+    if machines:
+        q = q.filter(dimension_in_condition(machine_id_col, 'parc', machines))
+    if personnes:
+        q = q.filter(dimension_in_condition(personne_id_col, 'personne', personnes))
+    return q.order_by(date_col, columns[0])
+
+
+def export_columns(dataset):
+    return [c.key for c in EXPORT_DATASETS[dataset][4]]
+
+
+def iter_export_rows(dataset, date_from=None, date_to=None, machines=None, personnes=None):
+    """Lignes (tuples) lues par lots de EXPORT_FETCH_BATCH sur curseur serveur."""
+    return export_query(dataset, date_from, date_to, machines, personnes).yield_per(EXPORT_FETCH_BATCH)
+
+
+def iter_csv(dataset, date_from=None, date_to=None, machines=None, personnes=None):
+    """Export CSV (UTF-8, séparateur virgule, dates ISO) produit en flux : un bloc de texte par lot de lignes."""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow(export_columns(dataset))
+    n = 0
+    for row in iter_export_rows(dataset, date_from, date_to, machines, personnes):
+        writer.writerow(['' if v is None else v.isoformat() if isinstance(v, datetime) else v for v in row])
+        n += 1
+        if n % EXPORT_FETCH_BATCH == 0:
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    yield buf.getvalue()
+
+
+def _arrow_schema(dataset):
+    import pyarrow as pa
+
+    fields = []
+    for col in EXPORT_DATASETS[dataset][4]:
+        t = col.type
+        if isinstance(t, db.Integer):
+            arrow_type = pa.int64()
+        elif isinstance(t, db.Float):
+            arrow_type = pa.float64()
+        elif isinstance(t, db.DateTime):
+            arrow_type = pa.timestamp('us')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(col.key, arrow_type, nullable=col.nullable))
+    return pa.schema(fields)
+
+
+def write_parquet(target, dataset, date_from=None, date_to=None, machines=None, personnes=None):
+    """
+    Écrit l'export Parquet dans target (chemin ou flux) par groupes de PARQUET_ROW_GROUP lignes :
+    seul le groupe en cours est en mémoire. Nécessite pyarrow.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = _arrow_schema(dataset)
+
+    def row_group(columns):
+        return pa.Table.from_arrays([pa.array(v, type=f.type) for v, f in zip(columns, schema)], schema=schema)
+
+    with pq.ParquetWriter(target, schema, compression='snappy') as writer:
+        columns = [[] for _ in schema.names]
+        n = 0
+        for row in iter_export_rows(dataset, date_from, date_to, machines, personnes):
+            for values, v in zip(columns, row):
+                values.append(v)
+            n += 1
+            if n == PARQUET_ROW_GROUP:
+                writer.write_table(row_group(columns))
+                columns = [[] for _ in schema.names]
+                n = 0
+        if n:
+            writer.write_table(row_group(columns))
+
+
+def parquet_available():
+    try:
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        return False
+    return True
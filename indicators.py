@@ -6,15 +6,16 @@ from collections import defaultdict
 from database import (
     db,
     RawData,
+    ProcessedData,
     Anomalie,
+    DailyAggregate,
     get_anomalie_filter_conditions,
-    get_camion_cuve_parcs_set,
-    get_camion_cuve_seuil_litres,
     get_parc_to_famille_nom_map,
     famille_label_for_parc,
 )
-from config import cuve_num_to_site, format_cuve_label
-from consumption import effective_quantite_conso_carburant
+from config import EFFICACITE_UNITES, cuve_num_to_site, format_cuve_label
+from dimensions import get_dimension_values
+from sketches import QUANTILE_AGGS, QuantileSketch, ExactQuantiles, HyperLogLog, ExactDistinct, RatioSum
 
 
 def _date_filter(query, model, date_from=None, date_to=None):
@@ -51,268 +52,635 @@ def _truncate_date(dt, group_by):
     return d.isoformat()
 
 
-def get_indicator_data(x_axis, x_date_group, y_metrics, serie_dim, date_from=None, date_to=None, serie_filter=None, user_id=None):
+def _raw_dim_key(dim, r, fam_map, x_date_group='jour'):
+    """Clé d'une ligne RawData pour une dimension (axe X ou série)."""
+    if dim == 'date':
+        return _truncate_date(r.date_heure, x_date_group or 'jour')
+    if dim == 'parc':
+        return str(r.parc or '')
+    if dim == 'personne':
+        return str(r.personne or '(vide)')
+    if dim == 'produit':
+        return str(r.produit or '(vide)')
+    if dim == 'site':
+        return cuve_num_to_site(r.cuve_num) or '(non renseigné)'
+    if dim == 'cuve':
+        return format_cuve_label(r.cuve_num)
+    if dim == 'famille':
+        return famille_label_for_parc(r.parc, fam_map)
+    return None
+
+
+def _anomalie_dim_key(dim, a, fam_map, x_date_group='jour'):
+    """Clé d'une anomalie pour une dimension (axe X ou série)."""
+    if dim == 'date':
+        return _truncate_date(a.date, x_date_group or 'jour')
+    if dim == 'parc':
+        return str(a.machine or '')
+    if dim == 'personne':
+        return str(a.personne or '(vide)')
+    if dim == 'produit':
+        return '(vide)'  # anomalie n'a pas produit
+    if dim == 'type_anomalie':
+        return str(a.type_anomalie or '')
+    if dim == 'famille':
+        return famille_label_for_parc(a.machine, fam_map)
+    return None
+
+
+AUTRES_SERIE = 'Autres'
+
+# Métriques servies par les résumés journaliers : metric → (colonne daily_aggregates, attribut du relevé traité, type)
+SKETCH_METRICS = {
+    'quantite': ('quantite_sketch', 'quantite', 'quantile'),
+    'km_entre_pleins': ('km_sketch', 'km_entre_pleins', 'quantile'),
+    'nb_machines_distinctes': ('parcs_hll', 'parc', 'distinct'),
+    'nb_personnes_distinctes': ('personnes_hll', 'personne', 'distinct'),
+    # efficacité : Σ quantité / Σ écart compteur des intervalles valides (colonnes numériques, pas de JSON),
+    # L/100 km sur les compteurs kilométriques, L/h sur les compteurs horaires
+    'efficacite': (('efficacite_quantite', 'efficacite_compteur'), ('efficacite_quantite', 'efficacite_compteur'), 'ratio'),
+    'efficacite_h': (('efficacite_h_quantite', 'efficacite_h_compteur'), ('efficacite_h_quantite', 'efficacite_h_compteur'), 'ratio'),
+}
+# type → (résumé fusionnable, équivalent exact)
+_SKETCH_CLASSES = {
+    'quantile': (QuantileSketch, ExactQuantiles),
+    'distinct': (HyperLogLog, ExactDistinct),
+    'ratio': (RatioSum, RatioSum),
+}
+# En dessous de cette période (jours), les résumés sont remplacés par un calcul exact sur processed_data
+EXACT_MAX_DAYS = 31
+
+
+def _sketch_spec(ym):
+    """(colonne, attribut, type) si la métrique est servie par un résumé, sinon None."""
+    spec = SKETCH_METRICS.get(ym.get('metric'))
+    if spec is None or (spec[2] == 'quantile' and ym.get('agg') not in QUANTILE_AGGS):
+        return None
+    return spec
+# Dimension d'indicateur → dimension des agrégats journaliers qui permet de la reconstituer
+_SKETCH_DIMS = {'parc': 'parc', 'famille': 'parc', 'personne': 'personne', 'produit': 'produit', 'cuve': 'cuve', 'site': 'cuve'}
+
+
+def _sketch_dim(x_axis, serie_dim):
+    """
+    Dimension des agrégats journaliers couvrant (x_axis, serie_dim) : '' si seule la date intervient,
+    None si deux dimensions distinctes se croisent (calcul exact sur processed_data).
+    """
+    dims = {_SKETCH_DIMS.get(d, d) for d in (x_axis, serie_dim) if d and d != 'date'}
+    if not dims:
+        return ''
+    if len(dims) == 1:
+        dim = dims.pop()
+        return dim if dim in _SKETCH_DIMS.values() else None
+    return None
+
+
+class _DailyRow:
+    """Ligne daily_aggregates présentée comme un relevé (date_heure, parc, ...) pour _raw_dim_key."""
+
+    __slots__ = ('date_heure', 'parc', 'personne', 'produit', 'cuve_num', '_raw', '_parsed')
+
+    def __init__(self, dim, r):
+        self.date_heure = datetime.combine(r.jour, datetime.min.time())
+        self.parc = r.valeur if dim == 'parc' else None
+        self.personne = r.valeur if dim == 'personne' else None
+        self.produit = r.valeur if dim == 'produit' else None
+        self.cuve_num = int(r.valeur) if dim == 'cuve' and r.valeur else None
+        self._raw = r
+        self._parsed = {}
+
+    def sketch(self, col, cls):
+        """Résumé désérialisé (une seule fois par ligne, partagé entre les configs) ; col tuple = colonnes numériques."""
+        if col not in self._parsed:
+            if isinstance(col, tuple):
+                self._parsed[col] = cls(*(getattr(self._raw, c) for c in col))
+            else:
+                self._parsed[col] = cls.from_json(getattr(self._raw, col))
+        return self._parsed[col]
+
+
+def _lttb_indices(xs, ys, threshold):
+    """Indices retenus par Largest-Triangle-Three-Buckets (conserve la forme visuelle de la courbe)."""
+    n = len(ys)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    out = [0]
+    for i in range(threshold - 2):
+        avg_start = int((i + 1) * every) + 1
+        avg_end = min(int((i + 2) * every) + 1, n)
+        span = avg_end - avg_start
+        avg_x = sum(xs[avg_start:avg_end]) / span
+        avg_y = sum(ys[avg_start:avg_end]) / span
+        range_start = int(i * every) + 1
+        range_end = int((i + 1) * every) + 1
+        ax, ay = xs[a], ys[a]
+        max_area = -1.0
+        next_a = range_start
+        for j in range(range_start, range_end):
+            area = abs((ax - avg_x) * (ys[j] - ay) - (ax - xs[j]) * (avg_y - ay))
+            if area > max_area:
+                max_area = area
+                next_a = j
+        out.append(next_a)
+        a = next_a
+    out.append(n - 1)
+    return out
+
+
+def _downsample_indices(labels, series_values, max_points):
+    """
+    Indices d'abscisse communs à toutes les courbes (au plus max_points) : LTTB sur la somme des séries,
+    plus le minimum et le maximum de chaque série pour ne perdre aucun pic ; au-delà de la moitié du budget,
+    seuls les extrêmes les plus éloignés de la moyenne de leur série sont gardés.
+    series_values : itérable de listes de valeurs (parcouru une seule fois).
+    """
+    n = len(labels)
+    try:
+        xs = [date.fromisoformat(l).toordinal() for l in labels]
+    except (TypeError, ValueError):
+        xs = list(range(n))
+    total = [0.0] * n
+    deviations = {}  # indice d'un extrême → plus grand écart |valeur - moyenne| parmi les séries
+    for data in series_values:
+        if not data:
+            continue
+        for i, v in enumerate(data):
+            total[i] += v
+        mean = sum(data) / n
+        for i in (min(range(n), key=data.__getitem__), max(range(n), key=data.__getitem__)):
+            deviations[i] = max(deviations.get(i, 0.0), abs(data[i] - mean))
+    extremes = set(sorted(deviations, key=lambda i: (-deviations[i], i))[:max_points // 2])
+    budget = max(3, max_points - len(extremes))
+    return sorted(set(_lttb_indices(xs, total, budget)) | extremes)
+
+
+CHART_COLORS = [
+    '#3498db', '#27ae60', '#e74c3c', '#f39c12', '#9b59b6',
+    '#1abc9c', '#e67e22', '#34495e', '#16a085', '#c0392b'
+]
+
+
+class _IndicatorAccumulator:
+    """Agrégation d'une configuration d'indicateur, alimentée ligne par ligne (un même scan peut servir plusieurs configs)."""
+
+    def __init__(self, x_axis, x_date_group, y_metrics, serie_dim, date_from=None, date_to=None, serie_filter=None, fam_map=None,
+                 top_n=None, max_points=None):
+        self.x_axis = x_axis
+        self.top_n = top_n if top_n and top_n > 0 else None
+        self.max_points = max_points if max_points and max_points >= 3 else None
+        self.x_date_group = x_date_group or 'jour'
+        self.y_metrics = y_metrics
+        self.serie_dim = serie_dim
+        self.serie_filter = serie_filter
+        self.fam_map = fam_map if fam_map is not None else {}
+        self.start = datetime.combine(date_from, datetime.min.time()) if date_from else None
+        self.end = datetime.combine(date_to, datetime.max.time()) if date_to else None
+        self.raw_metrics = [
+            (ym['metric'], ym.get('agg', 'sum'), ym.get('metric', 'quantite') + '_' + ym.get('agg', 'sum'))
+            for ym in y_metrics
+            if ym.get('metric') != 'nb_anomalies' and ym.get('agg') not in QUANTILE_AGGS and _sketch_spec(ym) is None
+        ]
+        self.sketch_metrics = [
+            (ym['metric'], ym.get('agg', 'sum'), ym['metric'] + '_' + ym.get('agg', 'sum'), _sketch_spec(ym))
+            for ym in y_metrics if _sketch_spec(ym) is not None
+        ]
+        # Quantiles / valeurs distinctes : fusion des résumés journaliers d'une dimension ; valeurs exactes
+        # si deux dimensions se croisent ou si la période est courte
+        small_range = self.start is not None and self.end is not None and (self.end - self.start).days < EXACT_MAX_DAYS
+        self.sketch_dim = _sketch_dim(x_axis, serie_dim) if self.sketch_metrics and not small_range else None
+        self.wants_sketches = self.sketch_dim is not None
+        self.wants_exact = bool(self.sketch_metrics) and self.sketch_dim is None
+        self.sketches = defaultdict(dict)
+        self.wants_raw = bool(self.raw_metrics)
+        self.wants_anomalies = any(m.get('metric') == 'nb_anomalies' for m in y_metrics)
+        self.has_avg = any(m.get('agg') == 'avg' for m in y_metrics)
+        self.result = defaultdict(lambda: defaultdict(float))
+        self.counts = defaultdict(int)
+        self.series_keys = set()
+
+    def _in_range(self, dt):
+        if self.start is not None and dt < self.start:
+            return False
+        if self.end is not None and dt > self.end:
+            return False
+        return True
+
+    def _raw_cell_key(self, r):
+        x_key = _raw_dim_key(self.x_axis, r, self.fam_map, self.x_date_group)
+        if x_key is None:
+            x_key = '?'
+        if self.serie_dim:
+            s_key = _raw_dim_key(self.serie_dim, r, self.fam_map)
+            if s_key is None or self.serie_dim == 'date':
+                s_key = 'Global'
+        else:
+            s_key = '__global__'
+        self.series_keys.add(s_key)
+        return x_key, s_key
+
+    def add_raw(self, r):
+        if not self.wants_raw or not self._in_range(r.date_heure):
+            return
+        key = self._raw_cell_key(r)
+        cell = self.result[key]
+        self.counts[key] += 1
+        for metric, agg, mid in self.raw_metrics:
+            val = 0
+            if metric == 'quantite':
+                val = float(r.quantite or 0)
+            elif metric == 'quantite_conso':
+                val = float(r.quantite_conso or 0)
+            elif metric == 'compteur':
+                val = float(r.compteur or 0)
+            elif metric == 'nb_releves':
+                val = 1
+            if agg == 'sum' or agg == 'avg':
+                cell[mid] += val  # avg : divisé par le nombre de lignes à la fin
+            elif agg == 'count' or metric == 'nb_releves':
+                cell[mid] += 1
+            elif agg == 'max':
+                cell[mid] = max(cell.get(mid, 0), val)
+
+    def add_daily(self, d):
+        """Ligne daily_aggregates (_DailyRow) de la dimension sketch_dim : fusionne ses résumés dans la cellule."""
+        if not self.wants_sketches or not self._in_range(d.date_heure):
+            return
+        key = self._raw_cell_key(d)
+        cell = self.sketches[key]
+        self.result[key]  # la cellule existe même sans autre métrique (abscisses)
+        for _metric, _agg, mid, (col, _attr, kind) in self.sketch_metrics:
+            cls = _SKETCH_CLASSES[kind][0]
+            src = d.sketch(col, cls)
+            sk = cell.get(mid)
+            if sk is None:
+                sk = cell[mid] = cls()
+            sk.merge(src)
+
+    def add_processed(self, r):
+        """Relevé traité (valeurs exactes) : dimensions croisées ou période courte."""
+        if not self.wants_exact or not self._in_range(r.date_heure):
+            return
+        key = self._raw_cell_key(r)
+        cell = self.sketches[key]
+        self.result[key]
+        for _metric, _agg, mid, (_col, attr, kind) in self.sketch_metrics:
+            ex = cell.get(mid)
+            if ex is None:
+                ex = cell[mid] = _SKETCH_CLASSES[kind][1]()
+            ex.add(tuple(getattr(r, a) for a in attr) if isinstance(attr, tuple) else getattr(r, attr))
+
+    def add_anomalie(self, a):
+        if not self.wants_anomalies or not self._in_range(a.date):
+            return
+        x_key = _anomalie_dim_key(self.x_axis, a, self.fam_map, self.x_date_group)
+        if x_key is None:
+            x_key = '?'
+        s_key = _anomalie_dim_key(self.serie_dim, a, self.fam_map) if self.serie_dim in ('parc', 'personne', 'produit', 'famille') else None
+        if s_key is None:
+            s_key = '__global__'
+        self.series_keys.add(s_key)
+        self.result[(x_key, s_key)]['nb_anomalies_count'] += 1
+
+    def _metric_ids(self):
+        """(mid, agg) de chaque métrique tel que stocké dans result."""
+        out = []
+        for ym in self.y_metrics:
+            met = ym.get('metric', 'quantite')
+            agg = ym.get('agg', 'sum')
+            out.append(('nb_anomalies_count', 'count') if met == 'nb_anomalies' else (met + '_' + agg, agg))
+        return out
+
+    def _fold_top_n(self, series_list):
+        """
+        Garde les top_n séries (classées par total de la première métrique) et regroupe les autres
+        dans « Autres ». Fait avant le calcul des moyennes pour que avg / max restent exacts.
+        """
+        if not self.top_n or len(series_list) <= self.top_n:
+            return series_list
+        metric_ids = self._metric_ids()
+        rank_mid = metric_ids[0][0]
+        totals = defaultdict(float)
+        if any(mid == rank_mid for _m, _a, mid, _s in self.sketch_metrics):
+            # résumés : classement par nombre de valeurs (quantiles) ou de valeurs distinctes
+            for (x_key, s_key), cell in self.sketches.items():
+                sk = cell.get(rank_mid)
+                totals[s_key] += sk.count if sk is not None else 0
+        else:
+            for (x_key, s_key), vals in self.result.items():
+                totals[s_key] += abs(vals.get(rank_mid, 0))
+        ranked = sorted(series_list, key=lambda sk: (-totals.get(sk, 0), sk))
+        keep, rest = ranked[:self.top_n], set(ranked[self.top_n:])
+        for key in [k for k in self.result if k[1] in rest]:
+            vals = self.result.pop(key)
+            target = (key[0], AUTRES_SERIE)
+            cell = self.result[target]
+            for mid, agg in metric_ids:
+                if mid not in vals:
+                    continue
+                if agg == 'max':
+                    cell[mid] = max(cell.get(mid, 0), vals[mid])
+                else:
+                    cell[mid] += vals[mid]
+            self.counts[target] += self.counts.pop(key, 0)
+            target_q = self.sketches[target]
+            for mid, sk in self.sketches.pop(key, {}).items():
+                if mid in target_q:
+                    target_q[mid].merge(sk)
+                else:
+                    target_q[mid] = sk
+        return sorted(keep) + [AUTRES_SERIE]
+
+    def columns(self):
+        """
+        (labels, générateur de (label, couleur, valeurs)) : vecteur d'abscisses partagé par toutes les séries,
+        valeurs produites série par série (pas de structure intermédiaire par dataset).
+        """
+        series_list = sorted(s for s in self.series_keys if s != '__global__') or ['__global__']
+
+        # Filtrer les séries si serie_filter fourni (sélectionner quelles machines/personnes/produits afficher)
+        if self.serie_filter and len(self.serie_filter) > 0:
+            allowed = set(self.serie_filter)
+            series_list = [s for s in series_list if s in allowed]
+        if series_list != ['__global__']:
+            series_list = self._fold_top_n(series_list)
+
+        result = self.result
+        if self.has_avg:
+            for key, vals in result.items():
+                c = self.counts.get(key, 0)
+                for metric, agg, mid in self.raw_metrics:
+                    if agg == 'avg' and mid in vals and c > 0:
+                        vals[mid] = vals[mid] / c
+        for key, cell in self.sketches.items():
+            vals = result[key]
+            for _metric, agg, mid, (_col, _attr, kind) in self.sketch_metrics:
+                sk = cell.get(mid)
+                if sk is None:
+                    continue
+                if kind == 'quantile':
+                    v = sk.quantile(QUANTILE_AGGS[agg])
+                elif kind == 'ratio':
+                    v = sk.value
+                else:
+                    v = sk.count
+                if v is not None:
+                    vals[mid] = v
+
+        x_labels = sorted(set(k[0] for k in result.keys()))
+
+        specs = []
+        for i, s_key in enumerate(series_list):
+            for ym in self.y_metrics:
+                agg = ym.get('agg', 'sum')
+                met = ym.get('metric', 'quantite')
+                mid = met + '_' + agg
+                if met == 'nb_anomalies':
+                    mid = 'nb_anomalies_count'
+                label = ym.get('label') or f"{met} ({agg})"
+                if s_key != '__global__':
+                    label = f"{s_key} - {label}"
+                specs.append((s_key, mid, label, CHART_COLORS[(i + len(specs)) % len(CHART_COLORS)]))
+
+        empty = {}
+
+        def _values(s_key, mid):
+            out = []
+            for x in x_labels:
+                val = result.get((x, s_key), empty).get(mid, 0)
+                out.append(round(val, 2) if isinstance(val, float) else val)
+            return out
+
+        # Axe date long : sous-échantillonnage côté serveur (payload et rendu bornés)
+        idx = None
+        if self.max_points and self.x_axis == 'date' and len(x_labels) > self.max_points and specs:
+            idx = _downsample_indices(x_labels, (_values(sk, mid) for sk, mid, _l, _c in specs), self.max_points)
+
+        def _series():
+            for s_key, mid, label, color in specs:
+                data = _values(s_key, mid)
+                if idx is not None:
+                    data = [data[i] for i in idx]
+                yield label, color, data
+
+        labels = [x_labels[i] for i in idx] if idx is not None else x_labels
+        return labels, _series()
+
+    def to_columnar(self):
+        """{'labels', 'series': [{'label', 'color'}], 'values': [[...]]} : une seule copie des abscisses et métadonnées."""
+        labels, series = self.columns()
+        meta, values = [], []
+        for label, color, data in series:
+            meta.append({'label': label, 'color': color})
+            values.append(data)
+        return {'labels': labels, 'series': meta, 'values': values}
+
+
+def columnar_to_chartjs(col):
+    """Structure {'labels', 'datasets'} attendue par Chart.js à partir du format colonnes."""
+    return {
+        'labels': col['labels'],
+        'datasets': [{
+            'label': meta['label'],
+            'data': data,
+            'borderColor': meta['color'],
+            'backgroundColor': meta['color'] + '33',
+            'tension': 0.2,
+            'fill': False,
+        } for meta, data in zip(col['series'], col['values'])],
+    }
+
+
+def iter_ndjson(labels, series):
+    """NDJSON : une ligne d'en-tête (abscisses) puis une ligne par série, produites au fil de l'eau."""
+    import json
+    yield json.dumps({'labels': labels}, ensure_ascii=False) + '\n'
+    for label, color, data in series:
+        yield json.dumps({'label': label, 'color': color, 'data': data}, ensure_ascii=False) + '\n'
+
+
+def _iter_raw_rows(date_from=None, date_to=None):
+    """Lignes RawData (colonnes utiles aux indicateurs) sur la période."""
+    q = db.session.query(
+        RawData.date_heure,
+        RawData.parc,
+        RawData.personne,
+        RawData.produit,
+        RawData.quantite,
+        RawData.compteur,
+        RawData.cuve_num,
+        db.func.coalesce(RawData.quantite_conso, RawData.quantite).label('quantite_conso'),
+    )
+    q = _date_filter(q, RawData, date_from, date_to)
+    return q.yield_per(2000)
+
+
+def _iter_daily_aggregates(dim, date_from=None, date_to=None):
+    """Agrégats journaliers d'une dimension sur la période."""
+    q = db.session.query(
+        DailyAggregate.jour,
+        DailyAggregate.valeur,
+        DailyAggregate.quantite_sketch,
+        DailyAggregate.km_sketch,
+        DailyAggregate.parcs_hll,
+        DailyAggregate.personnes_hll,
+        DailyAggregate.efficacite_quantite,
+        DailyAggregate.efficacite_compteur,
+        DailyAggregate.efficacite_h_quantite,
+        DailyAggregate.efficacite_h_compteur,
+    )
+    q = q.filter(DailyAggregate.dim == dim)
+    if date_from:
+        q = q.filter(DailyAggregate.jour >= date_from)
+    if date_to:
+        q = q.filter(DailyAggregate.jour <= date_to)
+    for r in q.yield_per(2000):
+        yield _DailyRow(dim, r)
+
+
+def _iter_processed_rows(date_from=None, date_to=None):
+    """Relevés traités (quantité, km entre pleins, parc, personne) avec la cuve du relevé brut, pour le mode exact."""
+    unite = db.func.lower(db.func.trim(RawData.unite))
+    km = ProcessedData.efficacite.isnot(None) & (unite == 'km')
+    heures = ProcessedData.efficacite.isnot(None) & (unite == 'h')
+    q = db.session.query(
+        ProcessedData.date_heure,
+        ProcessedData.parc,
+        ProcessedData.personne,
+        ProcessedData.produit,
+        ProcessedData.quantite,
+        ProcessedData.km_entre_pleins,
+        db.case((km, ProcessedData.quantite)).label('efficacite_quantite'),
+        db.case((km, ProcessedData.km_entre_pleins / EFFICACITE_UNITES['km'][0])).label('efficacite_compteur'),
+        db.case((heures, ProcessedData.quantite)).label('efficacite_h_quantite'),
+        db.case((heures, ProcessedData.km_entre_pleins / EFFICACITE_UNITES['h'][0])).label('efficacite_h_compteur'),
+        RawData.cuve_num,
+    ).join(RawData, RawData.id == ProcessedData.raw_data_id)
+    q = _date_filter(q, ProcessedData, date_from, date_to)
+    return q.yield_per(2000)
+
+
+def _iter_anomalies(date_from=None, date_to=None, user_id=None):
+    """Anomalies sur la période (filtrées selon la config de l'utilisateur, incl. produits)."""
+    q = db.session.query(Anomalie.date, Anomalie.machine, Anomalie.personne, Anomalie.type_anomalie)
+    q = _date_filter(q, Anomalie, date_from, date_to)
+    if user_id:
+        q = q.filter(get_anomalie_filter_conditions(user_id, for_include_in_count=True))
+    return q.yield_per(2000)
+
+
+def _run_accumulators(accs, user_id=None):
+    """
+    Un seul scan RawData et un seul scan Anomalie (période englobante) alimentent toutes les configs ;
+    quantiles et valeurs distinctes lisent les agrégats journaliers (un scan par dimension) ou, en mode exact, processed_data.
+    """
+    raw_accs = [a for a in accs if a.wants_raw]
+    if raw_accs:
+        for r in _iter_raw_rows(*_union_range(raw_accs)):
+            for a in raw_accs:
+                a.add_raw(r)
+    sketch_accs = defaultdict(list)
+    for a in accs:
+        if a.wants_sketches:
+            sketch_accs[a.sketch_dim].append(a)
+    for dim, dim_accs in sketch_accs.items():
+        for d in _iter_daily_aggregates(dim, *_union_range(dim_accs)):
+            for a in dim_accs:
+                a.add_daily(d)
+    exact_accs = [a for a in accs if a.wants_exact]
+    if exact_accs:
+        for r in _iter_processed_rows(*_union_range(exact_accs)):
+            for a in exact_accs:
+                a.add_processed(r)
+    anom_accs = [a for a in accs if a.wants_anomalies]
+    if anom_accs:
+        for an in _iter_anomalies(*_union_range(anom_accs), user_id=user_id):
+            for a in anom_accs:
+                a.add_anomalie(an)
+
+
+def _union_range(accs):
+    """Période (date_from, date_to) couvrant toutes les configs (None = borne ouverte)."""
+    starts = [a.start for a in accs]
+    ends = [a.end for a in accs]
+    date_from = None if any(v is None for v in starts) else min(starts).date()
+    date_to = None if any(v is None for v in ends) else max(ends).date()
+    return date_from, date_to
+
+
+def _make_accumulator(x_axis, x_date_group, y_metrics, serie_dim, date_from=None, date_to=None, serie_filter=None,
+                      top_n=None, max_points=None, fam_map=None):
+    return _IndicatorAccumulator(
+        x_axis, x_date_group, y_metrics or [{'metric': 'quantite', 'agg': 'sum'}], serie_dim, date_from, date_to, serie_filter,
+        fam_map=fam_map if fam_map is not None else get_parc_to_famille_nom_map(), top_n=top_n, max_points=max_points)
+
+
+def get_indicator_columns(x_axis, x_date_group, y_metrics, serie_dim, date_from=None, date_to=None, serie_filter=None, user_id=None,
+                          top_n=None, max_points=None):
+    """Comme get_indicator_data, mais retourne (labels, générateur de séries) pour une réponse en flux."""
+    acc = _make_accumulator(x_axis, x_date_group, y_metrics, serie_dim, date_from, date_to, serie_filter, top_n, max_points)
+    _run_accumulators([acc], user_id)
+    return acc.columns()
+
+
+def get_indicator_columnar(x_axis, x_date_group, y_metrics, serie_dim, date_from=None, date_to=None, serie_filter=None, user_id=None,
+                           top_n=None, max_points=None):
+    """Comme get_indicator_data, au format colonnes (voir _IndicatorAccumulator.to_columnar)."""
+    acc = _make_accumulator(x_axis, x_date_group, y_metrics, serie_dim, date_from, date_to, serie_filter, top_n, max_points)
+    _run_accumulators([acc], user_id)
+    return acc.to_columnar()
+
+
+def get_indicator_data(x_axis, x_date_group, y_metrics, serie_dim, date_from=None, date_to=None, serie_filter=None, user_id=None,
+                       top_n=None, max_points=None):
     """
     Retourne les données agrégées pour le graphique.
     
     x_axis: 'date' | 'parc' | 'personne' | 'produit' | 'site' | 'cuve' | 'famille' | 'type_anomalie'
     x_date_group: 'jour' | 'semaine' | 'mois' | 'annee' (si x_axis=date)
-    y_metrics: liste de {'metric': ..., 'agg': ...}
+    y_metrics: liste de {'metric': ..., 'agg': ...}. Servis par les agrégats journaliers :
+        agg 'median' | 'p90' | 'p99' pour 'quantite' et 'km_entre_pleins' (±1 %),
+        'nb_machines_distinctes' / 'nb_personnes_distinctes' (HyperLogLog, ±1,6 %),
+        'efficacite' en L/100 km et 'efficacite_h' en L/h (Σ quantité / Σ écart compteur sur les intervalles sans anomalie).
+        Calcul exact si deux dimensions autres que la date se croisent ou si la période fait moins de EXACT_MAX_DAYS jours.
     serie_dim: None | 'parc' | 'personne' | 'produit' | 'site' | 'cuve' | 'famille'
     serie_filter: liste optionnelle de valeurs à inclure (ex: ['Parc1','Parc2']). Si fournie, seules ces séries sont affichées.
+    top_n: garde les N séries les plus fortes (total de la première métrique), le reste est regroupé dans « Autres ».
+    max_points: si x_axis=date, limite le nombre de points (LTTB + min/max de chaque série).
+    """
+    return columnar_to_chartjs(get_indicator_columnar(
+        x_axis, x_date_group, y_metrics, serie_dim, date_from, date_to, serie_filter, user_id, top_n, max_points))
+
+
+def get_indicator_data_batch(configs, user_id=None, columnar=False):
+    """
+    Calcule plusieurs configurations d'indicateurs en un seul passage sur les données.
+    configs : liste de dicts avec les mêmes clés que les paramètres de get_indicator_data.
+    Retourne la liste des résultats dans le même ordre (format colonnes si columnar=True).
     """
-    result = defaultdict(lambda: defaultdict(float))
-    series_keys = set()
-    camions = get_camion_cuve_parcs_set()
-    seuil_camion = get_camion_cuve_seuil_litres()
     fam_map = get_parc_to_famille_nom_map()
-    
-    # Mapping colonnes RawData
-    raw_col_map = {
-        'quantite': RawData.quantite,
-        'compteur': RawData.compteur,
-        'parc': RawData.parc,
-        'personne': RawData.personne,
-        'produit': RawData.produit,
-    }
-    
-    # Données carburant (RawData)
-    if any(m['metric'] != 'nb_anomalies' for m in y_metrics):
-        q = db.session.query(
-            RawData.date_heure,
-            RawData.parc,
-            RawData.personne,
-            RawData.produit,
-            RawData.quantite,
-            RawData.compteur,
-            RawData.cuve_num,
-        )
-        q = _date_filter(q, RawData, date_from, date_to)
-        rows = q.all()
-        
-        for r in rows:
-            # Clé axe X
-            if x_axis == 'date':
-                x_key = _truncate_date(r.date_heure, x_date_group or 'jour')
-            elif x_axis == 'parc':
-                x_key = str(r.parc or '')
-            elif x_axis == 'personne':
-                x_key = str(r.personne or '(vide)')
-            elif x_axis == 'produit':
-                x_key = str(r.produit or '(vide)')
-            elif x_axis == 'site':
-                x_key = cuve_num_to_site(r.cuve_num) or '(non renseigné)'
-            elif x_axis == 'cuve':
-                x_key = format_cuve_label(r.cuve_num)
-            elif x_axis == 'famille':
-                x_key = famille_label_for_parc(r.parc, fam_map)
-            else:
-                x_key = '?'
-            
-            # Clé série (ou None pour une seule courbe)
-            if serie_dim:
-                if serie_dim == 'parc':
-                    s_key = str(r.parc or '')
-                elif serie_dim == 'personne':
-                    s_key = str(r.personne or '(vide)')
-                elif serie_dim == 'produit':
-                    s_key = str(r.produit or '(vide)')
-                elif serie_dim == 'site':
-                    s_key = cuve_num_to_site(r.cuve_num) or '(non renseigné)'
-                elif serie_dim == 'cuve':
-                    s_key = format_cuve_label(r.cuve_num)
-                elif serie_dim == 'famille':
-                    s_key = famille_label_for_parc(r.parc, fam_map)
-                else:
-                    s_key = 'Global'
-            else:
-                s_key = '__global__'
-            
-            series_keys.add(s_key)
-            
-            # Agrégation des métriques
-            for ym in y_metrics:
-                if ym.get('metric') == 'nb_anomalies':
-                    continue
-                mid = ym.get('metric', 'quantite') + '_' + ym.get('agg', 'sum')
-                val = 0
-                if ym['metric'] == 'quantite':
-                    val = float(r.quantite or 0)
-                elif ym['metric'] == 'quantite_conso':
-                    val = effective_quantite_conso_carburant(
-                        r.parc, r.quantite, r.cuve_num, camions, seuil_camion)
-                elif ym['metric'] == 'compteur':
-                    val = float(r.compteur or 0)
-                elif ym['metric'] == 'nb_releves':
-                    val = 1
-                
-                if ym['agg'] == 'sum':
-                    result[(x_key, s_key)][mid] += val
-                elif ym['agg'] == 'avg':
-                    result[(x_key, s_key)][mid] += val  # on va diviser par count après
-                elif ym['agg'] == 'count' or ym['metric'] == 'nb_releves':
-                    result[(x_key, s_key)][mid] += 1
-                elif ym['agg'] == 'max':
-                    cur = result[(x_key, s_key)].get(mid, 0)
-                    result[(x_key, s_key)][mid] = max(cur, val)
-    
-    # Compter les rows pour avg
-    counts = defaultdict(lambda: defaultdict(int))
-    if any(m.get('agg') == 'avg' for m in y_metrics):
-        q = db.session.query(
-            RawData.date_heure,
-            RawData.parc,
-            RawData.personne,
-            RawData.produit,
-            RawData.cuve_num,
-        )
-        q = _date_filter(q, RawData, date_from, date_to)
-        for r in q.all():
-            if x_axis == 'date':
-                x_key = _truncate_date(r.date_heure, x_date_group or 'jour')
-            elif x_axis == 'parc':
-                x_key = str(r.parc or '')
-            elif x_axis == 'personne':
-                x_key = str(r.personne or '(vide)')
-            elif x_axis == 'produit':
-                x_key = str(r.produit or '(vide)')
-            elif x_axis == 'site':
-                x_key = cuve_num_to_site(r.cuve_num) or '(non renseigné)'
-            elif x_axis == 'cuve':
-                x_key = format_cuve_label(r.cuve_num)
-            elif x_axis == 'famille':
-                x_key = famille_label_for_parc(r.parc, fam_map)
-            else:
-                x_key = '?'
-            if serie_dim == 'parc':
-                s_key = str(r.parc or '')
-            elif serie_dim == 'personne':
-                s_key = str(r.personne or '(vide)')
-            elif serie_dim == 'produit':
-                s_key = str(r.produit or '(vide)')
-            elif serie_dim == 'site':
-                s_key = cuve_num_to_site(r.cuve_num) or '(non renseigné)'
-            elif serie_dim == 'cuve':
-                s_key = format_cuve_label(r.cuve_num)
-            elif serie_dim == 'famille':
-                s_key = famille_label_for_parc(r.parc, fam_map)
-            else:
-                s_key = '__global__'
-            counts[(x_key, s_key)] += 1
-    
-    for (x_key, s_key), vals in result.items():
-        c = counts.get((x_key, s_key), 0)
-        for ym in y_metrics:
-            if ym['metric'] == 'nb_anomalies':
-                continue
-            mid = ym['metric'] + '_' + ym.get('agg', 'sum')
-            if ym.get('agg') == 'avg' and mid in vals and c > 0:
-                vals[mid] = vals[mid] / c
-    
-    # Anomalies (filtrées selon la config de l'utilisateur, incl. produits)
-    if any(m.get('metric') == 'nb_anomalies' for m in y_metrics):
-        q = Anomalie.query
-        q = _date_filter(q, Anomalie, date_from, date_to)
-        if user_id:
-            filter_cond = get_anomalie_filter_conditions(user_id, for_include_in_count=True)
-            q = q.filter(filter_cond)
-        anomalies = q.all()
-        
-        for a in anomalies:
-            if x_axis == 'date':
-                x_key = _truncate_date(a.date, x_date_group or 'jour')
-            elif x_axis == 'parc':
-                x_key = str(a.machine or '')
-            elif x_axis == 'personne':
-                x_key = str(a.personne or '(vide)')
-            elif x_axis == 'produit':
-                x_key = '(vide)'  # anomalie n'a pas produit
-            elif x_axis == 'type_anomalie':
-                x_key = str(a.type_anomalie or '')
-            elif x_axis == 'famille':
-                x_key = famille_label_for_parc(a.machine, fam_map)
-            else:
-                x_key = '?'
-            
-            if serie_dim == 'parc':
-                s_key = str(a.machine or '')
-            elif serie_dim == 'personne':
-                s_key = str(a.personne or '(vide)')
-            elif serie_dim == 'produit':
-                s_key = '(vide)'
-            elif serie_dim == 'famille':
-                s_key = famille_label_for_parc(a.machine, fam_map)
-            else:
-                s_key = '__global__'
-            
-            series_keys.add(s_key)
-            result[(x_key, s_key)]['nb_anomalies_count'] += 1
-    
-    # Construire la réponse structurée
-    x_labels = sorted(set(k[0] for k in result.keys()))
-    series_list = sorted(s for s in series_keys if s != '__global__') or ['__global__']
-    
-    # Filtrer les séries si serie_filter fourni (sélectionner quelles machines/personnes/produits afficher)
-    if serie_filter and len(serie_filter) > 0:
-        allowed = set(serie_filter)
-        series_list = [s for s in series_list if s in allowed]
-    
-    datasets = []
-    colors = [
-        '#3498db', '#27ae60', '#e74c3c', '#f39c12', '#9b59b6',
-        '#1abc9c', '#e67e22', '#34495e', '#16a085', '#c0392b'
+    accs = [
+        _make_accumulator(
+            c.get('x_axis', 'date'), c.get('x_date_group'), c.get('y_metrics'), c.get('serie_dim'),
+            c.get('date_from'), c.get('date_to'), c.get('serie_filter'), c.get('top_n'), c.get('max_points'), fam_map=fam_map)
+        for c in configs
     ]
-    
-    for i, s_key in enumerate(series_list):
-        for ym in y_metrics:
-            agg = ym.get('agg', 'sum')
-            met = ym.get('metric', 'quantite')
-            mid = met + '_' + agg
-            if met == 'nb_anomalies':
-                mid = 'nb_anomalies_count'
-            label = ym.get('label') or f"{met} ({agg})"
-            if s_key != '__global__':
-                label = f"{s_key} - {label}"
-            
-            data = []
-            for x in x_labels:
-                val = result.get((x, s_key), {}).get(mid, 0)
-                data.append(round(val, 2) if isinstance(val, float) else val)
-            
-            color = colors[(i + len(datasets)) % len(colors)]
-            datasets.append({
-                'label': label,
-                'data': data,
-                'borderColor': color,
-                'backgroundColor': color + '33',
-                'tension': 0.2,
-                'fill': False,
-            })
-    
-    return {
-        'labels': x_labels,
-        'datasets': datasets,
-    }
+    _run_accumulators(accs, user_id)
+    cols = [a.to_columnar() for a in accs]
+    return cols if columnar else [columnar_to_chartjs(c) for c in cols]
 
 
 def get_available_values(dimension, date_from=None, date_to=None):
     """Retourne les valeurs distinctes pour une dimension (parc, personne, produit, site, cuve)."""
     q = db.session.query
+    # parc / personne / produit / famille : dictionnaires (plages first_seen / last_seen), sans scan de raw_data
     if dimension == 'parc':
-        base = q(RawData.parc).distinct().filter(RawData.parc != '')
-        base = _date_filter(base, RawData, date_from, date_to)
-        rows = base.order_by(RawData.parc).all()
-        return [r[0] for r in rows if r[0]]
+        return get_dimension_values('parc', date_from, date_to)
     if dimension == 'personne':
-        base = q(RawData.personne).distinct()
-        base = _date_filter(base, RawData, date_from, date_to)
-        rows = base.order_by(RawData.personne).all()
-        return [r[0] if r[0] else '(vide)' for r in rows]
+        return [v or '(vide)' for v in get_dimension_values('personne', date_from, date_to, include_empty=True)]
     if dimension == 'produit':
-        base = q(RawData.produit).distinct().filter(RawData.produit != '')
-        base = _date_filter(base, RawData, date_from, date_to)
-        rows = base.order_by(RawData.produit).all()
-        return [r[0] for r in rows if r[0]]
+        return get_dimension_values('produit', date_from, date_to)
     if dimension == 'site':
         base = q(RawData.cuve_num).distinct()
         base = _date_filter(base, RawData, date_from, date_to)
@@ -340,11 +708,5 @@ def get_available_values(dimension, date_from=None, date_to=None):
         return sorted(out)
     if dimension == 'famille':
         m = get_parc_to_famille_nom_map()
-        base = q(RawData.parc).distinct().filter(RawData.parc != '')
-        base = _date_filter(base, RawData, date_from, date_to)
-        rows = base.all()
-        labs = set()
-        for r in rows:
-            labs.add(famille_label_for_parc(r[0], m))
-        return sorted(labs)
+        return sorted({famille_label_for_parc(p, m) for p in get_dimension_values('parc', date_from, date_to)})
     return []
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+"""Applique les migrations de schéma en attente sans démarrer l'application (ex. avant un déploiement).
+Usage: py migrate.py"""
+import sys
+
+
+def main():
+    from flask import Flask
+    from database import SCHEMA_VERSION, get_schema_version, init_db
+
+    app = Flask(__name__)
+    init_db(app)
+    with app.app_context():
+        version = get_schema_version()
+    print(f"Schéma à la version {version}/{SCHEMA_VERSION}")
+    return 0 if version == SCHEMA_VERSION else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
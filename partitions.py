@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+Partitionnement mensuel (PostgreSQL, si PG_PARTITIONING=1) de raw_data et anomalies par plage de dates.
+Les requêtes bornées en date ne lisent que les mois concernés ; archiver une année revient à détacher
+ses partitions au lieu d'un gros DELETE. Sans effet sur SQLite.
+Usage: py partitions.py creer [--mois-avance N]
+       py partitions.py detacher AAAA-MM   (détache les mois antérieurs puis recalcule le traitement)
+"""
+import argparse
+import logging
+import sys
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from database import db, RawData, Anomalie
+
+# table → (modèle, colonne de partitionnement)
+PARTITIONED_TABLES = {
+    'raw_data': (RawData, 'date_heure'),
+    'anomalies': (Anomalie, 'date'),
+}
+# Mois créés d'avance au-delà du mois courant (et du dernier mois importé)
+PARTITION_MONTHS_AHEAD = 3
+
+logger = logging.getLogger(__name__)
+
+
+def _month(d):
+    return date(d.year, d.month, 1)
+
+
+def _next_month(m):
+    return date(m.year + (m.month == 12), m.month % 12 + 1, 1)
+
+
+def _months(start, end):
+    """Premiers jours des mois de start à end inclus."""
+    m = _month(start)
+    while m <= end:
+        yield m
+        m = _next_month(m)
+
+
+def partition_name(table, month):
+    return f"{table}_{month.year}{month.month:02d}"
+
+
+def is_postgresql(conn):
+    return conn.dialect.name == 'postgresql'
+
+
+def is_partitioned(conn, table):
+    return conn.execute(text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :t"
+    ), {'t': table}).first() is not None
+
+
+def _partitions(conn, table):
+    return {r[0] for r in conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+        "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :t"
+    ), {'t': table})}
+
+
+def _create_month(conn, table, column, month):
+    """
+    Crée la partition d'un mois : table autonome, lignes du mois reprises de la partition par défaut
+    (sinon l'attachement échouerait), puis rattachement.
+    """
+    name = partition_name(table, month)
+    start, end = month, _next_month(month)
+    conn.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(
+        f"WITH moved AS (DELETE FROM {table}_default WHERE {column} >= :s AND {column} < :e RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved"
+    ), {'s': start, 'e': end})
+    conn.execute(text(
+        f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+
+
+def ensure_partitions(conn, date_min=None, date_max=None, months_ahead=PARTITION_MONTHS_AHEAD):
+    """
+    Crée les partitions mensuelles manquantes de date_min (défaut : mois courant) jusqu'à
+    months_ahead mois après max(date_max, aujourd'hui). conn : connexion ou session (même transaction
+    que l'import qui suit). Sans effet hors PostgreSQL ou sur une table non partitionnée.
+    """
+    if not is_postgresql(conn):
+        return
+    today = date.today()
+    if isinstance(date_min, datetime):
+        date_min = date_min.date()
+    if isinstance(date_max, datetime):
+        date_max = date_max.date()
+    last = max(date_max or today, today)
+    for _ in range(months_ahead):
+        last = _next_month(_month(last))
+    for table, (_model, column) in PARTITIONED_TABLES.items():
+        if not is_partitioned(conn, table):
+            continue
+        existing = _partitions(conn, table)
+        for month in _months(date_min or today, last):
+            if partition_name(table, month) not in existing:
+                _create_month(conn, table, column, month)
+
+
+def _convert_table(conn, table, model, column):
+    """
+    Remplace une table ordinaire par une table partitionnée par mois (mêmes colonnes, séquence, index,
+    clés étrangères sortantes) et y recopie les lignes. La clé primaire devient (id, colonne de date) ;
+    les clés étrangères qui pointaient vers la table sont retirées (non supportées sans la date).
+    """
+    old = f"{table}_unpartitioned"
+    for referencing, conname in conn.execute(text(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint WHERE confrelid = CAST(:t AS regclass) AND contype = 'f'"
+    ), {'t': table}).all():
+        conn.execute(text(f'ALTER TABLE {referencing} DROP CONSTRAINT "{conname}"'))
+    foreign_keys = [r[0] for r in conn.execute(text(
+        "SELECT pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = CAST(:t AS regclass) AND contype = 'f'"
+    ), {'t': table})]
+    sequence = conn.execute(text("SELECT pg_get_serial_sequence(:t, 'id')"), {'t': table}).scalar()
+    bounds = conn.execute(text(f"SELECT MIN({column}), MAX({column}) FROM {table}")).first()
+
+    conn.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY NONE"))  # survit à la suppression de l'ancienne table
+    conn.execute(text(
+        f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ({column})"
+    ))
+    conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+    if bounds[0] is not None:
+        ensure_partitions(conn, bounds[0], bounds[1])
+    conn.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+    conn.execute(text(f"DROP TABLE {old}"))  # libère aussi les noms de clé primaire et d'index
+    conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, {column})"))
+    if sequence:
+        conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    for definition in foreign_keys:
+        conn.execute(text(f"ALTER TABLE {table} ADD {definition}"))
+    for index in model.__table__.indexes:  # schéma final : appelé après les migrations (init_db)
+        index.create(conn)  # index partitionné : décliné sur chaque partition
+
+
+def partition_tables():
+    """Convertit raw_data et anomalies en tables partitionnées (PostgreSQL, une seule fois) puis crée les mois à venir."""
+    with db.engine.begin() as conn:
+        if not is_postgresql(conn):
+            return
+        for table, (model, column) in PARTITIONED_TABLES.items():
+            if not is_partitioned(conn, table):
+                _convert_table(conn, table, model, column)
+                logger.info("Table %s partitionnée par mois", table)
+        ensure_partitions(conn)
+
+
+def detach_before(month):
+    """
+    Détache (sans les supprimer) les partitions mensuelles antérieures à month : les lignes quittent
+    raw_data / anomalies instantanément et restent consultables dans les tables <table>_AAAAMM.
+    Retourne les noms des partitions détachées.
+    """
+    month = _month(month)
+    detached = []
+    with db.engine.begin() as conn:
+        if not is_postgresql(conn):
+            raise RuntimeError("Le détachement de partitions nécessite PostgreSQL.")
+        for table in PARTITIONED_TABLES:
+            for name in sorted(_partitions(conn, table)):
+                suffix = name[len(table) + 1:]
+                if len(suffix) == 6 and suffix.isdigit() and date(int(suffix[:4]), int(suffix[4:]), 1) < month:
+                    conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name}"))
+                    detached.append(name)
+    return detached
+
+
+def main(argv=None):
+    from flask import Flask
+    from database import init_db
+
+    parser = argparse.ArgumentParser(description="Partitions mensuelles MADIC (PostgreSQL).")
+    sub = parser.add_subparsers(dest='action', required=True)
+    creer = sub.add_parser('creer', help="crée les partitions des mois à venir")
+    creer.add_argument('--mois-avance', type=int, default=PARTITION_MONTHS_AHEAD)
+    detacher = sub.add_parser('detacher', help="détache les mois antérieurs à AAAA-MM (archivage)")
+    detacher.add_argument('mois', type=lambda s: datetime.strptime(s, '%Y-%m').date())
+    args = parser.parse_args(argv)
+
+    app = Flask(__name__)
+    init_db(app)
+    with app.app_context():
+        if args.action == 'creer':
+            with db.engine.begin() as conn:
+                ensure_partitions(conn, months_ahead=args.mois_avance)
+            return 0
+        names = detach_before(args.mois)
+        if names:
+            from dimensions import rebuild_dimensions
+            from processor import process_all_machines
+            rebuild_dimensions()
+            process_all_machines()  # traitement, agrégats et version des données
+        print(f"{len(names)} partition(s) détachée(s) : {', '.join(names) or '-'}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
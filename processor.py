@@ -6,37 +6,46 @@ from database import (
     RawData,
     ProcessedData,
     Anomalie,
+    anomalie_type_fields,
     get_jump_threshold,
     get_compteur_zero_excluded_products,
     get_camion_cuve_parcs_set,
+    bump_data_version,
 )
+from aggregates import DailyAggregateBuilder
+from config import EFFICACITE_UNITES, compteur_unite
 
 
 def process_all_machines():
     """
     Traite toutes les machines : tri par date, calcul des diff, détection anomalies.
-    Supprime et régénère processed_data et anomalies.
+    Supprime et régénère processed_data, anomalies et agrégats journaliers.
     """
     ProcessedData.query.delete()
     Anomalie.query.delete()
     
-    parcs = db.session.query(RawData.parc).distinct().all()
-    parcs = [p[0] for p in parcs]
+    parc_ids = [p[0] for p in db.session.query(RawData.parc_id).distinct().all()]
     camion_cuve_parcs = get_camion_cuve_parcs_set()
+    aggregates = DailyAggregateBuilder()
 
-    for parc in parcs:
-        _process_machine(parc, camion_cuve_parcs)
+    for parc_id in parc_ids:
+        _process_machine(parc_id, camion_cuve_parcs, aggregates)
     
+    aggregates.save()
     db.session.commit()
+    bump_data_version()
 
 
-def _process_machine(parc, camion_cuve_parcs):
-    """Traite une machine : tri, calculs, anomalies.
+def _process_machine(parc_id, camion_cuve_parcs, aggregates=None):
+    """Traite une machine (id du dictionnaire des parcs) : tri, calculs, anomalies.
     Produits exclus (ex: ADB) : pas d'anomalie compteur zero, et on "saute" ces relevés
     pour le calcul des diff (on utilise les 2 relevés normaux qui entourent).
     Camions cuve : pas d'anomalies sur le compteur (remplissage sans relevé km/temps fiable).
     """
-    rows = RawData.query.filter_by(parc=parc).order_by(RawData.date_heure).all()
+    rows = RawData.query.filter_by(parc_id=parc_id).order_by(RawData.date_heure).all()
+    if not rows:
+        return
+    parc = rows[0].parc
     excluded_products = get_compteur_zero_excluded_products()
     is_camion_cuve = parc in camion_cuve_parcs
     
@@ -52,14 +61,37 @@ def _process_machine(parc, camion_cuve_parcs):
             compteur_before = prev_normal.compteur
             prev_date = prev_normal.date_heure
             diff_compteur = compteur_after - compteur_before
+            km_entre_pleins = None if is_excluded else diff_compteur
         else:
             compteur_before = row.compteur
             prev_date = prev.date_heure if prev else None
             diff_compteur = 0
+            km_entre_pleins = None
         
         quantite_before = prev.quantite if prev else row.quantite
         quantite_after = row.quantite
         
+        # Détection des anomalies (skip_compteur_zero pour produits exclus)
+        anomalies = _detect_anomalies(
+            parc=parc,
+            date=row.date_heure,
+            prev_date=prev_date,
+            personne=row.personne,
+            produit=row.produit,
+            compteur_before=compteur_before,
+            compteur_after=compteur_after,
+            quantite_before=quantite_before,
+            quantite_after=quantite_after,
+            diff_compteur=diff_compteur,
+            skip_compteur_zero=is_excluded,
+            is_camion_cuve=is_camion_cuve,
+        )
+        # Efficacité (L/100 km ou L/h selon le compteur) : seulement sur un intervalle mesurable et sans anomalie
+        unite = compteur_unite(row.unite)
+        efficacite = None
+        if unite and km_entre_pleins is not None and km_entre_pleins > 0 and not anomalies and not is_camion_cuve:
+            efficacite = quantite_after * EFFICACITE_UNITES[unite][0] / km_entre_pleins
+        
         pd_row = ProcessedData(
             raw_data_id=row.id,
             parc=parc,
@@ -74,27 +106,17 @@ def _process_machine(parc, camion_cuve_parcs):
             compteur_before=compteur_before,
             compteur_after=compteur_after,
             diff_compteur=diff_compteur,
+            km_entre_pleins=km_entre_pleins,
+            efficacite=efficacite,
         )
         db.session.add(pd_row)
+        if aggregates is not None:
+            aggregates.add(row, km_entre_pleins, unite if efficacite is not None else None)
         
-        # Détection des anomalies (skip_compteur_zero pour produits exclus)
-        anomalies = _detect_anomalies(
-            parc=parc,
-            date=row.date_heure,
-            prev_date=prev_date,
-            personne=row.personne,
-            produit=row.produit,
-            compteur_before=compteur_before,
-            compteur_after=compteur_after,
-            quantite_before=quantite_before,
-            quantite_after=quantite_after,
-            diff_compteur=diff_compteur,
-            skip_compteur_zero=is_excluded,
-            is_camion_cuve=is_camion_cuve,
-        )
         # Pour les relevés exclus (ex: ADB), on ne crée aucune anomalie (compteur non fiable)
         if not is_excluded:
             for a in anomalies:
+                a.machine_id, a.personne_id, a.produit_id = row.parc_id, row.personne_id, row.produit_id
                 db.session.add(a)
         
         prev = row
@@ -114,7 +136,7 @@ def _detect_anomalies(parc, date, prev_date, personne, produit=None,
     # 1. Zero quantity
     if quantite_after == 0:
         anomalies.append(Anomalie(
-            machine=parc, type_anomalie='Zero quantity', produit=produit, date=date, prev_date=prev_date,
+            machine=parc, **anomalie_type_fields('zero_quantity'), produit=produit, date=date, prev_date=prev_date,
             personne=personne, compteur_before=compteur_before, compteur_after=compteur_after,
             quantite_before=quantite_before, quantite_after=quantite_after,
             details='Quantité égale à 0'
@@ -126,7 +148,7 @@ def _detect_anomalies(parc, date, prev_date, personne, produit=None,
     # 2. Compteur decreased
     if prev_date is not None and compteur_after < compteur_before:
         anomalies.append(Anomalie(
-            machine=parc, type_anomalie='Compteur decreased', produit=produit, date=date, prev_date=prev_date,
+            machine=parc, **anomalie_type_fields('compteur_decreased'), produit=produit, date=date, prev_date=prev_date,
             personne=personne, compteur_before=compteur_before, compteur_after=compteur_after,
             quantite_before=quantite_before, quantite_after=quantite_after,
             details=f'Compteur a baissé de {compteur_before} à {compteur_after}'
@@ -136,7 +158,7 @@ def _detect_anomalies(parc, date, prev_date, personne, produit=None,
     threshold = get_jump_threshold()
     if prev_date is not None and diff_compteur > threshold:
         anomalies.append(Anomalie(
-            machine=parc, type_anomalie=f'Jump >{threshold}', produit=produit, date=date, prev_date=prev_date,
+            machine=parc, **anomalie_type_fields('jump', threshold), produit=produit, date=date, prev_date=prev_date,
             personne=personne, compteur_before=compteur_before, compteur_after=compteur_after,
             quantite_before=quantite_before, quantite_after=quantite_after,
             details=f'Saut de {diff_compteur} km (seuil: {threshold})'
@@ -145,7 +167,7 @@ def _detect_anomalies(parc, date, prev_date, personne, produit=None,
     # 4. Compteur == 0 (sauf produits exclus comme ADB où le compteur n'est pas demandé)
     if compteur_after == 0 and not skip_compteur_zero:
         anomalies.append(Anomalie(
-            machine=parc, type_anomalie='Compteur zero', produit=produit, date=date, prev_date=prev_date,
+            machine=parc, **anomalie_type_fields('compteur_zero'), produit=produit, date=date, prev_date=prev_date,
             personne=personne, compteur_before=compteur_before, compteur_after=compteur_after,
             quantite_before=quantite_before, quantite_after=quantite_after,
             details='Compteur à 0'
@@ -154,7 +176,7 @@ def _detect_anomalies(parc, date, prev_date, personne, produit=None,
     # 5. Compteur identique malgré un plein (quantité > 0 mais diff = 0)
     if prev_date is not None and quantite_after > 0 and diff_compteur == 0:
         anomalies.append(Anomalie(
-            machine=parc, type_anomalie='Compteur identique malgré plein', produit=produit, date=date, prev_date=prev_date,
+            machine=parc, **anomalie_type_fields('compteur_identique'), produit=produit, date=date, prev_date=prev_date,
             personne=personne, compteur_before=compteur_before, compteur_after=compteur_after,
             quantite_before=quantite_before, quantite_after=quantite_after,
             details=f'Quantité {quantite_after} mais compteur inchangé'
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""
+Cache des rapports PDF / Excel sur disque (REPORTS_FOLDER), adressé par contenu :
+un fichier par (format, période, config anomalies, version des données), généré en tâche de fond
+et réutilisé tant que rien ne change. Le dossier est plafonné en taille (éviction LRU).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cache import make_cache_key
+from config import REPORTS_MAX_BYTES
+from database import get_data_version, get_user_anomalie_config_hash
+
+REPORT_EXTENSIONS = {'pdf': 'pdf', 'excel': 'xlsx'}
+REPORT_PREFIX = 'rapport_madic_'
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='rapports')
+_jobs_lock = threading.RLock()  # réentrant : add_done_callback peut rappeler _forget_job aussitôt
+_jobs = {}  # clé → Future de la génération en cours (ou terminée en erreur)
+
+
+def report_key(fmt, date_from=None, date_to=None, user_id=None, variant=None):
+    """
+    Clé d'un rapport : même période, même config anomalies et mêmes données → même fichier.
+    variant : déclinaison du rapport (ex. découpage du PDF par machine / par site).
+    """
+    return make_cache_key(
+        'rapport', fmt, variant, date_from, date_to, get_user_anomalie_config_hash(user_id), get_data_version(),
+    )
+
+
+def report_path(folder, fmt, key):
+    return os.path.join(folder, f"{REPORT_PREFIX}{key[:20]}.{REPORT_EXTENSIONS[fmt]}")
+
+
+def _touch(path):
+    """Marque le fichier comme récemment utilisé (ordre LRU = date de modification)."""
+    try:
+        os.utime(path, None)
+    except OSError:
+        pass
+
+
+def evict_reports(folder, max_bytes=REPORTS_MAX_BYTES, keep=None):
+    """Supprime les rapports les moins récemment utilisés jusqu'à repasser sous max_bytes (keep : jamais supprimé)."""
+    entries = []
+    for name in os.listdir(folder):
+        if not name.startswith(REPORT_PREFIX) or '.tmp.' in name:
+            continue
+        path = os.path.join(folder, name)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        entries.append((st.st_mtime, st.st_size, path))
+    total = sum(size for _m, size, _p in entries)
+    for _mtime, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def _tmp_path(path):
+    root, ext = os.path.splitext(path)
+    return f"{root}.{threading.get_ident()}.tmp{ext}"  # extension conservée (choix du moteur Excel)
+
+
+def _build(app, generate, path, date_from, date_to, user_id):
+    """Tâche de fond : génère dans un fichier temporaire puis le renomme (jamais de fichier partiel visible)."""
+    tmp = _tmp_path(path)
+    try:
+        with app.app_context():
+            generate(date_from, date_to, user_id, filepath=tmp)
+        os.replace(tmp, path)
+        evict_reports(os.path.dirname(path), keep=path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
+
+
+def find_report(app, fmt, date_from=None, date_to=None, user_id=None, variant=None):
+    """(clé, chemin du rapport en cache ou None)."""
+    key = report_key(fmt, date_from, date_to, user_id, variant)
+    path = report_path(app.config['REPORTS_FOLDER'], fmt, key)
+    if os.path.exists(path):
+        _touch(path)
+        return key, path
+    return key, None
+
+
+def stream_into_cache(app, fmt, key, chunks):
+    """
+    Relaie un rapport produit en flux (blocs d'octets) et l'enregistre dans le cache une fois complet.
+    Flux interrompu (client parti, erreur) : rien n'est conservé et la production est arrêtée.
+    """
+    path = report_path(app.config['REPORTS_FOLDER'], fmt, key)
+    tmp = _tmp_path(path)
+    try:
+        with open(tmp, 'wb') as f:
+            for chunk in chunks:
+                f.write(chunk)
+                yield chunk
+        os.replace(tmp, path)
+        evict_reports(os.path.dirname(path), keep=path)
+    finally:
+        chunks.close()
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+def get_or_start_report(app, fmt, generate, date_from=None, date_to=None, user_id=None, variant=None):
+    """
+    Rapport en cache ou lancement de sa génération en tâche de fond.
+    generate(date_from, date_to, user_id, filepath=…) écrit le rapport (déclinaison variant déjà appliquée).
+    Retourne (clé, chemin si disponible sinon None, Future de la génération sinon None).
+    """
+    key, path = find_report(app, fmt, date_from, date_to, user_id, variant)
+    if path is not None:
+        return key, path, None
+    path = report_path(app.config['REPORTS_FOLDER'], fmt, key)
+    with _jobs_lock:
+        future = _jobs.get(key)
+        if future is None or (future.done() and future.exception() is not None):
+            future = _executor.submit(_build, app, generate, path, date_from, date_to, user_id)
+            _jobs[key] = future
+            future.add_done_callback(lambda f, k=key: _forget_job(k, f))
+    return key, None, future
+
+
+def _forget_job(key, future):
+    """Une génération réussie n'a plus besoin d'être suivie : le fichier fait foi."""
+    if future.exception() is None:
+        with _jobs_lock:
+            if _jobs.get(key) is future:
+                del _jobs[key]
+
+
+def report_status(key):
+    """État d'une génération : 'pending', 'error' (message) ou 'done' (terminée ou inconnue : relire le cache)."""
+    with _jobs_lock:
+        future = _jobs.get(key)
+    if future is None:
+        return 'done', None
+    if not future.done():
+        return 'pending', None
+    exc = future.exception()
+    return ('error', str(exc)) if exc is not None else ('done', None)
@@ -1,18 +1,31 @@
 # -*- coding: utf-8 -*-
 """Génération de rapports PDF et Excel."""
+import io
 import os
+from collections import namedtuple
 from datetime import datetime, date
 from types import SimpleNamespace
 from flask import current_app
 from reportlab.lib import colors
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.styles import getSampleStyleSheet
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, LongTable, PageBreak, TableStyle
 from reportlab.lib.units import cm
-from database import db, RawData, Anomalie, get_anomalie_filter_conditions, get_camion_cuve_parcs_set, get_camion_cuve_seuil_litres
-from consumption import effective_quantite_conso_carburant
-from config import format_cuve_label, cuve_num_to_site, STOCK_ROULANT_CUVE_IDS
-from sqlalchemy import func, or_
+from database import (
+    db, RawData, ProcessedData, Anomalie, DailyAggregate, CamionCuve, get_anomalie_filter_conditions,
+    anomalie_type_name, get_camion_cuve_seuil_litres, get_data_version, get_user_anomalie_config_hash,
+)
+from cache import make_cache_key, stats_cache, chart_cache
+from streaming import iter_written
+from dimensions import (
+    ID_COLUMNS, dimension_condition, get_dimension_ids, get_dimension_values, get_leaderboard, count_leaderboard,
+)
+from config import format_cuve_label, cuve_num_to_site, STOCK_ROULANT_CUVE_IDS, EFFICACITE_UNITES
+from sqlalchemy import case, func, literal, or_, select, tuple_
+
+
+# Nombre d'entrées affichées d'emblée dans les classements du tableau de bord (la suite est paginée)
+DASHBOARD_TOP_N = 20
 
 
 def _date_filter(query, model, date_from=None, date_to=None):
@@ -28,359 +41,436 @@ def _date_filter(query, model, date_from=None, date_to=None):
     return query
 
 
-def _person_filter_condition(personne_col, person_filter):
-    """
-    Filtre SQLAlchemy sur la colonne personne.
-    Les listes du dashboard peuvent contenir '(vide)' pour les lignes sans nom.
-    """
-    if not person_filter or len(person_filter) == 0:
-        return None
-    pieces = []
-    noms = []
-    for p in person_filter:
-        if p == '(vide)':
-            pieces.append(or_(personne_col == '', personne_col.is_(None)))
-        else:
-            noms.append(p)
-    if noms:
-        pieces.append(personne_col.in_(noms))
-    if not pieces:
-        return None
-    return or_(*pieces) if len(pieces) > 1 else pieces[0]
-
-
 def get_stats(machine_filter=None, person_filter=None, user_id=None, date_from=None, date_to=None):
     """
     Retourne les statistiques pour le dashboard.
     - Total carburant et nombre d'anomalies : uniquement selon la période (filtre du haut de page).
     - Listes « machines suivies » / « personnes suivies » : filtres d'affichage (cases à cocher),
       sur tout l'historique ; elles ne modifient pas le total ni le décompte d'anomalies.
+      Seules les DASHBOARD_TOP_N premières entrées des classements sont lues (suite : get_dashboard_leaderboard).
+    Résultat en cache par (utilisateur, config anomalies, filtres, version des données).
     """
-    camions = get_camion_cuve_parcs_set()
-    seuil_camion = get_camion_cuve_seuil_litres()
-
-    q_total = db.session.query(RawData.parc, RawData.quantite, RawData.cuve_num)
+    key = make_cache_key(
+        'stats', user_id, get_user_anomalie_config_hash(user_id), sorted(machine_filter or []),
+        sorted(person_filter or []), date_from, date_to, get_data_version(),
+    )
+    return stats_cache.get_or_compute(
+        key, lambda: _compute_stats(machine_filter, person_filter, user_id, date_from, date_to))
+
+
+def _compute_stats(machine_filter=None, person_filter=None, user_id=None, date_from=None, date_to=None):
+    """Calcul de get_stats : une requête d'agrégats sur raw_data, une sur anomalies (+ listes suivies)."""
+    # quantite_conso est matérialisée à l'import (règle camion cuve) : simple SUM côté SQL ;
+    # le nombre de camions cuve configurés vient dans la même requête
+    q_total = db.session.query(
+        func.count(RawData.id),
+        func.sum(RawData.quantite),
+        func.sum(func.coalesce(RawData.quantite_conso, RawData.quantite)),
+        db.session.query(func.count(CamionCuve.parc)).scalar_subquery(),
+    )
     q_total = _date_filter(q_total, RawData, date_from, date_to)
-    rows_total = q_total.all()
-    nb_releves_carburant = len(rows_total)
-    total_carburant_brut = sum(float(r.quantite or 0) for r in rows_total)
-    if not camions:
-        total_carburant = total_carburant_brut
-    else:
-        total_carburant = sum(
-            effective_quantite_conso_carburant(
-                r.parc, r.quantite, r.cuve_num, camions, seuil_camion)
-            for r in rows_total
-        )
-
-    # Machines suivies : toutes les données (pas de filtre période), filtre machines = affichage
-    q_mach = db.session.query(
-        RawData.parc, db.func.sum(RawData.quantite).label('total')
-    ).group_by(RawData.parc).order_by(db.desc('total'))
-    if machine_filter and len(machine_filter) > 0:
-        q_mach = q_mach.filter(RawData.parc.in_(machine_filter))
-    top_machines = q_mach.all()
-
-    # Personnes suivies : idem, filtre personnes = affichage
-    q_pers = db.session.query(
-        RawData.personne, db.func.sum(RawData.quantite).label('total')
-    ).filter(RawData.personne != '').group_by(RawData.personne).order_by(db.desc('total'))
-    if person_filter and len(person_filter) > 0:
-        pcond = _person_filter_condition(RawData.personne, person_filter)
-        if pcond is not None:
-            q_pers = q_pers.filter(pcond)
-    top_personnes = q_pers.all()
-
-    q_anom = Anomalie.query.filter(get_anomalie_filter_conditions(user_id, for_include_in_count=True))
-    q_anom = _date_filter(q_anom, Anomalie, date_from, date_to)
-    nb_anomalies = q_anom.count()
+    row_total = q_total.first()
+    nb_releves_carburant = int(row_total[0] or 0)
+    total_carburant_brut = float(row_total[1] or 0)
+    total_carburant = float(row_total[2] or 0)
+    camions_cuve_configures = bool(row_total[3])
+
+    # Machines / personnes suivies : classements tenus à jour à l'import (tout l'historique), filtres = affichage
+    top_machines = get_dashboard_leaderboard('parc', machine_filter, limit=DASHBOARD_TOP_N)
+    top_personnes = get_dashboard_leaderboard('personne', person_filter, limit=DASHBOARD_TOP_N)
 
+    # Décompte par type et total en une requête (le filtre config utilisateur n'est construit qu'une fois)
     anomalies_par_type = []
     if user_id:
         q_types = db.session.query(
-            Anomalie.type_anomalie,
+            Anomalie.type_key,
+            Anomalie.threshold,
             func.count(Anomalie.id).label('cnt'),
         ).filter(get_anomalie_filter_conditions(user_id, for_include_in_count=True))
         q_types = _date_filter(q_types, Anomalie, date_from, date_to)
-        anomalies_par_type = (
-            q_types.group_by(Anomalie.type_anomalie)
+        anomalies_par_type = [
+            (anomalie_type_name(code, threshold), cnt)
+            for code, threshold, cnt in q_types.group_by(Anomalie.type_key, Anomalie.threshold)
             .order_by(func.count(Anomalie.id).desc())
             .all()
-        )
+        ]
+    nb_anomalies = sum(cnt for _typ, cnt in anomalies_par_type)
 
     return {
         'total_carburant': total_carburant,
         'total_carburant_brut': total_carburant_brut,
         'nb_releves_carburant': nb_releves_carburant,
-        'camions_cuve_configures': bool(camions),
-        'seuil_camion_litres': seuil_camion,
+        'camions_cuve_configures': camions_cuve_configures,
+        'seuil_camion_litres': get_camion_cuve_seuil_litres(),
         'top_machines': top_machines,
+        'nb_machines': count_dashboard_leaderboard('parc', machine_filter),
         'top_personnes': top_personnes,
+        'nb_personnes': count_dashboard_leaderboard('personne', person_filter),
         'nb_anomalies': nb_anomalies,
         'anomalies_par_type': anomalies_par_type,
     }
 
 
+_LEADERBOARD_ATTR = {'parc': 'parc', 'personne': 'personne', 'cuve': 'cuve'}
+
+
+def _leaderboard_filter(dimension, display_filter):
+    """(valeurs, vide) : valeurs du filtre d'affichage ; vide=True si le filtre ne retient aucune entrée classée."""
+    if not display_filter:
+        return None, False
+    values = [v for v in display_filter if v != '(vide)']  # personnes sans nom : hors classement
+    return values, not values
+
+
+def get_dashboard_leaderboard(dimension, display_filter=None, limit=None, offset=0):
+    """
+    Classement 'parc' | 'personne' | 'cuve' par quantité totale : objets (parc|personne|cuve, total, nb, last_seen).
+    Pour 'cuve', l'attribut cuve est le n° (int) ou None (sans cuve).
+    """
+    values, none_left = _leaderboard_filter(dimension, display_filter)
+    if none_left:
+        return []
+    attr = _LEADERBOARD_ATTR[dimension]
+    out = []
+    for valeur, total, nb, last_seen in get_leaderboard(
+            dimension, limit=limit, offset=offset, values=values, exclude_empty=dimension == 'personne'):
+        if dimension == 'cuve':
+            valeur = int(valeur) if valeur else None
+        out.append(SimpleNamespace(**{attr: valeur}, total=float(total or 0), nb=int(nb or 0), last_seen=last_seen))
+    return out
+
+
+def count_dashboard_leaderboard(dimension, display_filter=None):
+    """Nombre d'entrées de get_dashboard_leaderboard (sans limite)."""
+    values, none_left = _leaderboard_filter(dimension, display_filter)
+    if none_left:
+        return 0
+    return count_leaderboard(dimension, values=values, exclude_empty=dimension == 'personne')
+
+
 def get_all_machines_for_filter():
     """Retourne la liste de toutes les machines (pour le filtre du dashboard)."""
-    rows = db.session.query(RawData.parc).distinct().filter(RawData.parc != '').order_by(RawData.parc).all()
-    return [r[0] for r in rows if r[0]]
+    return get_dimension_values('parc')
 
 
 def get_all_personnes_for_filter():
     """Retourne la liste de toutes les personnes (pour le filtre du dashboard)."""
-    rows = db.session.query(RawData.personne).distinct().filter(RawData.personne != '').order_by(RawData.personne).all()
-    return [r[0] or '(vide)' for r in rows]
+    return get_dimension_values('personne')
 
 
 def get_all_produits_for_filter():
     """Retourne la liste de tous les produits (pour la config anomalies par produit)."""
-    rows = db.session.query(RawData.produit).distinct().filter(RawData.produit != '').filter(RawData.produit.isnot(None)).order_by(RawData.produit).all()
-    return [r[0] for r in rows if r[0]]
+    return get_dimension_values('produit')
 
 
-def get_consumption_by_machine(date_from=None, date_to=None):
-    """Tableau des consommations par machine (optionnel: filtre par dates)."""
+ConsumptionByMachine = namedtuple('ConsumptionByMachine', ['parc', 'quantite_totale', 'nb_releves'])
+ConsumptionByPerson = namedtuple('ConsumptionByPerson', ['personne', 'quantite_totale', 'nb_releves'])
+
+
+def _consumption_by(dimension, date_from=None, date_to=None):
+    """(valeur, quantité, nb relevés) par valeur d'une dimension : regroupement sur l'id entier, libellés du dictionnaire."""
+    _model, id_col = ID_COLUMNS[dimension]
     q = db.session.query(
-        RawData.parc,
+        id_col,
         db.func.sum(RawData.quantite).label('quantite_totale'),
         db.func.count(RawData.id).label('nb_releves')
     )
     q = _date_filter(q, RawData, date_from, date_to)
-    return q.group_by(RawData.parc).order_by(db.desc('quantite_totale')).all()
+    labels = get_dimension_ids(dimension)[1]
+    return [(labels.get(i, ''), total, nb) for i, total, nb in q.group_by(id_col).order_by(db.desc('quantite_totale')).all()]
+
+
+def get_consumption_by_machine(date_from=None, date_to=None):
+    """Tableau des consommations par machine (optionnel: filtre par dates)."""
+    return [ConsumptionByMachine(*r) for r in _consumption_by('parc', date_from, date_to)]
 
 
 def get_consumption_by_person(date_from=None, date_to=None):
     """Tableau des consommations par personne (optionnel: filtre par dates)."""
+    return [ConsumptionByPerson(*r) for r in _consumption_by('personne', date_from, date_to) if r[0]]
+
+
+DetailDateTotal = namedtuple('DetailDateTotal', ['dt', 'total'])
+
+
+def _detail_pass(conditions, date_from=None, date_to=None, breakdowns=()):
+    """
+    Agrégats des relevés filtrés (conditions sur RawData + période) en une seule requête : GROUP BY jour et
+    ids entiers des dimensions de breakdowns ('parc', 'personne', 'produit'), repliés ensuite en totaux,
+    première / dernière date, totaux par jour et répartitions. Chaque répartition est une liste de
+    (valeur, total) triée par total décroissant (valeurs vides exclues, sauf 'parc' qui est toujours renseigné).
+    """
+    jour = func.date(RawData.date_heure)
+    id_cols = [ID_COLUMNS[b][1] for b in breakdowns]
     q = db.session.query(
-        RawData.personne,
-        db.func.sum(RawData.quantite).label('quantite_totale'),
-        db.func.count(RawData.id).label('nb_releves')
-    ).filter(RawData.personne != '')
-    q = _date_filter(q, RawData, date_from, date_to)
-    return q.group_by(RawData.personne).order_by(db.desc('quantite_totale')).all()
+        jour,
+        *id_cols,
+        func.count(RawData.id),
+        func.sum(RawData.quantite),
+        func.sum(func.coalesce(RawData.quantite_conso, RawData.quantite)),
+        func.min(RawData.date_heure),
+        func.max(RawData.date_heure),
+    ).filter(*conditions)
+    result = SimpleNamespace(nb=0, total=0.0, total_conso=0.0, date_min=None, date_max=None, by_date=[])
+    by_date = {}
+    by_id = [{} for _b in breakdowns]
+    for row in _date_filter(q, RawData, date_from, date_to).group_by(jour, *id_cols):
+        dt, ids = row[0], row[1:1 + len(id_cols)]
+        nb, total, total_conso, first, last = row[1 + len(id_cols):]
+        total = total or 0
+        result.nb += nb
+        result.total += total
+        result.total_conso += total_conso or 0
+        if result.date_min is None or first < result.date_min:
+            result.date_min = first
+        if result.date_max is None or last > result.date_max:
+            result.date_max = last
+        day = str(dt)[:10]  # SQLite : texte, PostgreSQL : date
+        by_date[day] = by_date.get(day, 0) + total
+        for totals, dim_id in zip(by_id, ids):
+            totals[dim_id] = totals.get(dim_id, 0) + total
+    result.by_date = [DetailDateTotal(day, by_date[day]) for day in sorted(by_date)]
+    for b, id_totals in zip(breakdowns, by_id):
+        labels = get_dimension_ids(b)[1]
+        totals = {}
+        for dim_id, t in id_totals.items():
+            label = labels.get(dim_id, '')
+            if label or b == 'parc':
+                totals[label] = totals.get(label, 0) + t
+        setattr(result, b, sorted(totals.items(), key=lambda kv: (-kv[1], kv[0])))
+    return result
+
+
+# Tableaux paginés par clé (anomalies, relevés) : taille de page par défaut et plafond accepté par l'API
+KEYSET_PAGE_SIZE = 50
+MAX_KEYSET_PAGE_SIZE = 500
+
+# Périmètres des tableaux paginés (None = toutes les anomalies, page /rapports)
+KEYSET_SCOPES = ('machine', 'personne', 'cuve')
+
+
+def encode_keyset_cursor(dt, row_id):
+    """Curseur opaque « date ISO_id » désignant la dernière ligne affichée."""
+    return f"{dt.isoformat()}_{row_id}"
+
+
+def decode_keyset_cursor(cursor):
+    """(date, id) d'un curseur, ou None s'il est absent ou invalide (première page)."""
+    if not cursor:
+        return None
+    try:
+        dt_s, id_s = str(cursor).rsplit('_', 1)
+        return datetime.fromisoformat(dt_s), int(id_s)
+    except (TypeError, ValueError):
+        return None
 
 
-def get_anomalies_detail(date_from=None, date_to=None, user_id=None):
-    """Tableau détaillé des anomalies (optionnel: filtre par dates, par config user)."""
-    q = Anomalie.query
+def _keyset_page(query, date_col, id_col, cursor=None, limit=KEYSET_PAGE_SIZE):
+    """
+    Page suivante d'une requête triée par (date, id) décroissants :
+    WHERE (date, id) < curseur ORDER BY date DESC, id DESC LIMIT n (+1 pour savoir s'il reste des lignes).
+    Coût indépendant de la profondeur de page (pas d'OFFSET). Retourne (lignes, curseur suivant ou None).
+    """
+    key = decode_keyset_cursor(cursor)
+    if key is not None:
+        query = query.filter(tuple_(date_col, id_col) < tuple_(literal(key[0]), literal(key[1])))
+    rows = query.order_by(date_col.desc(), id_col.desc()).limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_keyset_cursor(getattr(last, date_col.key), getattr(last, id_col.key))
+
+
+def _cuve_condition(cuve_num):
+    return RawData.cuve_num.is_(None) if cuve_num is None else RawData.cuve_num == cuve_num
+
+
+def _anomalies_query(scope=None, value=None, date_from=None, date_to=None, user_id=None, entities=None):
+    """
+    Anomalies d'un périmètre (machine, personne, cuve ou toutes) sur la période, filtrées selon la config user.
+    Cuve : anomalies des machines servies par cette cuve sur la période.
+    """
+    q = db.session.query(*entities) if entities else Anomalie.query
+    if scope == 'machine':
+        q = q.filter(dimension_condition(Anomalie.machine_id, 'parc', value))
+    elif scope == 'personne':
+        q = q.filter(dimension_condition(Anomalie.personne_id, 'personne', value))
+    elif scope == 'cuve':
+        parcs = _date_filter(select(RawData.parc_id).where(_cuve_condition(value)), RawData, date_from, date_to)
+        q = q.filter(Anomalie.machine_id.in_(parcs.distinct()))
     q = _date_filter(q, Anomalie, date_from, date_to)
     if user_id:
-        filter_cond = get_anomalie_filter_conditions(user_id, for_include_in_count=False)
-        q = q.filter(filter_cond)
-    return q.order_by(Anomalie.date.desc()).all()
+        q = q.filter(get_anomalie_filter_conditions(user_id, for_include_in_count=False))
+    return q
 
 
-def get_machine_detail(parc, date_from=None, date_to=None, user_id=None):
-    """Données détaillées pour une machine (parc). Les anomalies sont filtrées selon la config user."""
-    q = db.session.query(
+def get_anomalies_page(scope=None, value=None, date_from=None, date_to=None, user_id=None,
+                       cursor=None, limit=KEYSET_PAGE_SIZE):
+    """Page d'anomalies (plus récentes d'abord) après cursor : (anomalies, curseur suivant ou None)."""
+    q = _anomalies_query(scope, value, date_from, date_to, user_id)
+    return _keyset_page(q, Anomalie.date, Anomalie.id, cursor, limit)
+
+
+def get_anomalies_by_type(scope=None, value=None, date_from=None, date_to=None, user_id=None):
+    """
+    Nombre d'anomalies par type du périmètre : [(type, nb)] trié par nb décroissant.
+    Sert de total aux tableaux paginés (somme) et au graphique des types ; en cache par version des données.
+    """
+    key = make_cache_key(
+        'anomalies_par_type', scope, value, user_id, get_user_anomalie_config_hash(user_id),
+        date_from, date_to, get_data_version(),
+    )
+
+    def compute():
+        q = _anomalies_query(scope, value, date_from, date_to, user_id,
+                             entities=(Anomalie.type_key, Anomalie.threshold, func.count(Anomalie.id)))
+        rows = q.group_by(Anomalie.type_key, Anomalie.threshold).all()
+        return sorted(((anomalie_type_name(code, threshold), int(n)) for code, threshold, n in rows),
+                      key=lambda r: (-r[1], r[0]))
+
+    return stats_cache.get_or_compute(key, compute)
+
+
+def _releves_query(scope, value):
+    """Relevés d'un périmètre avec les colonnes affichées dans sa page détail."""
+    if scope == 'machine':
+        return db.session.query(
+            RawData.id,
+            RawData.date_heure,
+            RawData.personne,
+            RawData.produit,
+            RawData.quantite,
+            RawData.compteur,
+            ProcessedData.efficacite,
+            case(*(((ProcessedData.efficacite.isnot(None)) & (func.lower(func.trim(RawData.unite)) == unite), libelle)
+                   for unite, (_par, libelle) in EFFICACITE_UNITES.items())).label('efficacite_unite'),
+        ).outerjoin(ProcessedData, ProcessedData.raw_data_id == RawData.id).filter(
+            dimension_condition(RawData.parc_id, 'parc', value))
+    if scope == 'personne':
+        return db.session.query(
+            RawData.id,
+            RawData.date_heure,
+            RawData.parc,
+            RawData.produit,
+            RawData.quantite,
+            RawData.compteur,
+        ).filter(dimension_condition(RawData.personne_id, 'personne', value))
+    return db.session.query(
+        RawData.id,
         RawData.date_heure,
+        RawData.parc,
         RawData.personne,
         RawData.produit,
         RawData.quantite,
         RawData.compteur,
-    ).filter(RawData.parc == parc)
-    q = _date_filter(q, RawData, date_from, date_to)
-    releves = q.order_by(RawData.date_heure).all()
-    
-    q2 = db.session.query(
-        RawData.parc,
-        db.func.sum(RawData.quantite).label('total'),
-        db.func.count(RawData.id).label('nb'),
-    ).filter(RawData.parc == parc)
-    q2 = _date_filter(q2, RawData, date_from, date_to)
-    stats = q2.group_by(RawData.parc).first()
-    
-    q3 = db.session.query(
-        RawData.personne,
-        db.func.sum(RawData.quantite).label('total'),
-    ).filter(RawData.parc == parc).filter(RawData.personne != '')
-    q3 = _date_filter(q3, RawData, date_from, date_to)
-    by_personne = q3.group_by(RawData.personne).order_by(db.desc('total')).all()
-    
-    q4 = Anomalie.query.filter(Anomalie.machine == parc)
-    q4 = _date_filter(q4, Anomalie, date_from, date_to)
-    if user_id:
-        filter_cond = get_anomalie_filter_conditions(user_id, for_include_in_count=False)
-        q4 = q4.filter(filter_cond)
-    anomalies = q4.order_by(Anomalie.date.desc()).all()
+        RawData.cuve_num,
+    ).filter(_cuve_condition(value))
+
+
+def get_releves_page(scope, value, date_from=None, date_to=None, cursor=None, limit=KEYSET_PAGE_SIZE):
+    """Page de relevés (plus récents d'abord) d'une machine, personne ou cuve : (relevés, curseur suivant ou None)."""
+    q = _date_filter(_releves_query(scope, value), RawData, date_from, date_to)
+    return _keyset_page(q, RawData.date_heure, RawData.id, cursor, limit)
+
+
+def _detail_anomalies(scope, value, date_from=None, date_to=None, user_id=None, limit=20):
+    """Première page d'anomalies d'une page détail, avec décompte par type (cache)."""
+    anomalies, cursor = get_anomalies_page(scope, value, date_from, date_to, user_id, limit=limit)
+    by_type = get_anomalies_by_type(scope, value, date_from, date_to, user_id)
+    return {
+        'anomalies': anomalies,
+        'anomalies_cursor': cursor,
+        'anomalies_by_type': by_type,
+        'nb_anomalies': sum(n for _t, n in by_type),
+    }
+
+
+def get_machine_detail(parc, date_from=None, date_to=None, user_id=None, releves_limit=50, anomalies_limit=20):
+    """
+    Données détaillées pour une machine (parc). Les anomalies sont filtrées selon la config user.
+    releves / anomalies : premières pages (plus récents d'abord) ; la suite via get_releves_page / get_anomalies_page.
+    """
+    scan = _detail_pass([dimension_condition(RawData.parc_id, 'parc', parc)], date_from, date_to, breakdowns=('personne',))
+    releves, releves_cursor = get_releves_page('machine', parc, date_from, date_to, limit=releves_limit)
+    anomalies = _detail_anomalies('machine', parc, date_from, date_to, user_id, anomalies_limit)
     
-    q5 = db.session.query(
-        func.date(RawData.date_heure).label('dt'),
-        db.func.sum(RawData.quantite).label('total'),
-    ).filter(RawData.parc == parc)
-    q5 = _date_filter(q5, RawData, date_from, date_to)
-    by_date = q5.group_by(func.date(RawData.date_heure)).order_by('dt').all()
+    # Efficacité : cumul journalier calculé au traitement (intervalles sans anomalie), par unité de compteur
+    q6 = db.session.query(
+        DailyAggregate.jour,
+        DailyAggregate.efficacite_quantite,
+        DailyAggregate.efficacite_compteur,
+        DailyAggregate.efficacite_h_quantite,
+        DailyAggregate.efficacite_h_compteur,
+    ).filter(DailyAggregate.dim == 'parc', DailyAggregate.valeur == parc,
+             or_(DailyAggregate.efficacite_compteur > 0, DailyAggregate.efficacite_h_compteur > 0))
+    if date_from:
+        q6 = q6.filter(DailyAggregate.jour >= date_from)
+    if date_to:
+        q6 = q6.filter(DailyAggregate.jour <= date_to)
+    efficacites = {unite: [0.0, 0.0, []] for unite in EFFICACITE_UNITES}  # unité → [Σ quantité, Σ écart, [(jour, efficacité)]]
+    for jour, quantite_km, compteur_km, quantite_h, compteur_h in q6.order_by(DailyAggregate.jour).all():
+        for unite, quantite, compteur in (('km', quantite_km, compteur_km), ('h', quantite_h, compteur_h)):
+            if compteur:
+                cumul = efficacites[unite]
+                cumul[0] += quantite
+                cumul[1] += compteur
+                cumul[2].append((jour, quantite / compteur))
     
     return {
         'parc': parc,
-        'stats': stats,
+        'stats': SimpleNamespace(parc=parc, total=scan.total, nb=scan.nb) if scan.nb else None,
         'releves': releves,
-        'by_personne': by_personne,
-        'anomalies': anomalies,
-        'by_date': by_date,
+        'releves_cursor': releves_cursor,
+        'by_personne': scan.personne,
+        **anomalies,
+        'by_date': scan.by_date,
+        # [(libellé d'unité, efficacité sur la période, [(jour, efficacité)])] : compteurs km puis horaires
+        'efficacites': [(EFFICACITE_UNITES[unite][1], quantite / compteur, by_date)
+                        for unite, (quantite, compteur, by_date) in efficacites.items() if compteur],
     }
 
 
-def get_person_detail(personne, date_from=None, date_to=None, user_id=None):
-    """Données détaillées pour une personne. Les anomalies sont filtrées selon la config user."""
-    q = db.session.query(
-        RawData.date_heure,
-        RawData.parc,
-        RawData.produit,
-        RawData.quantite,
-        RawData.compteur,
-    ).filter(RawData.personne == personne)
-    q = _date_filter(q, RawData, date_from, date_to)
-    releves = q.order_by(RawData.date_heure).all()
-    
-    q2 = db.session.query(
-        RawData.personne,
-        db.func.sum(RawData.quantite).label('total'),
-        db.func.count(RawData.id).label('nb'),
-    ).filter(RawData.personne == personne)
-    q2 = _date_filter(q2, RawData, date_from, date_to)
-    stats = q2.group_by(RawData.personne).first()
-    
-    q3 = db.session.query(
-        RawData.parc,
-        db.func.sum(RawData.quantite).label('total'),
-    ).filter(RawData.personne == personne)
-    q3 = _date_filter(q3, RawData, date_from, date_to)
-    by_machine = q3.group_by(RawData.parc).order_by(db.desc('total')).all()
-    
-    q4 = Anomalie.query.filter(Anomalie.personne == personne)
-    q4 = _date_filter(q4, Anomalie, date_from, date_to)
-    if user_id:
-        filter_cond = get_anomalie_filter_conditions(user_id, for_include_in_count=False)
-        q4 = q4.filter(filter_cond)
-    anomalies = q4.order_by(Anomalie.date.desc()).all()
-    
-    q5 = db.session.query(
-        func.date(RawData.date_heure).label('dt'),
-        db.func.sum(RawData.quantite).label('total'),
-    ).filter(RawData.personne == personne)
-    q5 = _date_filter(q5, RawData, date_from, date_to)
-    by_date = q5.group_by(func.date(RawData.date_heure)).order_by('dt').all()
+def get_person_detail(personne, date_from=None, date_to=None, user_id=None, releves_limit=50, anomalies_limit=20):
+    """
+    Données détaillées pour une personne. Les anomalies sont filtrées selon la config user.
+    releves / anomalies : premières pages (plus récents d'abord) ; la suite via get_releves_page / get_anomalies_page.
+    """
+    scan = _detail_pass([dimension_condition(RawData.personne_id, 'personne', personne)], date_from, date_to,
+                        breakdowns=('parc',))
+    releves, releves_cursor = get_releves_page('personne', personne, date_from, date_to, limit=releves_limit)
+    anomalies = _detail_anomalies('personne', personne, date_from, date_to, user_id, anomalies_limit)
     
     return {
         'personne': personne,
-        'stats': stats,
+        'stats': SimpleNamespace(personne=personne, total=scan.total, nb=scan.nb) if scan.nb else None,
         'releves': releves,
-        'by_machine': by_machine,
-        'anomalies': anomalies,
-        'by_date': by_date,
+        'releves_cursor': releves_cursor,
+        'by_machine': scan.parc,
+        **anomalies,
+        'by_date': scan.by_date,
     }
 
 
-def _filter_rawdata_by_cuve(query, cuve_num):
-    """Filtre une requête RawData sur le n° de cuve (None = cuve non renseignée)."""
-    if cuve_num is None:
-        return query.filter(RawData.cuve_num.is_(None))
-    return query.filter(RawData.cuve_num == cuve_num)
-
-
 def get_cuves_summary():
-    """Cuves présentes dans les imports : volume total et nb de relevés (tri volume décroissant)."""
-    rows = db.session.query(
-        RawData.cuve_num,
-        db.func.sum(RawData.quantite).label('total'),
-        db.func.count(RawData.id).label('nb'),
-    ).group_by(RawData.cuve_num).order_by(db.desc('total')).all()
-    out = []
-    for row in rows:
-        num = row[0]
-        tot = float(row[1] or 0)
-        nb = int(row[2] or 0)
-        out.append({
-            'cuve_num': num,
-            'label': format_cuve_label(num),
-            'total': tot,
-            'nb': nb,
-        })
-    return out
+    """Cuves présentes dans les imports : volume total et nb de relevés (tri volume décroissant, classement des cuves)."""
+    return [{
+        'cuve_num': c.cuve,
+        'label': format_cuve_label(c.cuve),
+        'total': c.total,
+        'nb': c.nb,
+        'last_seen': c.last_seen,
+    } for c in get_dashboard_leaderboard('cuve')]
 
 
-def get_cuve_detail(cuve_num, date_from=None, date_to=None, user_id=None):
+def get_cuve_detail(cuve_num, date_from=None, date_to=None, user_id=None, releves_limit=80, anomalies_limit=30):
     """
     Indicateurs pour une cuve (cuve_num: int 1–10 ou None pour lignes sans cuve).
+    releves / anomalies : premières pages (plus récents d'abord) ; la suite via get_releves_page / get_anomalies_page.
     """
-    camions = get_camion_cuve_parcs_set()
-    seuil = get_camion_cuve_seuil_litres()
-
-    q_rel = db.session.query(
-        RawData.date_heure,
-        RawData.parc,
-        RawData.personne,
-        RawData.produit,
-        RawData.quantite,
-        RawData.compteur,
-        RawData.cuve_num,
-    )
-    q_rel = _filter_rawdata_by_cuve(q_rel, cuve_num)
-    q_rel = _date_filter(q_rel, RawData, date_from, date_to)
-    releves = q_rel.order_by(RawData.date_heure).all()
-
-    total_brut = 0.0
-    total_conso_ajustee = 0.0
-    parcs_seen = set()
-    for r in releves:
-        qv = float(r.quantite or 0)
-        total_brut += qv
-        total_conso_ajustee += effective_quantite_conso_carburant(
-            r.parc, r.quantite, r.cuve_num, camions, seuil)
-        if r.parc:
-            parcs_seen.add(r.parc)
-
-    nb = len(releves)
-    q2 = db.session.query(
-        db.func.min(RawData.date_heure),
-        db.func.max(RawData.date_heure),
-    )
-    q2 = _filter_rawdata_by_cuve(q2, cuve_num)
-    q2 = _date_filter(q2, RawData, date_from, date_to)
-    minmax = q2.first()
-
-    q_parc = db.session.query(
-        RawData.parc,
-        db.func.sum(RawData.quantite).label('total'),
-    )
-    q_parc = _filter_rawdata_by_cuve(q_parc, cuve_num)
-    q_parc = _date_filter(q_parc, RawData, date_from, date_to)
-    by_parc = q_parc.group_by(RawData.parc).order_by(db.desc('total')).all()
-
-    q_pers = db.session.query(
-        RawData.personne,
-        db.func.sum(RawData.quantite).label('total'),
-    ).filter(RawData.personne != '')
-    q_pers = _filter_rawdata_by_cuve(q_pers, cuve_num)
-    q_pers = _date_filter(q_pers, RawData, date_from, date_to)
-    by_personne = q_pers.group_by(RawData.personne).order_by(db.desc('total')).all()
-
-    q_prod = db.session.query(
-        RawData.produit,
-        db.func.sum(RawData.quantite).label('total'),
-    ).filter(RawData.produit != '').filter(RawData.produit.isnot(None))
-    q_prod = _filter_rawdata_by_cuve(q_prod, cuve_num)
-    q_prod = _date_filter(q_prod, RawData, date_from, date_to)
-    by_produit = q_prod.group_by(RawData.produit).order_by(db.desc('total')).all()
-
-    q5 = db.session.query(
-        func.date(RawData.date_heure).label('dt'),
-        db.func.sum(RawData.quantite).label('total'),
-    )
-    q5 = _filter_rawdata_by_cuve(q5, cuve_num)
-    q5 = _date_filter(q5, RawData, date_from, date_to)
-    by_date = q5.group_by(func.date(RawData.date_heure)).order_by('dt').all()
-
-    anomalies = []
-    if parcs_seen:
-        q4 = Anomalie.query.filter(Anomalie.machine.in_(list(parcs_seen)))
-        q4 = _date_filter(q4, Anomalie, date_from, date_to)
-        if user_id:
-            filter_cond = get_anomalie_filter_conditions(user_id, for_include_in_count=False)
-            q4 = q4.filter(filter_cond)
-        anomalies = q4.order_by(Anomalie.date.desc()).all()
+    scan = _detail_pass([_cuve_condition(cuve_num)], date_from, date_to, breakdowns=('parc', 'personne', 'produit'))
+    releves, releves_cursor = get_releves_page('cuve', cuve_num, date_from, date_to, limit=releves_limit)
+    anomalies = _detail_anomalies('cuve', cuve_num, date_from, date_to, user_id, anomalies_limit)
 
     label = format_cuve_label(cuve_num)
     site = cuve_num_to_site(cuve_num)
@@ -396,18 +486,19 @@ def get_cuve_detail(cuve_num, date_from=None, date_to=None, user_id=None):
         'site': site,
         'is_stock_roulant': is_stock_roulant,
         'stats': SimpleNamespace(
-            total=total_brut,
-            total_conso_ajustee=total_conso_ajustee,
-            nb=nb,
-            date_min=minmax[0] if minmax else None,
-            date_max=minmax[1] if minmax else None,
+            total=scan.total,
+            total_conso_ajustee=scan.total_conso,
+            nb=scan.nb,
+            date_min=scan.date_min,
+            date_max=scan.date_max,
         ),
         'releves': releves,
-        'by_parc': by_parc,
-        'by_personne': by_personne,
-        'by_produit': by_produit,
-        'by_date': by_date,
-        'anomalies': anomalies,
+        'releves_cursor': releves_cursor,
+        'by_parc': scan.parc,
+        'by_personne': scan.personne,
+        'by_produit': scan.produit,
+        'by_date': scan.by_date,
+        **anomalies,
     }
 
 
@@ -435,13 +526,198 @@ def get_date_range():
         return (None, None)
 
 
-def generate_pdf(date_from=None, date_to=None, user_id=None):
-    """Génère un rapport PDF (optionnel: filtre par dates, anomalies selon config user)."""
-    folder = current_app.config['REPORTS_FOLDER']
-    filename = f"rapport_madic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    filepath = os.path.join(folder, filename)
-    
-    doc = SimpleDocTemplate(filepath, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm)
+def _report_filepath(filepath, extension):
+    """Chemin de sortie d'un rapport : celui demandé (cache des rapports) ou un nom horodaté dans REPORTS_FOLDER."""
+    if filepath:
+        return filepath
+    filename = f"rapport_madic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{extension}"
+    return os.path.join(current_app.config['REPORTS_FOLDER'], filename)
+
+
+# Lignes lues par lot sur le curseur serveur pendant la génération des rapports
+REPORT_FETCH_BATCH = 2000
+
+# Découpages possibles du rapport PDF en sous-rapports (un chapitre par machine ou par site)
+PDF_DECOUPAGES = ('machine', 'site')
+
+# Styles de tableaux partagés par tous les rapports (construits une seule fois)
+PDF_STYLE_MACHINES = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, 0), 10),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+])
+PDF_STYLE_PERSONNES = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
+    ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+])
+PDF_STYLE_ANOMALIES = TableStyle([
+    ('BACKGROUND', (0, 0), (-1, 0), colors.darkred),
+    ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+    ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+])
+_PDF_ANOMALIES_HEADER = ['Machine', 'Type', 'Date', 'Personne', 'Compteur avant', 'Compteur après', 'Détails']
+_PDF_ANOMALIES_WIDTHS = [50, 70, 70, 60, 55, 55, 120]
+
+
+class _PdfGroup:
+    """Cumuls d'un périmètre du rapport (tout, une machine ou un site), remplis pendant le parcours unique."""
+
+    __slots__ = ('total', 'nb', 'by_machine', 'by_personne', 'by_month', 'anomalies')
+
+    def __init__(self):
+        self.total = 0.0
+        self.nb = 0
+        self.by_machine = {}
+        self.by_personne = {}
+        self.by_month = {}
+        self.anomalies = []
+
+    def add(self, parc, personne, quantite, mois):
+        self.total += quantite
+        self.nb += 1
+        m = self.by_machine.get(parc)
+        if m is None:
+            m = self.by_machine[parc] = [0.0, 0]
+        m[0] += quantite
+        m[1] += 1
+        if personne:
+            p = self.by_personne.get(personne)
+            if p is None:
+                p = self.by_personne[personne] = [0.0, 0]
+            p[0] += quantite
+            p[1] += 1
+        self.by_month[mois] = self.by_month.get(mois, 0.0) + quantite
+
+
+def _pdf_pass(date_from=None, date_to=None, user_id=None, decoupage=None):
+    """
+    Un seul parcours des relevés puis des anomalies de la période : cumuls globaux
+    et, si decoupage ('machine' | 'site'), cumuls de chaque sous-rapport.
+    Retourne (groupe global, {clé de sous-rapport: groupe}).
+    """
+    overall = _PdfGroup()
+    groups = {}
+    sites_by_parc = {}
+    q = _date_filter(db.session.query(
+        RawData.date_heure, RawData.parc, RawData.personne, RawData.quantite, RawData.cuve_num,
+    ), RawData, date_from, date_to)
+    for dt, parc, personne, quantite, cuve_num in q.yield_per(REPORT_FETCH_BATCH):
+        quantite = quantite or 0.0
+        mois = dt.strftime('%Y-%m')
+        overall.add(parc, personne, quantite, mois)
+        if decoupage == 'machine':
+            key = parc
+        elif decoupage == 'site':
+            key = cuve_num_to_site(cuve_num) or 'Sans site'
+            sites_by_parc.setdefault(parc, set()).add(key)
+        else:
+            continue
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = _PdfGroup()
+        group.add(parc, personne, quantite, mois)
+
+    q = _anomalies_query(None, None, date_from, date_to, user_id, entities=(
+        Anomalie.machine, Anomalie.type_anomalie, Anomalie.date, Anomalie.personne,
+        Anomalie.compteur_before, Anomalie.compteur_after, Anomalie.details,
+    ))
+    for a in q.order_by(Anomalie.date.desc(), Anomalie.id.desc()).yield_per(REPORT_FETCH_BATCH):
+        row = [
+            str(a.machine), str(a.type_anomalie),
+            a.date.strftime('%d/%m/%Y %H:%M') if a.date else '-',
+            str(a.personne or '-'),
+            str(a.compteur_before or '-'), str(a.compteur_after or '-'),
+            str((a.details or '')[:40]),
+        ]
+        if decoupage is None:
+            overall.anomalies.append(row)
+        elif decoupage == 'machine':
+            if a.machine in groups:
+                groups[a.machine].anomalies.append(row)
+        else:
+            # anomalies d'une machine rattachées à chaque site où elle a été servie sur la période
+            for site in sites_by_parc.get(a.machine, ()):
+                groups[site].anomalies.append(row)
+    return overall, groups
+
+
+def _pdf_chart(scope, value, by_month, date_from=None, date_to=None):
+    """
+    Histogramme de consommation mensuelle (Drawing vectoriel) d'un périmètre du rapport.
+    Les séries (libellé du mois, valeur) sont en cache tant que les données ne changent pas ; le Drawing est
+    construit pour chaque document : un flowable est modifié à la mise en page, il n'est jamais partagé
+    entre rapports générés en parallèle.
+    """
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    from reportlab.graphics.shapes import Drawing
+
+    key = make_cache_key('graphique_pdf', scope, value, date_from, date_to, get_data_version())
+    series = chart_cache.get_or_compute(
+        key, lambda: tuple((f"{m[5:]}/{m[2:4]}", round(by_month[m], 2)) for m in sorted(by_month)))
+
+    drawing = Drawing(17 * cm, 6 * cm)
+    chart = VerticalBarChart()
+    chart.x, chart.y = 40, 35
+    chart.width, chart.height = 17 * cm - 60, 6 * cm - 50
+    chart.data = [[v for _label, v in series]]
+    chart.categoryAxis.categoryNames = [label for label, _v in series]
+    chart.categoryAxis.labels.fontSize = 7
+    if len(series) > 12:
+        chart.categoryAxis.labels.angle = 45
+        chart.categoryAxis.labels.boxAnchor = 'ne'
+    chart.valueAxis.valueMin = 0
+    chart.valueAxis.labels.fontSize = 7
+    chart.bars[0].fillColor = colors.HexColor('#2980b9')
+    chart.bars[0].strokeColor = None
+    drawing.add(chart)
+    return drawing
+
+
+def _pdf_consumption_table(story, styles, group, dimension):
+    """Tableau « quantité totale / nombre de relevés » par machine ou par personne, tri décroissant."""
+    if dimension == 'parc':
+        header, items, style = 'Machine', group.by_machine, PDF_STYLE_MACHINES
+    else:
+        header, items, style = 'Personne', group.by_personne, PDF_STYLE_PERSONNES
+    if not items:
+        story.append(Paragraph("Aucune donnée.", styles['Normal']))
+        return
+    data = [[header, 'Quantité totale', 'Nombre de relevés']]
+    for valeur, (total, nb) in sorted(items.items(), key=lambda kv: (-kv[1][0], str(kv[0]))):
+        data.append([str(valeur), f"{total:.2f}", str(nb)])
+    story.append(LongTable(data, repeatRows=1, style=style))
+
+
+def _pdf_anomalies_table(story, styles, anomalies):
+    """Liste complète des anomalies : LongTable dont l'en-tête est répété à chaque page."""
+    if not anomalies:
+        story.append(Paragraph("Aucune anomalie détectée.", styles['Normal']))
+        return
+    story.append(LongTable([_PDF_ANOMALIES_HEADER] + anomalies, colWidths=_PDF_ANOMALIES_WIDTHS,
+                           repeatRows=1, style=PDF_STYLE_ANOMALIES))
+
+
+def render_pdf(date_from=None, date_to=None, user_id=None, decoupage=None):
+    """
+    Rapport PDF construit en mémoire (BytesIO), retourné en octets.
+    decoupage : None (rapport global), 'machine' ou 'site' (un sous-rapport par machine / par site,
+    avec graphique, répartition et anomalies), le tout en un seul parcours des données.
+    """
+    overall, groups = _pdf_pass(date_from, date_to, user_id, decoupage)
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=2*cm, leftMargin=2*cm)
     styles = getSampleStyleSheet()
     story = []
     
@@ -450,123 +726,159 @@ def generate_pdf(date_from=None, date_to=None, user_id=None):
     sub = f"Généré le {datetime.now().strftime('%d/%m/%Y à %H:%M')}"
     if date_from or date_to:
         sub += f" — Période : {date_from or '?'} à {date_to or '?'}"
+    if decoupage:
+        sub += f" — Un chapitre par {decoupage}"
     story.append(Paragraph(sub, styles['Normal']))
     story.append(Spacer(1, 24))
     
+    if overall.by_month:
+        story.append(Paragraph("Consommation mensuelle", styles['Heading2']))
+        story.append(_pdf_chart('', '', overall.by_month, date_from, date_to))
+        story.append(Spacer(1, 12))
+    
     # Consommations par machine
     story.append(Paragraph("1. Consommations par machine", styles['Heading2']))
     story.append(Spacer(1, 12))
-    
-    data_machines = [['Machine', 'Quantité totale', 'Nombre de relevés']]
-    for row in get_consumption_by_machine(date_from, date_to):
-        data_machines.append([str(row.parc), f"{row.quantite_totale:.2f}", str(row.nb_releves)])
-    
-    if len(data_machines) > 1:
-        t1 = Table(data_machines)
-        t1.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, 0), 10),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.beige),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ]))
-        story.append(t1)
-    else:
-        story.append(Paragraph("Aucune donnée.", styles['Normal']))
-    
+    _pdf_consumption_table(story, styles, overall, 'parc')
     story.append(Spacer(1, 24))
     
     # Consommations par personne
     story.append(Paragraph("2. Consommations par personne", styles['Heading2']))
     story.append(Spacer(1, 12))
-    
-    data_persons = [['Personne', 'Quantité totale', 'Nombre de relevés']]
-    for row in get_consumption_by_person(date_from, date_to):
-        data_persons.append([str(row.personne or '-'), f"{row.quantite_totale:.2f}", str(row.nb_releves)])
-    
-    if len(data_persons) > 1:
-        t2 = Table(data_persons)
-        t2.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.grey),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('BOTTOMPADDING', (0, 0), (-1, 0), 12),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.lightgrey),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ]))
-        story.append(t2)
-    else:
-        story.append(Paragraph("Aucune donnée.", styles['Normal']))
-    
+    _pdf_consumption_table(story, styles, overall, 'personne')
     story.append(Spacer(1, 24))
     
-    # Anomalies
-    story.append(Paragraph("3. Anomalies détectées", styles['Heading2']))
-    story.append(Spacer(1, 12))
-    
-    anomalies = get_anomalies_detail(date_from, date_to, user_id)
-    if anomalies:
-        data_anom = [['Machine', 'Type', 'Date', 'Personne', 'Compteur avant', 'Compteur après', 'Détails']]
-        for a in anomalies[:50]:  # Limiter à 50 pour le PDF
-            data_anom.append([
-                str(a.machine), str(a.type_anomalie),
-                a.date.strftime('%d/%m/%Y %H:%M') if a.date else '-',
-                str(a.personne or '-'),
-                str(a.compteur_before or '-'), str(a.compteur_after or '-'),
-                str((a.details or '')[:40])
-            ])
-        t3 = Table(data_anom, colWidths=[50, 70, 70, 60, 55, 55, 120])
-        t3.setStyle(TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.darkred),
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 8),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-        ]))
-        story.append(t3)
-        if len(anomalies) > 50:
-            story.append(Paragraph(f"... et {len(anomalies) - 50} anomalies supplémentaires.", styles['Normal']))
+    if decoupage is None:
+        # Anomalies
+        story.append(Paragraph("3. Anomalies détectées", styles['Heading2']))
+        story.append(Spacer(1, 12))
+        _pdf_anomalies_table(story, styles, overall.anomalies)
     else:
-        story.append(Paragraph("Aucune anomalie détectée.", styles['Normal']))
+        # Sous-rapports, par volume décroissant
+        for n, (key, group) in enumerate(sorted(groups.items(), key=lambda kv: (-kv[1].total, str(kv[0]))), start=3):
+            story.append(PageBreak())
+            titre = f"Machine {key}" if decoupage == 'machine' else f"Site {key}"
+            story.append(Paragraph(f"{n}. {titre}", styles['Heading1']))
+            story.append(Paragraph(f"{group.total:.2f} L — {group.nb} relevés — {len(group.anomalies)} anomalies",
+                                   styles['Normal']))
+            story.append(Spacer(1, 12))
+            story.append(_pdf_chart(decoupage, key, group.by_month, date_from, date_to))
+            story.append(Spacer(1, 12))
+            if decoupage == 'site':
+                story.append(Paragraph("Consommations par machine", styles['Heading3']))
+                _pdf_consumption_table(story, styles, group, 'parc')
+                story.append(Spacer(1, 12))
+            story.append(Paragraph("Consommations par personne", styles['Heading3']))
+            _pdf_consumption_table(story, styles, group, 'personne')
+            story.append(Spacer(1, 12))
+            story.append(Paragraph("Anomalies", styles['Heading3']))
+            _pdf_anomalies_table(story, styles, group.anomalies)
     
     doc.build(story)
+    return buffer.getvalue()
+
+
+def generate_pdf(date_from=None, date_to=None, user_id=None, filepath=None, decoupage=None):
+    """Génère un rapport PDF dans un fichier (cache des rapports) : voir render_pdf."""
+    filepath = _report_filepath(filepath, 'pdf')
+    data = render_pdf(date_from, date_to, user_id, decoupage)
+    with open(filepath, 'wb') as f:
+        f.write(data)
     return filepath
 
 
-def generate_excel(date_from=None, date_to=None, user_id=None):
+# Nombre maximal de lignes d'une feuille Excel (en-tête compris) : les relevés continuent sur une nouvelle feuille
+EXCEL_MAX_ROWS = 1048576
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+_EXCEL_ANOMALIES_COLUMNS = (
+    ('Machine', Anomalie.machine), ('Type', Anomalie.type_anomalie),
+    ('Date', Anomalie.date), ('Prev Date', Anomalie.prev_date),
+    ('Personne', Anomalie.personne),
+    ('Compteur before', Anomalie.compteur_before), ('Compteur after', Anomalie.compteur_after),
+    ('Quantité before', Anomalie.quantite_before), ('Quantité after', Anomalie.quantite_after),
+    ('Détails', Anomalie.details),
+)
+_EXCEL_RELEVES_COLUMNS = (
+    ('Date', RawData.date_heure), ('Parc', RawData.parc), ('Service véhicule', RawData.service_vehicule),
+    ('Personne', RawData.personne), ('Service personne', RawData.service_personne), ('Produit', RawData.produit),
+    ('Quantité', RawData.quantite), ('Quantité conso', RawData.quantite_conso), ('Compteur', RawData.compteur),
+    ('Unité', RawData.unite), ('Cuve', RawData.cuve_num),
+)
+
+
+def _write_excel_report(target, date_from=None, date_to=None, user_id=None):
+    """
+    Écrit le classeur (par machine, par personne, anomalies, relevés bruts) dans target (chemin ou flux).
+    Classeur openpyxl en écriture seule et lignes lues par lots sur curseur serveur (yield_per) :
+    mémoire constante quel que soit le volume. Les relevés sont répartis sur plusieurs feuilles
+    au-delà de EXCEL_MAX_ROWS lignes.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import Font
+
+    wb = Workbook(write_only=True)
+    bold = Font(bold=True)
+
+    def new_sheet(title, headers):
+        ws = wb.create_sheet(title)
+        cells = []
+        for h in headers:
+            cell = WriteOnlyCell(ws, value=h)
+            cell.font = bold
+            cells.append(cell)
+        ws.append(cells)
+        return ws
+
+    ws = new_sheet('Par machine', ['Machine', 'Quantité totale', 'Nb relevés'])
+    for r in get_consumption_by_machine(date_from, date_to):
+        ws.append([r.parc, r.quantite_totale, r.nb_releves])
+
+    ws = new_sheet('Par personne', ['Personne', 'Quantité totale', 'Nb relevés'])
+    for r in get_consumption_by_person(date_from, date_to):
+        ws.append([r.personne or '-', r.quantite_totale, r.nb_releves])
+
+    # Anomalies : feuille créée à la première ligne (absente s'il n'y en a pas)
+    q = _anomalies_query(None, None, date_from, date_to, user_id,
+                         entities=[col for _h, col in _EXCEL_ANOMALIES_COLUMNS])
+    ws = None
+    for row in q.order_by(Anomalie.date.desc(), Anomalie.id.desc()).yield_per(REPORT_FETCH_BATCH):
+        if ws is None:
+            ws = new_sheet('Anomalies', [h for h, _col in _EXCEL_ANOMALIES_COLUMNS])
+        ws.append(list(row))
+
+    # Relevés bruts, par ordre chronologique
+    headers = [h for h, _col in _EXCEL_RELEVES_COLUMNS]
+    q = _date_filter(db.session.query(*[col for _h, col in _EXCEL_RELEVES_COLUMNS]), RawData, date_from, date_to)
+    ws = new_sheet('Relevés', headers)
+    n_sheets, n_rows = 1, 1
+    for row in q.order_by(RawData.date_heure, RawData.id).yield_per(REPORT_FETCH_BATCH):
+        if n_rows >= EXCEL_MAX_ROWS:
+            n_sheets += 1
+            ws = new_sheet(f'Relevés ({n_sheets})', headers)
+            n_rows = 1
+        ws.append(list(row))
+        n_rows += 1
+
+    wb.save(target)
+
+
+def generate_excel(date_from=None, date_to=None, user_id=None, filepath=None):
     """Génère un rapport Excel (optionnel: filtre par dates, anomalies selon config user)."""
-    import pandas as pd
-    
-    folder = current_app.config['REPORTS_FOLDER']
-    filename = f"rapport_madic_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    filepath = os.path.join(folder, filename)
-    
-    with pd.ExcelWriter(filepath, engine='openpyxl') as writer:
-        # Par machine
-        mach_data = [{'Machine': r.parc, 'Quantité totale': r.quantite_totale, 'Nb relevés': r.nb_releves} 
-                     for r in get_consumption_by_machine(date_from, date_to)]
-        pd.DataFrame(mach_data).to_excel(writer, sheet_name='Par machine', index=False)
-        
-        # Par personne
-        pers_data = [{'Personne': r.personne or '-', 'Quantité totale': r.quantite_totale, 'Nb relevés': r.nb_releves} 
-                     for r in get_consumption_by_person(date_from, date_to)]
-        pd.DataFrame(pers_data).to_excel(writer, sheet_name='Par personne', index=False)
-        
-        # Anomalies
-        anom = get_anomalies_detail(date_from, date_to, user_id)
-        if anom:
-            df_anom = pd.DataFrame([{
-                'Machine': a.machine, 'Type': a.type_anomalie,
-                'Date': a.date, 'Prev Date': a.prev_date,
-                'Personne': a.personne,
-                'Compteur before': a.compteur_before, 'Compteur after': a.compteur_after,
-                'Quantité before': a.quantite_before, 'Quantité after': a.quantite_after,
-                'Détails': a.details
-            } for a in anom])
-            df_anom.to_excel(writer, sheet_name='Anomalies', index=False)
-    
+    filepath = _report_filepath(filepath, 'xlsx')
+    _write_excel_report(filepath, date_from, date_to, user_id)
     return filepath
+
+
+def iter_excel_report(date_from=None, date_to=None, user_id=None):
+    """
+    Rapport Excel produit en flux : blocs d'octets envoyés au fil de l'écriture du classeur (aucun fichier
+    intermédiaire). L'écriture tourne dans un thread ; fermer le générateur (client parti) l'interrompt.
+    """
+    return iter_written(
+        current_app._get_current_object(),
+        lambda out: _write_excel_report(out, date_from, date_to, user_id),
+        name='export-excel',
+    )
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""Résumés statistiques fusionnables (quantiles, valeurs distinctes, rapports) stockés dans les agrégats journaliers."""
+import hashlib
+import json
+import math
+
+QUANTILE_AGGS = {'median': 0.5, 'p90': 0.9, 'p99': 0.99}
+
+
+class QuantileSketch:
+    """
+    Résumé de quantiles à erreur relative bornée (principe DDSketch) : chaque valeur tombe dans un
+    seau logarithmique, deux résumés se fusionnent en additionnant leurs seaux.
+    Précision : ±1 % sur la valeur retournée ; taille bornée par l'étendue des valeurs, pas par leur nombre.
+    """
+
+    RELATIVE_ACCURACY = 0.01
+    _GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+    _LOG_GAMMA = math.log(_GAMMA)
+    _MIN_VALUE = 1e-9  # en dessous : compté comme zéro
+
+    __slots__ = ('pos', 'neg', 'zero', 'count')
+
+    def __init__(self):
+        self.pos = {}
+        self.neg = {}
+        self.zero = 0
+        self.count = 0
+
+    def _index(self, v):
+        return int(math.ceil(math.log(v) / self._LOG_GAMMA))
+
+    def _value(self, idx):
+        return 2 * self._GAMMA ** idx / (self._GAMMA + 1)
+
+    def add(self, value):
+        if value is None:
+            return
+        v = float(value)
+        if v > self._MIN_VALUE:
+            i = self._index(v)
+            self.pos[i] = self.pos.get(i, 0) + 1
+        elif v < -self._MIN_VALUE:
+            i = self._index(-v)
+            self.neg[i] = self.neg.get(i, 0) + 1
+        else:
+            self.zero += 1
+        self.count += 1
+
+    def merge(self, other):
+        """Fusionne other dans ce résumé (en place) et le retourne."""
+        for store, src in ((self.pos, other.pos), (self.neg, other.neg)):
+            for i, c in src.items():
+                store[i] = store.get(i, 0) + c
+        self.zero += other.zero
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        """Valeur au rang q (0..1) ; None si le résumé est vide."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for i in sorted(self.neg, reverse=True):
+            seen += self.neg[i]
+            if seen > rank:
+                return -self._value(i)
+        seen += self.zero
+        if seen > rank:
+            return 0.0
+        for i in sorted(self.pos):
+            seen += self.pos[i]
+            if seen > rank:
+                return self._value(i)
+        return self._value(max(self.pos)) if self.pos else 0.0
+
+    def to_json(self):
+        return json.dumps({'p': self.pos, 'n': self.neg, 'z': self.zero}, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, raw):
+        s = cls()
+        if not raw:
+            return s
+        d = json.loads(raw)
+        s.pos = {int(k): v for k, v in d.get('p', {}).items()}
+        s.neg = {int(k): v for k, v in d.get('n', {}).items()}
+        s.zero = d.get('z', 0)
+        s.count = sum(s.pos.values()) + sum(s.neg.values()) + s.zero
+        return s
+
+
+class ExactQuantiles:
+    """Même interface que QuantileSketch, mais conserve toutes les valeurs (quantile exact, petits volumes)."""
+
+    __slots__ = ('values',)
+
+    def __init__(self):
+        self.values = []
+
+    @property
+    def count(self):
+        return len(self.values)
+
+    def add(self, value):
+        if value is not None:
+            self.values.append(float(value))
+
+    def merge(self, other):
+        self.values.extend(other.values)
+        return self
+
+    def quantile(self, q):
+        """Valeur au rang q (même convention de rang que QuantileSketch.quantile)."""
+        if not self.values:
+            return None
+        values = sorted(self.values)
+        return values[int(math.floor(q * (len(values) - 1) + 1e-9))]
+
+
+class HyperLogLog:
+    """
+    Estimation du nombre de valeurs distinctes (HyperLogLog, 2^12 registres, erreur type ≈ 1,6 %).
+    Stockage creux (registres non nuls seulement) : un résumé journalier ne pèse que quelques octets.
+    """
+
+    P = 12
+    M = 1 << P
+    _ALPHA = 0.7213 / (1 + 1.079 / M)
+    _TAIL_BITS = 64 - P
+
+    __slots__ = ('registers',)
+
+    def __init__(self):
+        self.registers = {}
+
+    @staticmethod
+    def hash_value(value):
+        """Empreinte 64 bits stable d'une valeur (indépendante du processus, contrairement à hash())."""
+        return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+    def add(self, value):
+        if value is None or value == '':
+            return
+        self.add_hash(self.hash_value(value))
+
+    def add_hash(self, h):
+        idx = h >> self._TAIL_BITS
+        tail = h & ((1 << self._TAIL_BITS) - 1)
+        rank = self._TAIL_BITS - tail.bit_length() + 1
+        if rank > self.registers.get(idx, 0):
+            self.registers[idx] = rank
+
+    def merge(self, other):
+        regs = self.registers
+        for idx, rank in other.registers.items():
+            if rank > regs.get(idx, 0):
+                regs[idx] = rank
+        return self
+
+    @property
+    def count(self):
+        """Nombre estimé de valeurs distinctes."""
+        if not self.registers:
+            return 0
+        zeros = self.M - len(self.registers)
+        estimate = self._ALPHA * self.M * self.M / (zeros + sum(2.0 ** -r for r in self.registers.values()))
+        if estimate <= 2.5 * self.M and zeros:
+            estimate = self.M * math.log(self.M / zeros)  # petites cardinalités : comptage linéaire
+        return int(round(estimate))
+
+    def to_json(self):
+        return json.dumps(self.registers, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, raw):
+        s = cls()
+        if raw:
+            s.registers = {int(k): v for k, v in json.loads(raw).items()}
+        return s
+
+
+class ExactDistinct:
+    """Même interface que HyperLogLog, avec l'ensemble exact des valeurs (petites périodes)."""
+
+    __slots__ = ('values',)
+
+    def __init__(self):
+        self.values = set()
+
+    def add(self, value):
+        if value is not None and value != '':
+            self.values.add(value)
+
+    def merge(self, other):
+        self.values |= other.values
+        return self
+
+    @property
+    def count(self):
+        return len(self.values)
+
+
+class RatioSum:
+    """Rapport de deux sommes (ex. quantité / écart compteur), fusionnable : moyenne pondérée exacte."""
+
+    __slots__ = ('num', 'den')
+
+    def __init__(self, num=0.0, den=0.0):
+        self.num = num or 0.0
+        self.den = den or 0.0
+
+    def add(self, pair):
+        """pair : (numérateur, dénominateur) ; ignoré si l'un des deux manque."""
+        num, den = pair
+        if num is None or den is None:
+            return
+        self.num += num
+        self.den += den
+
+    def merge(self, other):
+        self.num += other.num
+        self.den += other.den
+        return self
+
+    @property
+    def count(self):
+        return self.den
+
+    @property
+    def value(self):
+        return self.num / self.den if self.den else None
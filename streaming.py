@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+"""
+Envoi en flux de fichiers produits par une bibliothèque qui écrit dans un objet fichier (openpyxl, pyarrow) :
+l'écriture tourne dans un thread, les octets sont relayés au client au fur et à mesure, sans fichier intermédiaire.
+"""
+import queue
+import threading
+
+# Taille des blocs envoyés au client
+STREAM_CHUNK = 64 * 1024
+
+
+class ChunkPipe:
+    """
+    Flux en écriture seule (ni tell ni seek : zipfile écrit alors séquentiellement) dont les blocs
+    sont consommés par un autre thread. File bornée : l'écriture attend le lecteur, la mémoire reste constante.
+    """
+
+    def __init__(self, chunk_size=STREAM_CHUNK, maxsize=16):
+        self.queue = queue.Queue(maxsize)
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.closed = False
+        self.written = 0
+
+    def put(self, item):
+        while True:
+            if self.closed:
+                raise IOError('Téléchargement interrompu')
+            try:
+                self.queue.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, data):
+        self.buffer += data
+        self.written += len(data)
+        if len(self.buffer) >= self.chunk_size:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def finish(self):
+        if self.buffer:
+            self.put(bytes(self.buffer))
+            self.buffer.clear()
+        self.put(None)
+
+
+class PositionedChunkPipe(ChunkPipe):
+    """ChunkPipe qui connaît sa position (pyarrow en a besoin pour les offsets du pied de fichier Parquet)."""
+
+    def tell(self):
+        return self.written
+
+
+def iter_written(app, write, name='export', pipe_class=ChunkPipe):
+    """
+    Exécute write(flux) dans un thread (contexte applicatif app) et retourne un générateur des octets écrits.
+    Fermer le générateur (client parti) interrompt l'écriture ; une erreur d'écriture est relancée côté lecteur.
+    """
+    pipe = pipe_class()
+
+    def produce():
+        try:
+            with app.app_context():
+                write(pipe)
+            pipe.finish()
+        except Exception as e:
+            if not pipe.closed:
+                pipe.put(e)
+
+    def chunks():
+        thread = threading.Thread(target=produce, name=name, daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = pipe.queue.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            pipe.closed = True
+
+    return chunks()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Base SQLite au schéma d'origine (antérieur au suivi des versions), avec quelques relevés."""
+import sqlite3
+
+# Schéma des bases déployées avant le suivi des versions (tables utiles au test ; les autres sont créées)
+BASELINE_SCHEMA = """
+CREATE TABLE history_periods (
+    id INTEGER NOT NULL, date_min DATE NOT NULL, date_max DATE NOT NULL, nb_lignes_importees INTEGER,
+    filename VARCHAR(255), imported_at DATETIME, PRIMARY KEY (id)
+);
+CREATE TABLE raw_data (
+    id INTEGER NOT NULL, date_heure DATETIME NOT NULL, parc VARCHAR(50) NOT NULL, service_vehicule VARCHAR(100),
+    personne VARCHAR(100), service_personne VARCHAR(100), produit VARCHAR(100), quantite FLOAT NOT NULL,
+    compteur FLOAT NOT NULL, unite VARCHAR(20), imported_at DATETIME,
+    history_period_id INTEGER REFERENCES history_periods(id), cuve_num INTEGER, PRIMARY KEY (id)
+);
+CREATE TABLE anomalies (
+    id INTEGER NOT NULL, machine VARCHAR(50) NOT NULL, type_anomalie VARCHAR(100) NOT NULL, date DATETIME NOT NULL,
+    prev_date DATETIME, personne VARCHAR(100), compteur_before FLOAT, compteur_after FLOAT, quantite_before FLOAT,
+    quantite_after FLOAT, details TEXT, created_at DATETIME, produit VARCHAR(100), PRIMARY KEY (id)
+);
+CREATE TABLE processed_data (
+    id INTEGER NOT NULL, raw_data_id INTEGER, parc VARCHAR(50) NOT NULL, date_heure DATETIME NOT NULL,
+    prev_date_heure DATETIME, personne VARCHAR(100), produit VARCHAR(100), quantite FLOAT, quantite_before FLOAT,
+    quantite_after FLOAT, compteur FLOAT, compteur_before FLOAT, compteur_after FLOAT, diff_compteur FLOAT,
+    created_at DATETIME, PRIMARY KEY (id), FOREIGN KEY(raw_data_id) REFERENCES raw_data (id)
+);
+CREATE TABLE users (
+    id INTEGER NOT NULL, username VARCHAR(80) NOT NULL, password_hash VARCHAR(255) NOT NULL, role VARCHAR(20) NOT NULL,
+    created_at DATETIME, PRIMARY KEY (id), UNIQUE (username)
+);
+CREATE TABLE user_filters (
+    user_id INTEGER NOT NULL, machines_json TEXT, personnes_json TEXT, updated_at DATETIME,
+    date_from_str VARCHAR(10), date_to_str VARCHAR(10), PRIMARY KEY (user_id), FOREIGN KEY(user_id) REFERENCES users (id)
+);
+CREATE TABLE anomalie_type_config (
+    id INTEGER NOT NULL, type_key VARCHAR(50) NOT NULL, label VARCHAR(120) NOT NULL, enabled BOOLEAN,
+    include_in_count BOOLEAN, sort_order INTEGER, PRIMARY KEY (id), UNIQUE (type_key)
+);
+CREATE TABLE user_anomalie_config (
+    user_id INTEGER NOT NULL, type_key VARCHAR(50) NOT NULL, enabled BOOLEAN, include_in_count BOOLEAN,
+    updated_at DATETIME, produits_json TEXT DEFAULT '[]', PRIMARY KEY (user_id, type_key),
+    FOREIGN KEY(user_id) REFERENCES users (id)
+);
+CREATE TABLE system_config ("key" VARCHAR(80) NOT NULL, value VARCHAR(255), updated_at DATETIME, PRIMARY KEY ("key"));
+"""
+
+RAW_ROWS = [
+    # date_heure (texte au format écrit par SQLAlchemy sous SQLite), parc, personne, produit, quantite, compteur, unite, cuve_num
+    ('2026-01-05 08:00:00.000000', 'P01', 'DUPONT', 'GNR', 50.0, 1000.0, 'Km', 1),
+    ('2026-01-06 08:00:00.000000', 'P01', 'DUPONT', 'GNR', 40.0, 3000.0, 'Km', 1),
+    ('2026-01-07 08:00:00.000000', 'P01 ', 'MARTIN', 'GNR', 45.0, 3400.0, 'Km', 1),
+    ('2026-01-05 09:00:00.000000', 'E02', 'MARTIN', 'GAZOLE', 30.0, 100.0, 'H', 6),
+    ('2026-01-06 09:00:00.000000', 'E02', 'MARTIN', 'GAZOLE', 0.0, 110.0, 'H', 6),
+    ('2026-01-07 09:00:00.000000', 'E02', 'DUPONT', 'GAZOLE', 25.0, 120.0, 'H', 6),
+]
+
+
+# Colonnes ajoutées par les migrations du code d'origine : sans elles, schéma des toutes premières bases
+OLDEST_SCHEMA = (BASELINE_SCHEMA
+                 .replace("\n    history_period_id INTEGER REFERENCES history_periods(id), cuve_num INTEGER,", "")
+                 .replace(", produit VARCHAR(100), PRIMARY KEY (id)", ", PRIMARY KEY (id)")
+                 .replace("\n    date_from_str VARCHAR(10), date_to_str VARCHAR(10),", "")
+                 .replace("\n    updated_at DATETIME, produits_json TEXT DEFAULT '[]',", "\n    updated_at DATETIME,"))
+
+
+def baseline_db(path, schema=BASELINE_SCHEMA):
+    conn = sqlite3.connect(path)
+    conn.executescript(schema)
+    if schema is OLDEST_SCHEMA:
+        conn.executemany(
+            "INSERT INTO raw_data (date_heure, parc, personne, produit, quantite, compteur, unite) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", [r[:-1] for r in RAW_ROWS])
+        conn.commit()
+        conn.close()
+        return
+    conn.executemany(
+        "INSERT INTO raw_data (date_heure, parc, personne, produit, quantite, compteur, unite, cuve_num) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", RAW_ROWS)
+    conn.execute(
+        "INSERT INTO anomalies (machine, type_anomalie, date, personne, produit) "
+        "VALUES ('P01', 'Jump >1000', '2026-01-06 08:00:00.000000', 'DUPONT', 'GNR')")
+    conn.commit()
+    conn.close()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""Fixtures communes : application Flask sur une base SQLite temporaire."""
+import os
+import sys
+import tempfile
+
+import pytest
+from flask import Flask
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# app.py initialise sa base dès l'import : base de test (au schéma d'origine) et dossiers temporaires,
+# jamais madic_data.db ni le DATABASE_URL de l'environnement
+_APP_DIR = tempfile.mkdtemp(prefix='madic-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_APP_DIR, 'app.db')}"
+os.environ['UPLOAD_FOLDER'] = os.path.join(_APP_DIR, 'uploads')
+os.environ['REPORTS_FOLDER'] = os.path.join(_APP_DIR, 'reports')
+
+from baseline import baseline_db  # noqa: E402
+
+baseline_db(os.path.join(_APP_DIR, 'app.db'))
+
+import cache  # noqa: E402
+import database  # noqa: E402
+import dimensions  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def _clear_caches():
+    """Caches de résultats indexés par version des données : une autre base de test peut avoir la même."""
+    for c in cache.ALL_CACHES:
+        c.clear()
+    yield
+
+
+@pytest.fixture
+def make_app(monkeypatch):
+    """Fabrique d'applications : make_app(chemin) initialise (et migre) la base SQLite à ce chemin."""
+    def make(path):
+        monkeypatch.setattr(database, 'DATABASE_URL', f'sqlite:///{path}')
+        # caches de processus indexés par version : une autre base peut réutiliser les mêmes numéros
+        monkeypatch.setattr(database, '_settings', {'token': None, 'snapshot': None, 'versions': None, 'checked': 0.0})
+        monkeypatch.setattr(dimensions, '_cache', {'version': None, 'entries': {}, 'ids': {}})
+        app = Flask(__name__)
+        app.config['SECRET_KEY'] = 'test'
+        database.init_db(app)
+        return app
+    return make
+
+
+@pytest.fixture
+def baseline_app(make_app, tmp_path):
+    """Application sur une base au schéma d'origine, mise à niveau par init_db (voir baseline.py)."""
+    path = tmp_path / 'baseline.db'
+    baseline_db(path)
+    return make_app(path)
+
+
+@pytest.fixture
+def client():
+    """Client de test de l'application complète (app.py, base au schéma d'origine), connecté en admin."""
+    from app import app
+    from database import User
+
+    app.config['TESTING'] = True
+    with app.app_context():
+        admin_id = User.query.filter_by(username='admin').one().id
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s['_user_id'] = str(admin_id)
+        s['_fresh'] = True
+    return c
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Routes de l'application complète : revalidation (ETag / 304), pagination par curseur, exports en flux."""
+import csv
+import io
+
+from baseline import RAW_ROWS
+from cache import indicator_cache
+from database import bump_data_version
+
+INDICATEUR = '/api/indicateurs/data?x_axis=date&x_date_group=jour&serie_dim=personne&y_metrics=quantite|sum'
+
+
+def test_indicator_not_modified_until_data_version_changes(client):
+    first = client.get(INDICATEUR)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'private, no-cache'
+
+    before = indicator_cache.stats()['not_modified']
+    again = client.get(INDICATEUR, headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.data == b''
+    assert again.headers['ETag'] == etag
+    assert indicator_cache.stats()['not_modified'] == before + 1
+    # autre format : autre représentation, autre ETag
+    columnar = client.get(INDICATEUR + '&format=columnar', headers={'If-None-Match': etag})
+    assert columnar.status_code == 200 and columnar.headers['ETag'] != etag
+
+    with client.application.app_context():
+        bump_data_version()
+    changed = client.get(INDICATEUR, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json() == first.get_json()
+
+
+def test_releves_api_pages_with_cursor(client):
+    ids, cursor = [], None
+    while True:
+        r = client.get('/api/releves', query_string={'scope': 'machine', 'value': 'P01', 'limit': 2, 'cursor': cursor})
+        assert r.status_code == 200
+        page = r.get_json()
+        assert len(page['items']) <= 2
+        ids.extend(item['id'] for item in page['items'])
+        dates = [item['date_heure'] for item in page['items']]
+        assert dates == sorted(dates, reverse=True)
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    assert len(ids) == len(set(ids)) == 3
+    assert client.get('/api/releves?limit=2').status_code == 400  # scope requis
+    assert client.get('/api/releves?scope=machine&value=P01&date_from=05/01/2026').status_code == 400
+
+
+def test_export_csv_route_streams_rows(client):
+    r = client.get('/export/raw.csv?machine=E02,P01&date_from=2026-01-05&date_to=2026-01-05')
+    assert r.status_code == 200
+    assert r.headers['Content-Disposition'] == 'attachment; filename=madic_raw.csv'
+    rows = list(csv.reader(io.StringIO(r.get_data(as_text=True))))
+    assert len(rows) == 1 + sum(1 for row in RAW_ROWS if row[0].startswith('2026-01-05'))
+    assert client.get('/export/raw.xml').status_code == 404
+    assert client.get('/export/raw.csv?date_from=2026-13-01').status_code == 400
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""Mémorisation par requête (request_memo) et paramètres partagés entre processus."""
+from sqlalchemy import text
+
+from database import db, get_parc_to_famille_nom_map, request_memo
+
+
+def test_request_memo_only_within_a_request(make_app, tmp_path):
+    app = make_app(tmp_path / 'memo.db')
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return len(calls)
+
+    with app.app_context():  # contexte applicatif seul (rapport en arrière-plan, commande) : jamais mémorisé
+        assert [request_memo('k', compute) for _i in range(2)] == [1, 2]
+    with app.test_request_context('/'):
+        assert [request_memo('k', compute) for _i in range(2)] == [3, 3]
+        db.session.commit()  # une écriture validée efface la mémoire de la requête
+        assert request_memo('k', compute) == 4
+
+
+def test_long_app_context_sees_other_process_changes(make_app, tmp_path):
+    app = make_app(tmp_path / 'memo.db')
+    with app.app_context():
+        assert get_parc_to_famille_nom_map() == {}
+        with db.engine.connect() as conn:  # écriture d'un autre processus (aucun commit de cette session)
+            conn.execute(text("INSERT INTO familles (id, nom) VALUES (1, 'Chargeuses')"))
+            conn.execute(text("INSERT INTO machine_famille (parc, famille_id) VALUES ('P01', 1)"))
+            conn.commit()
+        assert get_parc_to_famille_nom_map() == {'P01': 'Chargeuses'}
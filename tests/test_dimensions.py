@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+"""Dictionnaires de dimensions : reconstruction depuis raw_data (complète ou ciblée)."""
+from datetime import datetime
+
+from database import db, DimParc, RawData
+from dimensions import rebuild_dimensions
+
+
+def _parc(valeur):
+    d = DimParc.query.filter_by(valeur=valeur).one()
+    return d.nb_releves, d.total_quantite, d.first_seen, d.last_seen
+
+
+def test_rebuild_groups_value_variants(baseline_app):
+    expected = (3, 135.0, datetime(2026, 1, 5, 8), datetime(2026, 1, 7, 8))  # 'P01' ×2 et 'P01 ' ×1
+    with baseline_app.app_context():
+        assert _parc('P01') == expected  # reconstruction complète à la mise à niveau
+        rebuild_dimensions({'parc': {'P01'}})
+        assert _parc('P01') == expected
+        assert DimParc.query.filter(DimParc.valeur.like('P01%')).count() == 1
+
+
+def test_targeted_rebuild_after_delete(baseline_app):
+    with baseline_app.app_context():
+        RawData.query.filter(RawData.parc == 'P01', RawData.compteur == 1000.0).delete()
+        db.session.commit()
+        rebuild_dimensions({'parc': {'P01'}})
+        assert _parc('P01') == (2, 85.0, datetime(2026, 1, 6, 8), datetime(2026, 1, 7, 8))
+
+
+def test_rebuild_keeps_entries_still_referenced_by_id(baseline_app):
+    with baseline_app.app_context():
+        p01 = DimParc.query.filter_by(valeur='P01').one().id
+        RawData.query.filter(RawData.parc_id == p01).update({RawData.parc: 'P01-renomme'})
+        db.session.commit()
+        rebuild_dimensions({'parc': {'P01'}})
+        assert DimParc.query.filter_by(valeur='P01').one().id == p01  # parc_id des relevés toujours valide
+        RawData.query.filter(RawData.parc_id == p01).delete()
+        db.session.commit()
+        rebuild_dimensions({'parc': {'P01'}})
+        assert DimParc.query.filter_by(valeur='P01').count() == 0
@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Exports en flux : CSV, Parquet et classeur Excel relus depuis les octets produits."""
+import csv
+import io
+from datetime import date
+
+import pytest
+
+import exports
+from baseline import RAW_ROWS
+from exports import export_columns, iter_csv, write_parquet
+from reports import iter_excel_report
+
+
+def test_csv_stream_in_batches(baseline_app, monkeypatch):
+    monkeypatch.setattr(exports, 'EXPORT_FETCH_BATCH', 2)
+    with baseline_app.app_context():
+        chunks = list(iter_csv('raw'))
+        p01 = list(csv.reader(io.StringIO(''.join(iter_csv('raw', date(2026, 1, 6), None, ['P01'])))))
+    assert len(chunks) == len(RAW_ROWS) // 2 + 1  # un bloc par lot, plus le dernier (vide ici)
+    rows = list(csv.reader(io.StringIO(''.join(chunks))))
+    header = export_columns('raw')
+    assert rows[0] == header
+    assert len(rows) == len(RAW_ROWS) + 1
+    dates = [r[header.index('date_heure')] for r in rows[1:]]
+    assert dates == sorted(dates) and dates[0] == '2026-01-05T08:00:00'
+    # filtre machine sur la valeur normalisée : « P01 » et « P01  » ; filtre de date inclusif
+    assert [(r[header.index('parc')], r[header.index('quantite')]) for r in p01[1:]] == [('P01', '40.0'), ('P01 ', '45.0')]
+
+
+def test_parquet_export_readable(baseline_app, monkeypatch):
+    pq = pytest.importorskip('pyarrow.parquet')
+    monkeypatch.setattr(exports, 'PARQUET_ROW_GROUP', 4)
+    out = io.BytesIO()
+    with baseline_app.app_context():
+        write_parquet(out, 'raw')
+        anomalies = io.BytesIO()
+        write_parquet(anomalies, 'anomalies', machines=['E02'])
+    table = pq.read_table(io.BytesIO(out.getvalue()))
+    assert table.column_names == export_columns('raw')
+    assert table.num_rows == len(RAW_ROWS)
+    assert pq.ParquetFile(io.BytesIO(out.getvalue())).num_row_groups == 2
+    assert sorted(table.column('quantite').to_pylist()) == sorted(r[4] for r in RAW_ROWS)
+    assert set(pq.read_table(io.BytesIO(anomalies.getvalue())).column('machine').to_pylist()) <= {'E02'}
+
+
+def test_excel_report_stream(baseline_app):
+    openpyxl = pytest.importorskip('openpyxl')
+    with baseline_app.test_request_context():
+        data = b''.join(iter_excel_report())
+    wb = openpyxl.load_workbook(io.BytesIO(data), read_only=True)
+    assert wb.sheetnames[:2] == ['Par machine', 'Par personne'] and wb.sheetnames[-1] == 'Relevés'
+    releves = list(wb['Relevés'].iter_rows(values_only=True))
+    assert len(releves) == len(RAW_ROWS) + 1
+    machines = {r[0]: r[1:] for r in list(wb['Par machine'].iter_rows(values_only=True))[1:]}
+    assert machines['P01'] == (135.0, 3) and machines['E02'] == (55.0, 3)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+"""Indicateurs : réduction des points (LTTB + extrêmes), regroupement des petites séries."""
+from datetime import datetime
+
+from database import db, RawData, bump_data_version
+from dimensions import assign_dimension_ids, rebuild_dimensions
+from indicators import AUTRES_SERIE, _downsample_indices, _lttb_indices, get_indicator_columnar
+from processor import process_all_machines
+
+
+def test_lttb_keeps_endpoints_and_budget():
+    ys = [float(i % 7) for i in range(500)]
+    idx = _lttb_indices(list(range(500)), ys, 50)
+    assert len(idx) == 50 and idx[0] == 0 and idx[-1] == 499
+    assert idx == sorted(set(idx))
+
+
+def test_downsample_keeps_largest_spikes_when_extremes_exceed_budget():
+    n, max_points = 1000, 100
+    labels = [str(i) for i in range(n)]
+    series = []
+    for k in range(300):  # une pointe par série, de plus en plus haute : 300 extrêmes pour 50 places
+        data = [1.0] * n
+        data[3 * k + 1] = 10.0 + k
+        series.append(data)
+    idx = _downsample_indices(labels, series, max_points)
+    assert len(idx) <= max_points
+    largest = {3 * k + 1 for k in range(300 - max_points // 2, 300)}
+    assert largest <= set(idx)
+
+
+def test_downsample_keeps_every_extreme_within_budget():
+    n = 365
+    labels = [str(i) for i in range(n)]
+    data = [5.0] * n
+    data[100], data[250] = 80.0, -3.0
+    idx = _downsample_indices(labels, [data], 20)
+    assert {0, 100, 250, n - 1} <= set(idx) and len(idx) <= 20
+
+
+def _by_serie(col):
+    """{(série, métrique): valeurs} depuis les libellés « série - métrique »."""
+    return {tuple(meta['label'].split(' - ', 1)): values for meta, values in zip(col['series'], col['values'])}
+
+
+def test_top_n_folds_small_series_into_autres(baseline_app):
+    with baseline_app.app_context():
+        # deux petites personnes (12 et 10) derrière DUPONT (115) et MARTIN (75)
+        rows = [RawData(date_heure=datetime(2026, 1, d, 10), parc='T03', personne=personne, produit='GNR',
+                        quantite=q, compteur=10.0 * d, unite='Km', cuve_num=1)
+                for personne, d, q in (('BERNARD', 5, 5.0), ('BERNARD', 6, 7.0), ('PETIT', 6, 8.0), ('PETIT', 7, 2.0))]
+        assign_dimension_ids(rows)
+        db.session.add_all(rows)
+        db.session.commit()
+        rebuild_dimensions()
+        process_all_machines()
+        bump_data_version()
+
+        args = ('date', 'jour', [{'metric': 'quantite', 'agg': 'sum'}, {'metric': 'quantite', 'agg': 'max'}], 'personne')
+        full = get_indicator_columnar(*args)
+        folded = get_indicator_columnar(*args, top_n=2)
+
+    assert folded['labels'] == full['labels'] == ['2026-01-05', '2026-01-06', '2026-01-07']
+    full, folded = _by_serie(full), _by_serie(folded)
+    assert sorted({s for s, _m in folded}) == sorted(['DUPONT', 'MARTIN', AUTRES_SERIE])
+    for key in [k for k in folded if k[0] != AUTRES_SERIE]:
+        assert folded[key] == full[key]
+    # sommes additionnées, maxima comparés : les totaux restent exacts
+    assert folded[(AUTRES_SERIE, 'quantite (sum)')] == [5.0, 15.0, 2.0]
+    assert folded[(AUTRES_SERIE, 'quantite (max)')] == [5.0, 8.0, 2.0]
+    assert sum(map(sum, (v for (s, m), v in folded.items() if m == 'quantite (sum)'))) == 115.0 + 75.0 + 22.0
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Migrations : mise à niveau d'une base au schéma d'origine, base neuve, reprise de la mise à niveau des données."""
+import subprocess
+import sys
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect
+
+from database import (
+    db, ANOMALIE_TYPE_CODES, SCHEMA_VERSION, Anomalie, DailyAggregate, DimParc, ProcessedData, RawData, User,
+    _migrate_anomalie_type_key, _migration_lock, _set_schema_version, get_schema_version,
+)
+
+from baseline import BASELINE_SCHEMA, OLDEST_SCHEMA, RAW_ROWS, baseline_db
+
+
+def _index_names(table):
+    return {ix['name'] for ix in inspect(db.engine).get_indexes(table)}
+
+
+@pytest.mark.parametrize('schema', [BASELINE_SCHEMA, OLDEST_SCHEMA], ids=['baseline', 'oldest'])
+def test_upgrade_from_baseline_schema(make_app, tmp_path, schema):
+    path = tmp_path / 'baseline.db'
+    baseline_db(path, schema)
+    app = make_app(path)
+    with app.app_context():
+        assert get_schema_version() == SCHEMA_VERSION
+        assert RawData.query.count() == len(RAW_ROWS)
+        assert RawData.query.filter(RawData.parc_id.is_(None) | RawData.quantite_conso.is_(None)).count() == 0
+        p01 = DimParc.query.filter_by(valeur='P01').one()
+        assert RawData.query.filter_by(parc_id=p01.id).count() == 3  # 'P01 ' normalisé comme à l'import
+        assert Anomalie.query.count() > 0
+        assert Anomalie.query.filter(Anomalie.type_key.is_(None) | Anomalie.machine_id.is_(None)).count() == 0
+        assert Anomalie.query.filter_by(machine_id=p01.id, threshold=1000).count() == 1
+        assert {c['name'] for c in inspect(db.engine).get_columns('user_anomalie_config')} >= {'produits_json'}
+        assert DailyAggregate.query.count() > 0
+        assert {'ix_raw_data_parc_id_date', 'ix_raw_data_personne_id_date'} <= _index_names('raw_data')
+        assert 'ix_anomalies_machine_id_date' in _index_names('anomalies')
+        assert User.query.filter_by(username='admin').count() == 1
+
+
+def test_fresh_database(make_app, tmp_path):
+    app = make_app(tmp_path / 'neuve.db')
+    with app.app_context():
+        assert get_schema_version() == SCHEMA_VERSION
+        assert set(db.metadata.tables) <= set(inspect(db.engine).get_table_names())
+        assert 'ix_anomalies_type_date' in _index_names('anomalies')
+        assert User.query.filter_by(username='admin').count() == 1
+        assert RawData.query.count() == 0
+
+
+def test_interrupted_data_upgrade_is_resumed(make_app, tmp_path):
+    path = tmp_path / 'baseline.db'
+    baseline_db(path)
+    app = make_app(path)
+    with app.app_context():
+        counts = (ProcessedData.query.count(), Anomalie.query.count(), DailyAggregate.query.count())
+        DailyAggregate.query.delete()  # mise à niveau des données interrompue avant le retraitement
+        db.session.commit()
+        with db.engine.connect() as conn:
+            _set_schema_version(conn, SCHEMA_VERSION - 1)
+    app = make_app(path)
+    with app.app_context():
+        assert get_schema_version() == SCHEMA_VERSION
+        assert (ProcessedData.query.count(), Anomalie.query.count(), DailyAggregate.query.count()) == counts
+
+
+def test_anomalie_type_key_step_matches_codes(make_app, tmp_path):
+    app = make_app(tmp_path / 'neuve.db')
+    labels = {
+        'Zero quantity': ('zero_quantity', None), 'Compteur decreased': ('compteur_decreased', None),
+        'Jump >500': ('jump', 500), 'Compteur zero': ('compteur_zero', None),
+        'Compteur identique malgré plein': ('compteur_identique', None),
+    }
+    with app.app_context():
+        for label in labels:
+            db.session.add(Anomalie(machine='P01', type_anomalie=label, date=datetime(2026, 1, 5)))
+        db.session.commit()
+        _migrate_anomalie_type_key(app)  # étape figée : ses codes doivent rester ceux de ANOMALIE_TYPE_CODES
+        db.session.expire_all()
+        for a in Anomalie.query.all():
+            type_key, threshold = labels[a.type_anomalie]
+            assert (a.type_key, a.threshold) == (ANOMALIE_TYPE_CODES[type_key], threshold)
+
+
+# Tente le verrou du fichier sans attendre ; --garder : le prend puis attend d'être tué
+_TRY_LOCK = """
+import fcntl, os, sys, time
+fd = os.open(sys.argv[1], os.O_CREAT | os.O_RDWR)
+try:
+    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+except BlockingIOError:
+    sys.exit(1)
+if len(sys.argv) > 2:
+    print('ok', flush=True)
+    time.sleep(60)
+"""
+
+
+def test_migration_lock_held_until_released_and_freed_by_dead_holder(make_app, tmp_path):
+    pytest.importorskip('fcntl')
+    path = tmp_path / 'verrou.db'
+    app = make_app(path)
+    lock = f"{path}.migration.lock"
+    with app.app_context():
+        with _migration_lock(app):
+            assert subprocess.run([sys.executable, '-c', _TRY_LOCK, lock]).returncode == 1
+        assert subprocess.run([sys.executable, '-c', _TRY_LOCK, lock]).returncode == 0
+        holder = subprocess.Popen([sys.executable, '-c', _TRY_LOCK, lock, '--garder'], stdout=subprocess.PIPE)
+        assert holder.stdout.readline().strip() == b'ok'
+        holder.kill()  # titulaire mort en pleine migration : le système libère le verrou
+        holder.wait()
+        with _migration_lock(app):
+            pass
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""Rapports : graphiques PDF (cache partagé), détails, pagination par clé."""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database import db, Anomalie, RawData
+from dimensions import assign_dimension_ids
+from reports import (_pdf_chart, decode_keyset_cursor, encode_keyset_cursor, get_anomalies_page,
+                     get_releves_page, render_pdf)
+
+SAME_TIME = datetime(2026, 1, 8, 8, 0)
+
+
+def test_pdf_chart_is_a_fresh_drawing_per_document(baseline_app):
+    by_month = {'2026-01': 135.5, '2026-02': 40.0}
+    with baseline_app.app_context():
+        first = _pdf_chart('machine', 'P01', by_month)
+        second = _pdf_chart('machine', 'P01', {})  # même clé : séries relues du cache
+        assert first is not second
+        assert second.contents[0].data == first.contents[0].data == [[135.5, 40.0]]
+        assert second.contents[0].categoryAxis.categoryNames == ['01/26', '02/26']
+
+
+def test_concurrent_pdf_reports(baseline_app):
+    def build(_i):
+        with baseline_app.app_context():
+            return render_pdf(decoupage='machine')
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        pdfs = list(pool.map(build, range(4)))
+    assert all(p.startswith(b'%PDF') for p in pdfs)
+    assert len({len(p) for p in pdfs}) == 1
+
+
+def _all_pages(fetch, limit):
+    """Parcourt toutes les pages : (ids dans l'ordre, nombre de pages)."""
+    ids, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = fetch(cursor, limit)
+        ids.extend(r.id for r in rows)
+        pages += 1
+        assert len(rows) <= limit
+        if cursor is None:
+            return ids, pages
+
+
+def test_keyset_cursor_round_trip():
+    assert decode_keyset_cursor(encode_keyset_cursor(SAME_TIME, 42)) == (SAME_TIME, 42)
+    for bad in (None, '', 'abc', '2026-01-08T08:00:00', '2026-13-40T00:00:00_1', '2026-01-08T08:00:00_x'):
+        assert decode_keyset_cursor(bad) is None
+
+
+def test_releves_pages_split_equal_timestamps(baseline_app):
+    with baseline_app.app_context():
+        rows = [RawData(date_heure=SAME_TIME, parc='P01', personne='DUPONT', produit='GNR', quantite=10.0,
+                        compteur=4000.0 + i, unite='Km', cuve_num=1) for i in range(5)]
+        assign_dimension_ids(rows)
+        db.session.add_all(rows)
+        db.session.commit()
+        same = sorted((r.id for r in rows), reverse=True)
+        expected = [r.id for r in RawData.query.filter(RawData.parc.in_(['P01', 'P01 '])).order_by(
+            RawData.date_heure.desc(), RawData.id.desc())]
+        assert expected[:5] == same and len(expected) == 8
+
+        for limit in (1, 2, 3, 5, 8):  # limites de page au milieu, au bord et après l'heure commune
+            ids, pages = _all_pages(lambda c, n: get_releves_page('machine', 'P01', cursor=c, limit=n), limit)
+            assert ids == expected
+            assert pages == -(-len(expected) // limit)  # pas de page vide en fin de liste
+
+        first, cursor = get_releves_page('machine', 'P01', limit=2)
+        assert cursor == encode_keyset_cursor(SAME_TIME, same[1])
+        assert [r.id for r in get_releves_page('machine', 'P01', cursor='invalide', limit=2)[0]] == \
+            [r.id for r in first]
+
+
+def test_anomalies_pages_split_equal_timestamps(baseline_app):
+    with baseline_app.app_context():
+        rows = [Anomalie(machine='P01', type_anomalie='Zero quantity', date=SAME_TIME) for _ in range(4)]
+        db.session.add_all(rows)
+        db.session.commit()
+        expected = [a.id for a in Anomalie.query.order_by(Anomalie.date.desc(), Anomalie.id.desc())]
+        assert expected[:4] == sorted((a.id for a in rows), reverse=True)
+
+        for limit in (1, 2, 3, 4):
+            ids, _pages = _all_pages(lambda c, n: get_anomalies_page(cursor=c, limit=n), limit)
+            assert ids == expected
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""Résumés fusionnables : quantiles (±1 %), valeurs distinctes (HyperLogLog), rapports de sommes."""
+import random
+
+import pytest
+
+from sketches import ExactDistinct, ExactQuantiles, HyperLogLog, QUANTILE_AGGS, QuantileSketch, RatioSum
+
+
+def _values(n, seed):
+    rng = random.Random(seed)
+    return [rng.lognormvariate(3, 1) for _ in range(n)] + [0.0] * 10 + [-rng.uniform(1, 50) for _ in range(50)]
+
+
+def _filled(cls, values):
+    s = cls()
+    for v in values:
+        s.add(v)
+    return s
+
+
+def test_quantile_sketch_within_relative_accuracy():
+    values = _values(20000, 1)
+    sketch, exact = _filled(QuantileSketch, values), _filled(ExactQuantiles, values)
+    assert sketch.count == exact.count == len(values)
+    for q in list(QUANTILE_AGGS.values()) + [0.0, 0.001, 0.25, 1.0]:
+        expected = exact.quantile(q)
+        assert sketch.quantile(q) == pytest.approx(expected, rel=QuantileSketch.RELATIVE_ACCURACY, abs=1e-9)
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_quantile_sketch_merge_and_json_round_trip():
+    a_values, b_values = _values(3000, 2), _values(5000, 3)
+    merged = _filled(QuantileSketch, a_values).merge(_filled(QuantileSketch, b_values))
+    whole = _filled(QuantileSketch, a_values + b_values)
+    assert (merged.pos, merged.neg, merged.zero, merged.count) == (whole.pos, whole.neg, whole.zero, whole.count)
+    restored = QuantileSketch.from_json(merged.to_json())
+    assert (restored.pos, restored.neg, restored.zero, restored.count) == (whole.pos, whole.neg, whole.zero, whole.count)
+    assert [restored.quantile(q) for q in QUANTILE_AGGS.values()] == [whole.quantile(q) for q in QUANTILE_AGGS.values()]
+    assert QuantileSketch.from_json(None).count == 0
+
+
+@pytest.mark.parametrize('n', [10, 1000, 50000])
+def test_hyperloglog_count_close_to_exact(n):
+    values = [f'P{i:05d}' for i in range(n)] * 2  # doublons : comptés une fois
+    hll, exact = _filled(HyperLogLog, values + [None, '']), _filled(ExactDistinct, values + [None, ''])
+    assert exact.count == n
+    assert abs(hll.count - n) <= max(1, 0.05 * n)
+
+
+def test_hyperloglog_merge_is_union_and_json_round_trip():
+    a = _filled(HyperLogLog, [f'A{i}' for i in range(4000)] + [f'C{i}' for i in range(2000)])
+    b = _filled(HyperLogLog, [f'B{i}' for i in range(4000)] + [f'C{i}' for i in range(2000)])
+    union = _filled(HyperLogLog, [f'{p}{i}' for p in 'AB' for i in range(4000)] + [f'C{i}' for i in range(2000)])
+    merged = HyperLogLog.from_json(a.to_json()).merge(HyperLogLog.from_json(b.to_json()))
+    assert merged.registers == union.registers
+    assert abs(merged.count - 10000) <= 500
+    assert HyperLogLog.from_json('').count == 0
+    # empreinte stable d'un processus à l'autre (résumés stockés en base)
+    assert HyperLogLog.hash_value('P01') == HyperLogLog.hash_value('P01') != HyperLogLog.hash_value('P02')
+
+
+def test_ratio_sum_is_weighted_mean():
+    a, b = RatioSum(), RatioSum()
+    for pair in ((50.0, 1000.0), (40.0, None), (None, 100.0), (30.0, 500.0)):
+        a.add(pair)
+    b.add((12.0, 100.0))
+    assert a.merge(b).value == pytest.approx(92.0 / 1600.0)
+    assert a.count == 1600.0
+    assert RatioSum().value is None